@@ -0,0 +1,846 @@
+'''
+the absorption ratio (AR, Kritzman, Li, Page and Rigobon, 2011): the share of the total variance of a set of
+asset returns (eg 50 industries) that is explained by the first fifth of its principal components, with the
+variances weighted exponentially over a trailing two year window. See the methodology tab of the systemic
+risk page (apps/systemic_risk.py).
+
+rebuild data/absorption_ratio.csv from a csv of daily returns (a date column and one column per asset) with
+
+    python -m apps.absorption_ratio data/industry_returns.csv data/absorption_ratio.csv
+
+and the daily refresh only appends the new dates of the returns csv to data/absorption_ratio.csv and
+data/ar_shift.csv, starting from the state of the covariance accumulator saved by the previous run (see
+CovarianceAccumulator). The first run with --state rebuilds both files and saves the state.
+
+    python -m apps.absorption_ratio data/industry_returns.csv data/absorption_ratio.csv \\
+        --shift-path data/ar_shift.csv --state data/absorption_ratio_state.npz
+'''
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# trailing window of daily returns (about two years of trading days), half-life of the exponential weights
+# and the fraction of the principal components in the numerator of the ratio
+WINDOW = 500
+HALF_LIFE = 250
+FRACTION = 0.2
+
+# AR shift: the windows of the short and long moving averages of the AR, and the AR shift beyond which a
+# shift counts as a signal (see calc_ar_shift())
+SHORT_WINDOW = 15
+LONG_WINDOW = 252
+SHIFT_THRESHOLD = 1.0
+
+# the eigenvalue solvers of rolling_absorption_ratio(): full decompositions of all the dates at once, or only
+# the leading eigenvalues, one date at a time (see TopEigenSolver)
+SOLVERS = ['eigh', 'lanczos', 'subspace']
+
+
+def calc_exponential_weights(num_obs, half_life):
+    '''
+    exponentially decaying weights for num_obs observations in date order, so that the weight halves every
+    half_life observations back from the most recent one (the last). The weights sum to 1.
+    '''
+
+    weights = 0.5 ** (np.arange(num_obs)[::-1] / half_life)
+
+    return weights / weights.sum()
+
+
+def normalize(X):
+    '''
+    standardize every column (feature) of X to zero mean and unit standard deviation
+    '''
+
+    return (X - X.mean(axis=0)) / X.std(axis=0)
+
+
+def calc_weighted_variance(x, weights):
+    '''
+    calc weighted variance of an array. Weights are used to calculate the weighted average mean
+    and weights are used to calculate the weighted average deviation of the observations from the
+    weighed average mean
+    '''
+
+    x = np.array(x)
+    weights = np.array(weights)
+    assert len(x) == len(weights), 'error: x {} and weights {} are of unequal lengths'.format(len(x), len(weights))
+
+    # calc deviation of each element from weighted mean
+    mean = (x * weights).sum()
+    sq_deviation = (x - mean) ** 2
+
+    # calc weighted average deviation
+    return (sq_deviation * weights).sum()
+
+
+def calc_weighted_covariance(X, weights):
+    '''
+    the weighted covariance matrix of the columns of X (observations in rows), with weights that sum to 1.
+    Every element on the diagonal is the calc_weighted_variance() of a column, and the weighted variance of
+    any linear combination X.dot(v) of the columns is v.dot(covariance).dot(v).
+
+    :return: [num_columns x num_columns] array
+    '''
+
+    deviations = X - weights.dot(X)
+
+    return (deviations * weights[:, np.newaxis]).T.dot(deviations)
+
+
+def absorption_ratio(df, half_life, check=False):
+    '''
+    calculate the sum of weighted variances of the principal components as a percentage of the total
+    weighted variance of the original data, for one window of returns (the reference implementation shown on
+    the methodology tab). The principal components are those of the unweighted covariance matrix, in the
+    order returned by np.linalg.eig.
+
+    the weighted variances of all the principal components are the diagonal of V' S V, with V the
+    eigenvectors and S the weighted covariance matrix of the features, so they come from one weighted
+    covariance matrix instead of one weighted variance per component.
+
+    :param df: returns in the columns and date as index, as dataframe
+    :half_life: the half-life to use that parameterizes the decay of exponential weights, as int
+    :param check: check that the total weighted variance of the PCs equals that of the original features
+    :return: the cumulative proportion of total variance for each pc, as numpy array
+    '''
+
+    # 1. transform X data
+    # data is in the form of observations in rows and features in columns
+    X = normalize(df.values)
+
+    # 2. calc covariance matrix (features in rows and obs in columns)
+    cov_matrix = np.cov(X.T)
+
+    # 3. eigen decomposition
+    values, vectors = np.linalg.eig(cov_matrix)
+
+    # 4. construct exponential weights and the weighted covariance matrix of the features
+    weights = calc_exponential_weights(num_obs=X.shape[0], half_life=half_life)
+    weighted_cov = calc_weighted_covariance(X, weights)
+
+    # 5. calculate the weighted variance of every principal component (the pcs are X.dot(vectors)),
+    # diag(vectors' weighted_cov vectors)
+    pc_variances = (vectors * weighted_cov.dot(vectors)).sum(axis=0)
+
+    explanatory_power = pc_variances / pc_variances.sum()
+    cum_explanatory_power = explanatory_power.cumsum()
+
+    # 6. diagnostic: check that the total weighted variance of original features (one calc_weighted_variance()
+    # per feature, independently of the weighted covariance matrix) is equal to the total weighted variance of
+    # the PCs
+    if check:
+        feature_variances = np.array([calc_weighted_variance(X[:, i], weights) for i in range(X.shape[1])])
+
+        assert np.isclose(pc_variances.sum(), feature_variances.sum(), 0.00001), \
+            'error: pc variance {} does not equal feature variance {}'.format(pc_variances.sum(),
+                                                                            feature_variances.sum())
+
+    return cum_explanatory_power
+
+
+def num_components(num_assets, fraction=FRACTION):
+    '''
+    the number of principal components in the numerator of the absorption ratio (10 for 50 industries)
+    '''
+
+    return max(1, int(round(fraction * num_assets)))
+
+
+def windowed_sums(x, window, decay):
+    '''
+    exponentially weighted sums over a trailing window for every row of x,
+
+        s_t = x_t + decay * x_(t-1) + ... + decay^(window-1) * x_(t-window+1)
+
+    evaluated for all rows at once as a first order filter along the rows, minus the part of the filter that
+    is older than the window (rows before the start of x count as zero)
+    '''
+
+    # scipy.signal is slow to import and only needed for a full rebuild, not for the daily refresh
+    import scipy.signal
+
+    sums = scipy.signal.lfilter([1.0], [1.0, -decay], x, axis=0)
+    sums[window:] -= decay ** window * sums[:-window]
+
+    return sums
+
+
+def rolling_covariances(returns, start, stop, window=WINDOW, half_life=HALF_LIFE):
+    '''
+    the exponentially weighted covariance matrices of the normalized returns (see normalize()) over the
+    trailing window of every date (row) from start to stop, with the weights of calc_exponential_weights()
+
+    the weighted sums of the returns and of their outer products (the upper triangle only, the matrices are
+    symmetric) are built for all the dates at once (see windowed_sums()), and the normalization of every
+    window only rescales its covariance matrix by the standard deviations of the window.
+
+    :param returns: [num_dates x num_assets] array
+    :return: [stop - start x num_assets x num_assets] array
+    '''
+
+    assert start >= window - 1, 'error: the first {} dates do not have a full window'.format(window - 1)
+
+    num_assets = returns.shape[1]
+    x = returns[start - window + 1:stop]
+
+    # weighted sums of the returns and of their outer products, for the dates start to stop
+    decay = 0.5 ** (1.0 / half_life)
+    total_weight = (1.0 - decay ** window) / (1.0 - decay)
+
+    rows, columns = np.triu_indices(num_assets)
+    second_moments = windowed_sums(x[:, rows] * x[:, columns], window, decay)[window - 1:]
+    second_moments /= total_weight
+    means = windowed_sums(x, window, decay)[window - 1:] / total_weight
+
+    # the position of every element of the full matrix in the upper triangle
+    position = np.empty((num_assets, num_assets), dtype=np.int64)
+    position[rows, columns] = np.arange(len(rows))
+    position[columns, rows] = np.arange(len(rows))
+
+    covariances = np.take(second_moments, position.ravel(), axis=1).reshape(-1, num_assets, num_assets)
+    covariances -= means[:, :, np.newaxis] * means[:, np.newaxis, :]
+
+    # unweighted standard deviation of every asset over every window
+    cumulative = np.concatenate([np.zeros((1, num_assets)), np.cumsum(x, axis=0)])
+    cumulative_squares = np.concatenate([np.zeros((1, num_assets)), np.cumsum(x * x, axis=0)])
+    window_means = (cumulative[window:] - cumulative[:-window]) / window
+    window_variances = (cumulative_squares[window:] - cumulative_squares[:-window]) / window - window_means ** 2
+    stdevs = np.sqrt(window_variances)
+
+    covariances /= stdevs[:, :, np.newaxis] * stdevs[:, np.newaxis, :]
+
+    return covariances
+
+
+def rolling_absorption_ratio(returns, window=WINDOW, half_life=HALF_LIFE, fraction=FRACTION, chunk_size=2000,
+                             solver='eigh', **solver_options):
+    '''
+    the absorption ratio on every date: the sum of the largest num_components() eigenvalues of the
+    exponentially weighted covariance matrix of the trailing window of normalized returns, divided by its
+    trace (the total weighted variance). The eigenvalues are the weighted variances of the principal
+    components of the weighted covariance matrix.
+
+    with solver 'eigh', the dates are processed in chunks of chunk_size: the covariance matrices of a chunk
+    are built as one stacked array (see rolling_covariances()) and their eigenvalues are calculated with one
+    batched call. This is the fastest for a few dozen assets.
+
+    with solver 'lanczos' or 'subspace', the covariance matrix is updated one date at a time (see
+    CovarianceAccumulator) and only the leading eigenvalues are calculated, warm-started from the eigenvectors
+    of the previous date (see TopEigenSolver, which takes solver_options). This avoids the O(num_assets^3)
+    full decompositions and the stacked matrices of a chunk, for universes of hundreds or thousands of assets.
+
+    :param returns: [num_dates x num_assets] array, or a dataframe with the dates as index
+    :return: array of size [num_dates] (nan for the first window - 1 dates)
+    '''
+
+    assert solver in SOLVERS, 'error: unknown solver {}'.format(solver)
+
+    returns = np.asarray(returns, dtype=float)
+    assert not np.isnan(returns).any(), 'error: the returns have missing values'
+
+    num_dates, num_assets = returns.shape
+    k = num_components(num_assets, fraction)
+
+    ratios = np.full(num_dates, np.nan)
+
+    if solver != 'eigh':
+
+        top_eigenvalues = TopEigenSolver(k, method=solver, **solver_options)
+        accumulator = CovarianceAccumulator.from_returns(returns[:window - 1], window=window, half_life=half_life)
+
+        for t in range(window - 1, num_dates):
+            accumulator.update(returns[t])
+            ratios[t] = accumulator.ratio(fraction, top_eigenvalues)
+
+        return ratios
+
+    for start in range(window - 1, num_dates, chunk_size):
+        stop = min(start + chunk_size, num_dates)
+
+        covariances = rolling_covariances(returns, start, stop, window, half_life)
+        eigenvalues = np.linalg.eigvalsh(covariances)
+
+        # eigenvalues are in ascending order
+        ratios[start:stop] = eigenvalues[:, -k:].sum(axis=1) / np.einsum('tii->t', covariances)
+
+    return ratios
+
+
+def absorption_ratio_frame(df, window=WINDOW, half_life=HALF_LIFE, fraction=FRACTION, solver='eigh'):
+    '''
+    the absorption ratio of a dataframe of daily returns (dates as index, one column per asset), in the
+    format of data/absorption_ratio.csv
+
+    :return: dataframe with columns date and ar, from the first date with a full window
+    '''
+
+    ar = pd.DataFrame({'date': df.index,
+                       'ar': rolling_absorption_ratio(df.values, window, half_life, fraction, solver=solver)})
+
+    return ar.iloc[window - 1:].reset_index(drop=True)
+
+
+def rolling_moments(x, window):
+    '''
+    the mean and the standard deviation (ddof 1) of the trailing window of every value of x, calculated in two
+    passes over every window (its mean, then the squared deviations from it) rather than with the running sums
+    of pandas' rolling(), whose standard deviation drifts up to 1e-13 from the two-pass one. Both are nan for
+    the first window - 1 values.
+
+    :param x: 1-d array
+    :return: the means and the standard deviations, as two arrays of the length of x
+    '''
+
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    means = np.full(len(x), np.nan)
+    stdevs = np.full(len(x), np.nan)
+
+    if len(x) >= window:
+        windows = np.lib.stride_tricks.as_strided(x, shape=(len(x) - window + 1, window),
+                                                  strides=(x.strides[0], x.strides[0]), writeable=False)
+        means[window - 1:] = windows.mean(axis=1)
+        deviations = windows - means[window - 1:, np.newaxis]
+        stdevs[window - 1:] = np.sqrt((deviations * deviations).sum(axis=1) / (window - 1))
+
+    return means, stdevs
+
+
+def calc_ar_shift(df, threshold=SHIFT_THRESHOLD):
+    '''
+    calculate AR Shift, a z-score that indicates rapidly rising or falling systemic risk: the 15 day moving
+    average of the AR minus its 252 day moving average, in 252 day standard deviations. The action is 1 on the
+    days the AR shift rises to threshold or above, -1 on the days it falls to -threshold or below (and 0
+    otherwise), in the format of data/ar_shift.csv
+
+    the moving averages and the standard deviation are two-pass (see rolling_moments()): the standard
+    deviation can be as small as 0.003, so the error of a running sum standard deviation is magnified in the
+    AR shift (up to 5e-11 with pandas' rolling().std())
+
+    :param df: data with columns date and ar, as dataframe
+    :return: dataframe with columns date, ar, avg_15, avg_252, std_252, ar_shift and action
+    '''
+
+    df = df[['date', 'ar']].reset_index(drop=True)
+
+    df['avg_15'] = rolling_moments(df['ar'].values, SHORT_WINDOW)[0]
+    df['avg_252'], df['std_252'] = rolling_moments(df['ar'].values, LONG_WINDOW)
+    df['ar_shift'] = (df['avg_15'] - df['avg_252']) / df['std_252']
+
+    previous = df['ar_shift'].shift(1).fillna(0)
+    df['action'] = np.where((df['ar_shift'] >= threshold) & (previous < threshold), 1,
+                            np.where((df['ar_shift'] <= -threshold) & (previous > -threshold), -1, 0))
+
+    return df
+
+
+class RollingMoments:
+    '''
+    the mean and the standard deviation (ddof 1, as pandas' rolling().std()) of the last window values of a
+    stream, updated in O(1) per value: the values of the window are kept in a ring buffer, their sum is
+    updated with Kahan (compensated) summation, and the sum of squared deviations from the mean with the
+    sliding window form of Welford's update. Both are nan until the window is full, as with pandas.
+    '''
+
+    def __init__(self, window):
+
+        self.window = window
+        self.values = [0.0] * window
+        self.position = 0
+        self.count = 0
+
+        # the sum of the values in the window and its compensation, and the sum of squared deviations
+        self.total = 0.0
+        self.compensation = 0.0
+        self.m2 = 0.0
+
+    def _add(self, x):
+
+        y = x - self.compensation
+        total = self.total + y
+        self.compensation = (total - self.total) - y
+        self.total = total
+
+    def update(self, x):
+
+        x = float(x)
+        old = self.values[self.position]
+        previous_mean = self.total / min(self.count, self.window) if self.count else 0.0
+
+        self._add(x)
+        if self.count >= self.window:
+            self._add(-old)
+            mean = self.total / self.window
+            self.m2 += (x - old) * (x - mean + old - previous_mean)
+        else:
+            mean = self.total / (self.count + 1)
+            self.m2 += (x - previous_mean) * (x - mean)
+        self.m2 = max(self.m2, 0.0)
+
+        self.values[self.position] = x
+        self.position = (self.position + 1) % self.window
+        self.count += 1
+
+    def mean(self):
+        return self.total / self.window if self.count >= self.window else np.nan
+
+    def std(self):
+        return np.sqrt(self.m2 / (self.window - 1)) if self.count >= self.window else np.nan
+
+    def state(self, prefix):
+
+        return {prefix + 'values': np.array(self.values), prefix + 'position': self.position,
+                prefix + 'count': self.count, prefix + 'total': self.total,
+                prefix + 'compensation': self.compensation, prefix + 'm2': self.m2}
+
+    @classmethod
+    def from_state(cls, state, prefix):
+
+        moments = cls(len(state[prefix + 'values']))
+        moments.values = [float(x) for x in state[prefix + 'values']]
+        moments.position = int(state[prefix + 'position'])
+        moments.count = int(state[prefix + 'count'])
+        moments.total = float(state[prefix + 'total'])
+        moments.compensation = float(state[prefix + 'compensation'])
+        moments.m2 = float(state[prefix + 'm2'])
+
+        return moments
+
+
+class ARShiftCalculator:
+    '''
+    the AR shift of calc_ar_shift(), one new AR value at a time: every value updates the 15 and 252 day
+    moving averages, the 252 day standard deviation, the AR shift and the action in O(1) (see RollingMoments),
+    instead of recalculating the rolling windows over the whole history.
+
+    on the AR history of data/ar_shift.csv the averages, the standard deviation and the AR shift match
+    calc_ar_shift() to 1e-12 (see benchmarks/absorption_ratio.py, which checks it).
+    '''
+
+    def __init__(self, threshold=SHIFT_THRESHOLD):
+
+        self.threshold = threshold
+        self.short = RollingMoments(SHORT_WINDOW)
+        self.long = RollingMoments(LONG_WINDOW)
+        self.previous_shift = np.nan
+
+    def update(self, ar):
+        '''
+        :return: a dictionary with ar, avg_15, avg_252, std_252, ar_shift and action (as the columns of
+        calc_ar_shift())
+        '''
+
+        self.short.update(ar)
+        self.long.update(ar)
+
+        avg_15, avg_252, std_252 = self.short.mean(), self.long.mean(), self.long.std()
+        ar_shift = (avg_15 - avg_252) / std_252 if std_252 > 0 else np.nan
+
+        previous = 0.0 if np.isnan(self.previous_shift) else self.previous_shift
+        if ar_shift >= self.threshold and previous < self.threshold:
+            action = 1
+        elif ar_shift <= -self.threshold and previous > -self.threshold:
+            action = -1
+        else:
+            action = 0
+        self.previous_shift = ar_shift
+
+        return {'ar': ar, 'avg_15': avg_15, 'avg_252': avg_252, 'std_252': std_252, 'ar_shift': ar_shift,
+                'action': action}
+
+    def state(self):
+
+        return dict(self.short.state('short_'), threshold=self.threshold, previous_shift=self.previous_shift,
+                    **self.long.state('long_'))
+
+    @classmethod
+    def from_state(cls, state):
+
+        calculator = cls(float(state['threshold']))
+        calculator.short = RollingMoments.from_state(state, 'short_')
+        calculator.long = RollingMoments.from_state(state, 'long_')
+        calculator.previous_shift = float(state['previous_shift'])
+
+        return calculator
+
+
+class TopEigenSolver:
+    '''
+    the k largest eigenvalues of a sequence of symmetric matrices that change slowly, eg the covariance
+    matrices of consecutive dates. The absorption ratio only needs the sum of the leading eigenvalues (and the
+    trace), so there is no need for a full decomposition, which costs O(num_assets^3) per date.
+
+    method is 'lanczos' (scipy.sparse.linalg.eigsh, ARPACK's implicitly restarted Lanczos method) or
+    'subspace' (block subspace iteration with a Rayleigh-Ritz step, on a block of k + oversampling vectors).
+    Both start from the leading eigenvectors of the previous matrix: subspace iteration starts from the whole
+    block (random for the first matrix), and Lanczos from the sum of the previous eigenvectors. Subspace
+    iteration stops once the estimated error of the sum of the leading k Ritz values is below tol times the
+    trace (Lanczos passes tol to eigsh, as the relative accuracy of the eigenvalues).
+
+    iterations is the number of block iterations (or matrix-vector products for Lanczos) of the last call.
+    '''
+
+    def __init__(self, k, method='subspace', oversampling=10, tol=1e-10, max_iterations=100, seed=0):
+
+        assert method in ['lanczos', 'subspace'], 'error: unknown method {}'.format(method)
+
+        self.k = k
+        self.method = method
+        self.oversampling = oversampling
+        self.tol = tol
+        self.max_iterations = max_iterations
+        self.random_state = np.random.RandomState(seed)
+        self.vectors = None
+        self.iterations = 0
+
+    def __call__(self, matrix):
+        '''
+        :return: the k largest eigenvalues of matrix, in ascending order (as np.linalg.eigvalsh)
+        '''
+
+        if self.method == 'lanczos':
+            return self._lanczos(matrix)
+
+        return self._subspace(matrix)
+
+    def _lanczos(self, matrix):
+
+        # scipy.sparse is slow to import and only needed for this method
+        import scipy.sparse.linalg
+
+        start = None if self.vectors is None else self.vectors.sum(axis=1)
+
+        operator = scipy.sparse.linalg.aslinearoperator(matrix)
+        counter = {'matvecs': 0}
+
+        def matvec(v):
+            counter['matvecs'] += 1
+            return operator.matvec(v)
+
+        counted = scipy.sparse.linalg.LinearOperator(matrix.shape, matvec=matvec, dtype=matrix.dtype)
+        values, self.vectors = scipy.sparse.linalg.eigsh(counted, k=self.k, which='LA', v0=start, tol=self.tol,
+                                                         maxiter=self.max_iterations * matrix.shape[0])
+        self.iterations = counter['matvecs']
+
+        order = np.argsort(values)
+
+        return values[order]
+
+    def _subspace(self, matrix):
+
+        num_assets = matrix.shape[0]
+        block_size = min(self.k + self.oversampling, num_assets)
+        tolerance = self.tol * np.trace(matrix)
+
+        if self.vectors is None or self.vectors.shape != (num_assets, block_size):
+            vectors = np.linalg.qr(self.random_state.standard_normal((num_assets, block_size)))[0]
+        else:
+            vectors = self.vectors
+
+        def rayleigh_ritz(vectors):
+            # the eigenvalues of the matrix restricted to the span of vectors (orthonormal columns), and the
+            # matching rotation of vectors (and of their images) to approximate eigenvectors
+            images = matrix.dot(vectors)
+            values, rotation = np.linalg.eigh(vectors.T.dot(images))
+            return values, vectors.dot(rotation), images.dot(rotation)
+
+        values, vectors, images = rayleigh_ritz(vectors)
+        total = values[-self.k:].sum()
+        change = np.inf
+
+        for i in range(self.max_iterations):
+
+            values, vectors, images = rayleigh_ritz(np.linalg.qr(images)[0])
+            previous, total = total, values[-self.k:].sum()
+            previous_change, change = change, total - previous
+
+            # the sum of the Ritz values increases to the sum of the eigenvalues, by changes that shrink
+            # geometrically (at a rate estimated from the last two), so the error is about the rest of the
+            # geometric series
+            if change <= 0 or (i > 0 and change * change <= tolerance * max(previous_change - change, 0)):
+                break
+
+        self.vectors = vectors
+        self.iterations = i + 1
+
+        return values[-self.k:]
+
+
+class CovarianceAccumulator:
+    '''
+    the exponentially weighted covariance matrix of the trailing window of normalized returns (as in
+    rolling_covariances()), updated one day at a time.
+
+    the accumulator keeps the exponentially weighted sums of the returns and of their outer products over the
+    window (with the weights of calc_exponential_weights(), before dividing by their total), the plain sums of
+    the returns and of their squares (for the standard deviations of the window) and the returns of the window
+    in a ring buffer. A new day decays the weighted sums, adds the new returns and removes the returns that
+    leave the window, a rank-one update and downdate of O(num_assets^2), so the covariance matrix of the next
+    day never needs the rest of the window. Rounding errors in the weighted sums decay with the weights (the AR
+    stays within about 1e-15 of rolling_absorption_ratio() over thousands of updates).
+
+    state() and from_state() convert the accumulator (including the date of the last day added) to and from a
+    dictionary of arrays, to be saved to disk with save_state().
+    '''
+
+    def __init__(self, num_assets, window=WINDOW, half_life=HALF_LIFE):
+
+        self.window = window
+        self.half_life = half_life
+        self.decay = 0.5 ** (1.0 / half_life)
+        self.total_weight = (1.0 - self.decay ** window) / (1.0 - self.decay)
+
+        # the returns of the window, the oldest at position once the window is full
+        self.buffer = np.zeros((window, num_assets))
+        self.position = 0
+        self.count = 0
+        self.last_date = None
+
+        self.weighted_sums = np.zeros(num_assets)
+        self.weighted_outer = np.zeros((num_assets, num_assets))
+        self.sums = np.zeros(num_assets)
+        self.sum_squares = np.zeros(num_assets)
+
+    @classmethod
+    def from_returns(cls, returns, dates=None, window=WINDOW, half_life=HALF_LIFE):
+        '''
+        an accumulator at the last day of returns ([num_dates x num_assets] array, or dataframe with the dates
+        as index), built from the last window days at once
+        '''
+
+        if isinstance(returns, pd.DataFrame):
+            dates = returns.index
+        returns = np.asarray(returns, dtype=float)
+
+        accumulator = cls(returns.shape[1], window, half_life)
+
+        x = returns[-window:]
+        weights = accumulator.decay ** np.arange(len(x))[::-1]
+
+        accumulator.buffer[:len(x)] = x
+        accumulator.position = len(x) % window
+        accumulator.count = len(returns)
+        accumulator.weighted_sums = weights.dot(x)
+        accumulator.weighted_outer = (x * weights[:, np.newaxis]).T.dot(x)
+        accumulator.sums = x.sum(axis=0)
+        accumulator.sum_squares = (x * x).sum(axis=0)
+
+        if dates is not None:
+            accumulator.last_date = pd.Timestamp(dates[-1])
+
+        return accumulator
+
+    def update(self, x, date=None):
+        '''
+        add the returns of a new day (array of size [num_assets]), after the last day added
+        '''
+
+        x = np.asarray(x, dtype=float)
+        assert not np.isnan(x).any(), 'error: the returns on {} have missing values'.format(date)
+        if date is not None:
+            date = pd.Timestamp(date)
+            assert self.last_date is None or date > self.last_date, \
+                'error: {} is not after the last date {}'.format(date.date(), self.last_date.date())
+
+        # the returns that leave the window (zeros until the window is full)
+        old = self.buffer[self.position]
+        old_weight = self.decay ** self.window
+
+        # decay, then add the new outer product and remove the old one with one rank-two product
+        vectors = np.array([x, old])
+        self.weighted_outer *= self.decay
+        self.weighted_outer += (vectors.T * [1.0, -old_weight]).dot(vectors)
+
+        self.weighted_sums = self.decay * self.weighted_sums + x - old_weight * old
+        self.sums += x - old
+        self.sum_squares += x * x - old * old
+
+        self.buffer[self.position] = x
+        self.position = (self.position + 1) % self.window
+        self.count += 1
+        self.last_date = date
+
+    def covariance(self):
+        '''
+        :return: the [num_assets x num_assets] weighted covariance matrix of the normalized returns of the
+        window (the same matrix as rolling_covariances() for the last day added)
+        '''
+
+        assert self.count >= self.window, \
+            'error: {} days added, the window has {} days'.format(self.count, self.window)
+
+        window_means = self.sums / self.window
+        stdevs = np.sqrt(self.sum_squares / self.window - window_means ** 2)
+
+        # (weighted_outer / total_weight - means means') / (stdevs stdevs'), with as few temporary
+        # [num_assets x num_assets] arrays as possible
+        means = self.weighted_sums / self.total_weight / stdevs
+        covariance = self.weighted_outer * np.outer(1.0 / (self.total_weight * stdevs), 1.0 / stdevs)
+        covariance -= np.outer(means, means)
+
+        return covariance
+
+    def ratio(self, fraction=FRACTION, solver=None):
+        '''
+        :param solver: a TopEigenSolver for the leading eigenvalues (for num_components() eigenvalues), or None
+            for a full decomposition
+        :return: the absorption ratio of the last day added
+        '''
+
+        covariance = self.covariance()
+        k = num_components(covariance.shape[0], fraction)
+
+        if solver is None:
+            eigenvalues = np.linalg.eigvalsh(covariance)
+        else:
+            assert solver.k == k, 'error: the solver finds {} eigenvalues, the ratio needs {}'.format(solver.k, k)
+            eigenvalues = solver(covariance)
+
+        return eigenvalues[-k:].sum() / np.trace(covariance)
+
+    def state(self):
+        '''
+        :return: the state of the accumulator as a dictionary of arrays (see save_state())
+        '''
+
+        return {'window': self.window,
+                'half_life': self.half_life,
+                'buffer': self.buffer,
+                'position': self.position,
+                'count': self.count,
+                'last_date': '' if self.last_date is None else self.last_date.isoformat(),
+                'weighted_sums': self.weighted_sums,
+                'weighted_outer': self.weighted_outer,
+                'sums': self.sums,
+                'sum_squares': self.sum_squares}
+
+    @classmethod
+    def from_state(cls, state):
+
+        accumulator = cls(state['buffer'].shape[1], int(state['window']), float(state['half_life']))
+        accumulator.buffer = np.array(state['buffer'])
+        accumulator.position = int(state['position'])
+        accumulator.count = int(state['count'])
+        accumulator.weighted_sums = np.array(state['weighted_sums'])
+        accumulator.weighted_outer = np.array(state['weighted_outer'])
+        accumulator.sums = np.array(state['sums'])
+        accumulator.sum_squares = np.array(state['sum_squares'])
+        if str(state['last_date']):
+            accumulator.last_date = pd.Timestamp(str(state['last_date']))
+
+        return accumulator
+
+
+def save_state(path, **arrays):
+    '''
+    save arrays to an npz file, written to a temporary file first so that the previous state stays intact if
+    the write fails
+    '''
+
+    temp_path = '{}.{}.tmp.npz'.format(os.path.splitext(path)[0], os.getpid())
+    np.savez(temp_path, **arrays)
+    os.replace(temp_path, path)
+
+
+def load_state(path):
+
+    with np.load(path) as state:
+        return {key: state[key] for key in state.files}
+
+
+def refresh_state(returns, ar, window=WINDOW, half_life=HALF_LIFE):
+    '''
+    the state of the daily refresh at the last date of returns (see refresh()): the covariance accumulator,
+    the AR shift calculator and the number of dates with an AR
+
+    :param ar: the absorption ratio up to the same date, as returned by absorption_ratio_frame()
+    '''
+
+    accumulator = CovarianceAccumulator.from_returns(returns, window=window, half_life=half_life)
+
+    calculator = ARShiftCalculator()
+    for ratio in ar['ar']:
+        calculator.update(ratio)
+
+    return dict(accumulator.state(), num_ratios=len(ar), **calculator.state())
+
+
+def refresh(returns, ar_path, shift_path, state_path, fraction=FRACTION):
+    '''
+    append the absorption ratio (and the AR shift) of the dates of returns after the last date of the saved
+    state (see refresh_state()) to the csvs at ar_path and shift_path, and save the new state. returns (a
+    dataframe with the dates as index) only needs the new dates, and the csvs are only appended to.
+
+    :return: the number of dates appended
+    '''
+
+    state = load_state(state_path)
+    accumulator = CovarianceAccumulator.from_state(state)
+    calculator = ARShiftCalculator.from_state(state)
+    num_ratios = int(state['num_ratios'])
+
+    returns = returns[returns.index > accumulator.last_date]
+
+    if len(returns) == 0:
+        return 0
+
+    rows = []
+    for date, x in zip(returns.index, returns.values):
+        accumulator.update(x, date)
+        rows.append(dict(calculator.update(accumulator.ratio(fraction)), date=date))
+
+    new_shift = pd.DataFrame(rows, columns=['date', 'ar', 'avg_15', 'avg_252', 'std_252', 'ar_shift', 'action'],
+                             index=range(num_ratios, num_ratios + len(rows)))
+
+    new_shift[['date', 'ar']].to_csv(ar_path, mode='a', header=False, index=False, date_format='%Y-%m-%d')
+    if shift_path is not None:
+        new_shift.to_csv(shift_path, mode='a', header=False, date_format='%Y-%m-%d')
+
+    save_state(state_path, num_ratios=num_ratios + len(rows), **accumulator.state(), **calculator.state())
+
+    return len(returns)
+
+
+def load_returns(path):
+    '''
+    load daily returns from a csv with a date column and one column of returns per asset
+    '''
+
+    df = pd.read_csv(path, parse_dates=['date'])
+
+    return df.set_index('date').sort_index()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='calculate the absorption ratio from daily asset returns')
+    parser.add_argument('input_path')
+    parser.add_argument('output_path')
+    parser.add_argument('--window', type=int, default=WINDOW)
+    parser.add_argument('--half-life', type=float, default=HALF_LIFE)
+    parser.add_argument('--fraction', type=float, default=FRACTION)
+    parser.add_argument('--solver', choices=SOLVERS, default='eigh',
+                        help='lanczos or subspace for universes of hundreds of assets or more')
+    parser.add_argument('--shift-path', help='also write the AR shift (as data/ar_shift.csv) to this csv')
+    parser.add_argument('--state', help='the accumulator state file: append the new dates only if it exists, '
+                                        'else rebuild the csvs and save it')
+    args = parser.parse_args()
+
+    returns = load_returns(args.input_path)
+
+    if args.state is not None and os.path.exists(args.state):
+        num_dates = refresh(returns, args.output_path, args.shift_path, args.state, args.fraction)
+        print('appended the absorption ratio of {} dates to {}'.format(num_dates, args.output_path))
+
+    else:
+        ar = absorption_ratio_frame(returns, args.window, args.half_life, args.fraction, args.solver)
+        ar.to_csv(args.output_path, index=False, date_format='%Y-%m-%d')
+        if args.shift_path is not None:
+            calc_ar_shift(ar).to_csv(args.shift_path, date_format='%Y-%m-%d')
+        if args.state is not None:
+            save_state(args.state, **refresh_state(returns, ar, args.window, args.half_life))
+        print('wrote the absorption ratio of {} dates to {}'.format(len(ar), args.output_path))
@@ -0,0 +1,249 @@
+'''
+plan many households at once (eg overnight runs for advisors' clients).
+
+every household is planned on the same set of simulated market returns. The wealth recursion of a batch of
+households runs as one stacked [households x simulations] array operation per period, instead of calling
+financial_plan() once per household.
+
+    python -m apps.batch_planning households.csv results.csv --num-simulations 10000
+
+the input table needs the columns user_age, user_retirement_age, user_wealth, user_save and user_spend, and
+may have user_social_security_age and user_social_security_benefit (defaults as on the retirement page).
+'''
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from apps import functions as fn
+
+
+REQUIRED_COLUMNS = ['user_age', 'user_retirement_age', 'user_wealth', 'user_save', 'user_spend']
+DEFAULT_SOCIAL_SECURITY_AGE = 67
+DEFAULT_SOCIAL_SECURITY_BENEFIT = 18000
+
+# the statistics reported for every household
+RESULT_PERCENTILES = ['mean', 75, 50, 25, 5]
+
+
+def household_schedules(households, mortality_table):
+    '''
+    build the plan inputs of every household: the horizon (1% survival age), the index at retirement and
+    the contribution and allocation schedules, padded with zeros to the longest horizon
+
+    :return: a dictionary of arrays, one element (or row) per household
+    '''
+
+    if not isinstance(mortality_table, fn.SurvivalIndex):
+        mortality_table = fn.SurvivalIndex(mortality_table)
+
+    final_ages = mortality_table.horizon_ages(households['user_age'].to_numpy(), fn.SURVIVAL_THRESHOLDS['1%'])[:, 0]
+    age_lists = [mortality_table.survival_curve(user_age)[0].tolist() for user_age in households['user_age']]
+
+    num_periods = np.array(final_ages) - households['user_age'].to_numpy() + 1
+    max_periods = num_periods.max()
+
+    contributions = np.zeros((len(households), max_periods))
+    allocations = np.zeros((len(households), max_periods))
+
+    for h, household in enumerate(households.itertuples(index=False)):
+
+        contributions[h, :num_periods[h]] = fn.calc_contributions(user_age=household.user_age,
+                                                                  retirement_age=household.user_retirement_age,
+                                                                  final_age=final_ages[h],
+                                                                  user_save=household.user_save,
+                                                                  user_spend=household.user_spend,
+                                                                  user_social_security_age=household.user_social_security_age,
+                                                                  user_social_security_benefit=household.user_social_security_benefit)
+
+        allocations[h, :num_periods[h]] = fn.calc_asset_allocations(user_age=household.user_age,
+                                                                    retirement_age=household.user_retirement_age,
+                                                                    final_age=final_ages[h],
+                                                                    percent_at_retirement=0.6,
+                                                                    glide_length=10)
+
+    return {'final_age': np.array(final_ages),
+            'age_list': age_lists,
+            'num_periods': num_periods,
+            'idx_at_retirement': (households['user_retirement_age'] - households['user_age']).to_numpy(),
+            'contributions': contributions,
+            'allocations': allocations}
+
+
+def stacked_wealth_trajectories(starting_wealth, equity_returns, bond_returns, allocations, contributions):
+    '''
+    the calc_wealth_trajectory() recursion for a batch of households on shared market returns.
+
+    :param starting_wealth: [num_households] array
+    :param equity_returns: [num_simulations x num_periods] array, shared by all households
+    :param bond_returns: [num_periods] array, shared by all households
+    :param allocations: [num_households x num_periods] array
+    :param contributions: [num_households x num_periods] array
+    :return: [num_periods x num_households x num_simulations] array of wealth. The floating point operations
+    are the same as in calc_wealth_trajectory() so every household's wealths are identical to planning it
+    on its own.
+    '''
+
+    num_households, num_periods = allocations.shape
+    num_simulations = equity_returns.shape[0]
+
+    wealths = np.empty((num_periods, num_households, num_simulations))
+    scratch = np.empty((num_households, num_simulations))
+    current_wealths = np.broadcast_to(np.asarray(starting_wealth, dtype=np.float64)[:, np.newaxis],
+                                      (num_households, num_simulations))
+
+    for i in range(num_periods):
+
+        allocation_i = allocations[:, i, np.newaxis]
+
+        # wealths[i] = (wealth * equity growth) + (wealth * bond growth) + contribution
+        np.multiply(current_wealths, (1 + equity_returns[:, i]) * allocation_i, out=wealths[i])
+        np.multiply(current_wealths, (1 + bond_returns[i]) * (1.0 - allocation_i), out=scratch)
+        np.add(wealths[i], scratch, out=wealths[i])
+        np.add(wealths[i], contributions[:, i, np.newaxis], out=wealths[i])
+
+        current_wealths = wealths[i]
+
+    return wealths
+
+
+def summarize_batch(wealths, schedules, batch, growth_distributions):
+    '''
+    compute the results table rows of a batch of households from their stacked wealths
+    '''
+
+    percentiles = [p for p in RESULT_PERCENTILES if p != 'mean']
+    trajectories = dict(zip(percentiles, np.percentile(wealths, percentiles, axis=2)))
+    trajectories['mean'] = wealths.mean(axis=2)
+
+    rows = []
+    for j, h in enumerate(batch):
+
+        num_periods = schedules['num_periods'][h]
+        idx_at_retirement = schedules['idx_at_retirement'][h]
+        age_list = schedules['age_list'][h]
+
+        row = {'final_age': schedules['final_age'][h]}
+
+        for p in RESULT_PERCENTILES:
+            row['wealth_at_retirement_{}'.format(p)] = trajectories[p][idx_at_retirement, j]
+            row['wealth_at_end_{}'.format(p)] = trajectories[p][num_periods - 1, j]
+            row['age_at_negative_wealth_{}'.format(p)] = fn.get_age_at_negative_wealth(
+                trajectories[p][:num_periods, j], age_list)
+            row['rate_of_return_at_retirement_{}'.format(p)] = fn.calc_geometric_rate_of_return(
+                start_value=1, end_value=growth_distributions[p][idx_at_retirement - 1],
+                num_periods=idx_at_retirement - 1)
+
+        ruin_counts = np.bincount(fn.calc_first_ruin_index(wealths[:num_periods, j].T), minlength=num_periods + 1)
+        row['probability_of_success'] = fn.calc_ruin_analysis(ruin_counts, age_list)['probability_of_success']
+
+        rows.append(row)
+
+    return rows
+
+
+def plan_households(households, equity_returns, bond_returns, mortality_table, max_batch_bytes=512 * 1024 ** 2):
+    '''
+    plan every household in the households table on the same simulated market returns.
+
+    households are processed in batches sized so that the stacked wealth array of a batch stays under
+    max_batch_bytes.
+
+    :param households: dataframe with one household per row (see REQUIRED_COLUMNS)
+    :param equity_returns: [num_simulations x num_periods] array of simulated equity returns, with at least
+    as many periods as the longest household horizon
+    :param bond_returns: [num_periods] array of bond returns
+    :param mortality_table: the mortality table, or its precomputed fn.SurvivalIndex
+    :return: dataframe of results with the same index as households
+    '''
+
+    missing = [col for col in REQUIRED_COLUMNS if col not in households.columns]
+    assert not missing, 'error: households table is missing columns {}'.format(missing)
+
+    households = households.copy()
+    if 'user_social_security_age' not in households.columns:
+        households['user_social_security_age'] = DEFAULT_SOCIAL_SECURITY_AGE
+    if 'user_social_security_benefit' not in households.columns:
+        households['user_social_security_benefit'] = DEFAULT_SOCIAL_SECURITY_BENEFIT
+
+    schedules = household_schedules(households, mortality_table)
+    max_periods = schedules['contributions'].shape[1]
+    num_simulations = equity_returns.shape[0]
+
+    assert equity_returns.shape[1] >= max_periods, \
+        'error: the returns have {} periods, the households need {}'.format(equity_returns.shape[1], max_periods)
+
+    equity_returns = equity_returns[:, :max_periods]
+    bond_returns = np.asarray(bond_returns)[:max_periods]
+
+    # the distribution of cumulative market growth is the same for every household
+    growth_distributions = fn.wealth_distributions(np.cumprod(equity_returns[:, 1:] + 1, axis=1),
+                                                   percentiles=[p for p in RESULT_PERCENTILES if p != 'mean'])
+
+    batch_size = max(1, int(max_batch_bytes // (8 * max_periods * num_simulations)))
+
+    # batch households with similar horizons together so that each batch only simulates up to the
+    # longest horizon in the batch
+    order = np.argsort(schedules['num_periods'], kind='stable')
+
+    rows = {}
+    for start in range(0, len(households), batch_size):
+
+        batch = order[start:start + batch_size]
+        batch_periods = schedules['num_periods'][batch].max()
+
+        wealths = stacked_wealth_trajectories(starting_wealth=households['user_wealth'].to_numpy()[batch],
+                                              equity_returns=equity_returns[:, :batch_periods],
+                                              bond_returns=bond_returns[:batch_periods],
+                                              allocations=schedules['allocations'][batch, :batch_periods],
+                                              contributions=schedules['contributions'][batch, :batch_periods])
+        rows.update(zip(batch, summarize_batch(wealths, schedules, batch, growth_distributions)))
+
+    return pd.DataFrame([rows[h] for h in range(len(households))], index=households.index)
+
+
+def run_batch(input_path, output_path, num_simulations=10000, seed=0, max_batch_bytes=512 * 1024 ** 2):
+    '''
+    read a households csv, plan every household and write the results csv (the input columns followed by
+    the results)
+
+    :return: the number of households planned per second
+    '''
+
+    households = pd.read_csv(input_path)
+    mortality_table = fn.load_mortality_table()
+
+    start = time.perf_counter()
+
+    equity_returns = fn.random_walk_simulations(mean=0.08,
+                                                stdev=0.14,
+                                                periods=len(mortality_table),
+                                                num_simulations=num_simulations,
+                                                random_state=np.random.default_rng(seed))
+    bond_returns = np.full(len(mortality_table), fill_value=0.01)
+    bond_returns[0] = 0.0
+
+    results = plan_households(households, equity_returns, bond_returns, mortality_table, max_batch_bytes)
+
+    households_per_second = len(households) / (time.perf_counter() - start)
+
+    pd.concat([households, results], axis=1).to_csv(output_path, index=False)
+
+    return households_per_second
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='plan a table of households on shared simulated returns')
+    parser.add_argument('input_path')
+    parser.add_argument('output_path')
+    parser.add_argument('--num-simulations', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-batch-mb', type=int, default=512)
+    args = parser.parse_args()
+
+    households_per_second = run_batch(args.input_path, args.output_path, args.num_simulations, args.seed,
+                                      args.max_batch_mb * 1024 ** 2)
+    print('planned households at {:.1f} households per second'.format(households_per_second))
@@ -1,6 +1,10 @@
 
+import os
+import time
+
 import numpy as np
 import pandas as pd
+import scipy.stats
 
 
 def calc_age_for_survival_prob(target_survival_prob, age_list, cum_survival_prob_list):
@@ -10,15 +14,91 @@ def calc_age_for_survival_prob(target_survival_prob, age_list, cum_survival_prob
     return 999
 
 
-def calc_wealth_trajectory(starting_wealth, equity_returns, bond_returns, allocations, contributions):
+def as_schedule(x, num_periods, name):
+    '''
+    prepare a per-period input (allocations, contributions, returns) for the wealth recursion. Deterministic
+    schedules can be given as a 1-d array of size [num_periods] and are returned as a [1 x num_periods] view
+    that broadcasts against the [num_simulations x num_periods] return matrices without being copied.
+    Stochastic inputs are given as 2-d arrays and are returned as-is.
+    '''
+
+    x = np.asarray(x)
+
+    if x.ndim == 1:
+        x = x[np.newaxis, :]
+
+    assert x.ndim == 2, 'error: {} must be a 1-d or 2-d array'.format(name)
+    assert x.shape[1] == num_periods, 'error: {} has {} periods, expected {}'.format(name, x.shape[1], num_periods)
+
+    return x
+
+
+def calc_wealth_trajectory(starting_wealth, equity_returns, bond_returns, allocations, contributions, engine='loop',
+                           death_periods=None):
+    '''
+    calculate wealth over time for every simulation, given the returns, asset allocation and contributions (or
+    spending) in every period.
+
+    equity_returns is a [num_simulations x num_periods] array. bond_returns, allocations and contributions
+    can either be [num_simulations x num_periods] arrays (stochastic inputs) or 1-d arrays of size
+    [num_periods] (deterministic schedules that are the same for every simulation).
+
+    the engine flag selects how the recursion is evaluated:
+        'loop': the reference implementation, steps through each period with a python loop
+        'inplace': a preallocated single-pass kernel over period-major buffers. Produces output that is
+            bit-for-bit identical to 'loop' but avoids the per-period temporaries
+        'cumulative': closed-form evaluation with cumprod/cumsum over the whole array. The fastest engine but
+            results only agree with 'loop' to floating point tolerance (~1e-9 relative)
+
+    death_periods optionally gives the last period in which the user is alive in every simulation (see
+    SurvivalIndex.sample_death_periods()), sorted in decreasing order. Wealth after death is set to nan. With
+    the 'inplace' engine the simulations that have ended are not calculated at all: since the simulations are
+    sorted by death, the ones still alive in a period are the first rows of the array.
+
+    the recursion runs in the precision of equity_returns: float32 returns (see random_walk_simulations())
+    give float32 wealth, anything else float64. The other inputs are cast to that precision up front, so
+    that eg the integer contributions of calc_contributions() do not upcast every period.
+
+    :return: an array of size [num_simulations x num_periods] with the wealth in every period
+    '''
+
+    num_periods = equity_returns.shape[1]
+    dtype = np.result_type(equity_returns.dtype, np.float32)
+    equity_returns = equity_returns.astype(dtype, copy=False)
+    bond_returns = as_schedule(bond_returns, num_periods, 'bond returns').astype(dtype, copy=False)
+    allocations = as_schedule(allocations, num_periods, 'allocations').astype(dtype, copy=False)
+    contributions = as_schedule(contributions, num_periods, 'contributions').astype(dtype, copy=False)
+    starting_wealth = np.asarray(starting_wealth, dtype=dtype)
+
+    for name, x in [('bond returns', bond_returns), ('allocations', allocations), ('contributions', contributions)]:
+        assert x.shape[0] in [1, equity_returns.shape[0]], \
+            'error: equity returns and {} do not have the same number of simulations'.format(name)
+    assert engine in ['loop', 'inplace', 'cumulative'], 'error: invalid engine: {}'.format(engine)
+
+    if death_periods is not None:
+
+        death_periods = np.asarray(death_periods)
+        assert death_periods.shape == (equity_returns.shape[0],), \
+            'error: there must be one death period per simulation'
+        assert np.all(np.diff(death_periods) <= 0), 'error: the death periods must be sorted in decreasing order'
+
+        if engine == 'inplace':
+            return _wealth_trajectory_alive(starting_wealth, equity_returns, bond_returns, allocations,
+                                            contributions, calc_alive_counts(death_periods, num_periods))
+
+        wealths = calc_wealth_trajectory(starting_wealth, equity_returns, bond_returns, allocations, contributions,
+                                         engine=engine)
+        wealths[np.arange(num_periods) > death_periods[:, np.newaxis]] = np.nan
 
-    assert equity_returns.shape == allocations.shape, 'error: equity returns and allocations are not the same shape'
-    assert equity_returns.shape == bond_returns.shape, 'error: equity returns and bond returns are not the same shape'
-    assert equity_returns.shape == contributions.shape, 'error: equity returns and contributions are not the same shape'
+        return wealths
+
+    if engine == 'inplace':
+        return _wealth_trajectory_inplace(starting_wealth, equity_returns, bond_returns, allocations, contributions)
+    elif engine == 'cumulative':
+        return _wealth_trajectory_cumulative(starting_wealth, equity_returns, bond_returns, allocations, contributions)
 
     # get the number of periods to simulate, based on the length of the
     # returns simulation
-    num_simulations = equity_returns.shape[0]
     num_periods = equity_returns.shape[1]
 
     # init an array that is the same shape as the inputted return
@@ -53,16 +133,235 @@ def calc_wealth_trajectory(starting_wealth, equity_returns, bond_returns, alloca
 
     return wealths
 
+
+def _wealth_trajectory_inplace(starting_wealth, equity_returns, bond_returns, allocations, contributions):
+    '''
+    single-pass version of the calc_wealth_trajectory() recursion. The per-asset growth factors are computed
+    for all periods at once and stored period-major ([num_periods x num_simulations]) so that every step of
+    the recursion reads and writes contiguous memory. The floating point operations are performed in the same
+    order as the loop engine so the output is identical.
+    '''
+
+    num_simulations = equity_returns.shape[0]
+    num_periods = equity_returns.shape[1]
+
+    # growth factors of each asset sleeve, [num_periods x num_simulations]
+    equity_growth = (1 + equity_returns.T) * allocations.T
+    bond_growth = (1 + bond_returns.T) * (1.0 - allocations.T)
+    contributions = np.ascontiguousarray(contributions.T)
+
+    wealths = np.empty((num_periods, num_simulations), dtype=equity_growth.dtype)
+    scratch = np.empty(num_simulations, dtype=equity_growth.dtype)
+
+    current_wealths = np.broadcast_to(starting_wealth, (num_simulations,)).astype(equity_growth.dtype)
+
+    for i in range(num_periods):
+
+        # wealths[i] = (wealth * equity growth) + (wealth * bond growth) + contribution
+        np.multiply(current_wealths, equity_growth[i], out=wealths[i])
+        np.multiply(current_wealths, bond_growth[i], out=scratch)
+        np.add(wealths[i], scratch, out=wealths[i])
+        np.add(wealths[i], contributions[i], out=wealths[i])
+
+        current_wealths = wealths[i]
+
+    # hand back a [num_simulations x num_periods] view of the period-major buffer
+    return wealths.T
+
+
+def _wealth_trajectory_alive(starting_wealth, equity_returns, bond_returns, allocations, contributions, alive_counts):
+    '''
+    version of the 'inplace' engine that only steps the simulations in which the user is still alive. The
+    simulations are sorted by death so the alive_counts[i] simulations alive in period i are the first rows,
+    and each period works on that prefix only. The growth factors are calculated period by period (on the
+    prefix) rather than for the whole array up front. The wealth of the alive simulations is identical to
+    the other engines, the rest is nan.
+    '''
+
+    num_simulations = equity_returns.shape[0]
+    num_periods = equity_returns.shape[1]
+
+    wealths = np.full((num_periods, num_simulations), np.nan, dtype=equity_returns.dtype)
+    equity_growth = np.empty(num_simulations, dtype=equity_returns.dtype)
+    bond_growth = np.empty(num_simulations, dtype=equity_returns.dtype)
+
+    current_wealths = np.broadcast_to(starting_wealth, (num_simulations,)).astype(equity_returns.dtype)
+
+    def alive_values(x, i, n):
+        # the schedules are either [1 x num_periods] or [num_simulations x num_periods]
+        return x[0, i] if x.shape[0] == 1 else x[:n, i]
+
+    for i in range(num_periods):
+
+        n = alive_counts[i]
+        if n == 0:
+            break
+
+        allocation = alive_values(allocations, i, n)
+
+        np.add(equity_returns[:n, i], 1, out=equity_growth[:n])
+        np.multiply(equity_growth[:n], allocation, out=equity_growth[:n])
+        np.add(alive_values(bond_returns, i, n), 1, out=bond_growth[:n])
+        np.multiply(bond_growth[:n], 1.0 - allocation, out=bond_growth[:n])
+
+        # wealths[i] = (wealth * equity growth) + (wealth * bond growth) + contribution
+        np.multiply(current_wealths[:n], equity_growth[:n], out=wealths[i, :n])
+        np.multiply(current_wealths[:n], bond_growth[:n], out=bond_growth[:n])
+        np.add(wealths[i, :n], bond_growth[:n], out=wealths[i, :n])
+        np.add(wealths[i, :n], alive_values(contributions, i, n), out=wealths[i, :n])
+
+        current_wealths = wealths[i]
+
+    return wealths.T
+
+
+def calc_alive_counts(death_periods, num_periods):
+    '''
+    :return: array of size [num_periods] with the number of simulations in which the user is alive in each
+    period, given the last period alive of every simulation
+    '''
+
+    deaths = np.bincount(np.minimum(death_periods, num_periods - 1), minlength=num_periods)
+
+    return np.cumsum(deaths[::-1])[::-1]
+
+
+def _wealth_trajectory_cumulative(starting_wealth, equity_returns, bond_returns, allocations, contributions):
+    '''
+    closed-form version of the calc_wealth_trajectory() recursion. With a growth factor g_i in every period,
+    W_i = g_i * W_(i-1) + c_i unrolls to
+
+        W_i = G_i * (W_0 + sum_(k<=i) c_k / G_k),   where G_i = g_1 * g_2 * ... * g_i
+
+    which can be evaluated for every period with one cumprod and one cumsum.
+    '''
+
+    num_simulations = equity_returns.shape[0]
+
+    growth = (1 + equity_returns) * allocations + (1 + bond_returns) * (1.0 - allocations)
+    cum_growth = np.cumprod(growth, axis=1)
+
+    wealths = np.cumsum(contributions / cum_growth, axis=1)
+    wealths += np.broadcast_to(starting_wealth, (num_simulations,))[:, np.newaxis]
+    wealths *= cum_growth
+
+    return wealths
+
+
+def calc_multi_asset_wealth_trajectory(starting_wealth, asset_returns, allocations, contributions):
+    '''
+    calculate wealth over time for every simulation of a portfolio of any number of assets, the generalization
+    of calc_wealth_trajectory() (where the assets are equity and bonds).
+
+    asset_returns is a [num_simulations x num_periods x num_assets] array (eg from
+    correlated_random_walk_simulations() or build_joint_sampled_returns()). allocations is a
+    [num_periods x num_assets] array with the share of wealth in every asset in every period (eg from
+    calc_multi_asset_allocations()), or a [num_simulations x num_periods x num_assets] array. contributions is
+    a [num_periods] array or a [num_simulations x num_periods] array.
+
+    the growth of $1 of the portfolio in every period, sum over assets of allocation * (1 + return), is
+    contracted over the asset axis in a single einsum pass, so the recursion itself is the same
+    W_i = g_i * W_(i-1) + c_i for any number of assets. For two assets the result agrees with
+    calc_wealth_trajectory() to floating point tolerance (the growth is summed before it is applied).
+
+    :return: an array of size [num_simulations x num_periods] with the wealth in every period (a view of a
+    period-major array, like the 'inplace' engine of calc_wealth_trajectory())
+    '''
+
+    assert asset_returns.ndim == 3, 'error: asset returns must be a [num_simulations x num_periods x num_assets] array'
+    num_simulations, num_periods, num_assets = asset_returns.shape
+
+    allocations = np.asarray(allocations, dtype=float)
+    contributions = as_schedule(contributions, num_periods, 'contributions')
+
+    # [num_periods x num_simulations] growth of $1 in every period
+    if allocations.ndim == 2:
+        assert allocations.shape == (num_periods, num_assets), \
+            'error: allocations must be a [num_periods x num_assets] array'
+        growth = np.ascontiguousarray(np.einsum('spa,pa->ps', asset_returns, allocations))
+        growth += allocations.sum(axis=1)[:, np.newaxis]
+    else:
+        assert allocations.shape == asset_returns.shape, \
+            'error: allocations must be a [num_periods x num_assets] or a [num_simulations x num_periods x ' \
+            'num_assets] array'
+        growth = np.ascontiguousarray(np.einsum('spa,spa->ps', asset_returns, allocations))
+        growth += allocations.sum(axis=2).T
+
+    wealths = np.empty((num_periods, num_simulations))
+    contributions = contributions.T
+    previous_wealths = np.broadcast_to(np.asarray(starting_wealth, dtype=float), (num_simulations,))
+
+    for i in range(num_periods):
+        np.multiply(previous_wealths, growth[i], out=wealths[i])
+        np.add(wealths[i], contributions[i], out=wealths[i])
+        previous_wealths = wealths[i]
+
+    return wealths.T
+
+
+def calc_multi_asset_allocations(equity_allocations, weights):
+    '''
+    split the share of a glide path that is not in equity (see calc_asset_allocations()) between other assets
+    in fixed proportions, eg weights=[0.5, 0.5] for half in treasuries and half in corporate bonds
+
+    :return: a [num_periods x (1 + len(weights))] array of allocations, with equity first
+    '''
+
+    equity_allocations = np.asarray(equity_allocations, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    assert (weights >= 0).all() and weights.sum() > 0, 'error: the weights must be positive'
+
+    return np.column_stack([equity_allocations, np.outer(1.0 - equity_allocations, weights / weights.sum())])
+
+
 def get_age_at_negative_wealth(trajectory, age_list):
 
     # find the index of the first instance when wealth for a given year
     # is negative
-    i = next((x for x in iter(range(len(trajectory))) if trajectory[x] <= 0), 999)
+    depleted = np.asarray(trajectory) <= 0
 
-    if i == 999:
+    if not depleted.any():
         return 999
     else:
-        return age_list[i]
+        return age_list[depleted.argmax()]
+
+
+def calc_first_ruin_index(wealths):
+    '''
+    find the period in which each simulation first has non-positive wealth
+
+    :param wealths: [num_simulations x num_periods] array of wealth
+    :return: array of size [num_simulations] with the index of the first period with wealth <= 0, or
+    num_periods for the simulations that never run out of money
+    '''
+
+    depleted = wealths <= 0
+
+    return np.where(depleted.any(axis=1), depleted.argmax(axis=1), wealths.shape[1])
+
+
+def calc_ruin_analysis(ruin_counts, age_list):
+    '''
+    summarize when the simulated plans run out of money.
+
+    :param ruin_counts: array of size [num_periods + 1] with the number of simulations that first run out of
+    money in each period (the last element counts the simulations that never do), eg from
+    np.bincount(calc_first_ruin_index(wealths), minlength=num_periods + 1)
+    :return: a dictionary with, for every period (age), the probability of first running out of money at that
+    age ('ruin_age_distribution'), of having run out by that age ('ruin_probability') and of the portfolio
+    still lasting ('survival'), plus the overall 'probability_of_success' (never running out of money)
+    '''
+
+    num_periods = len(ruin_counts) - 1
+    ruin_age_distribution = ruin_counts[:-1] / ruin_counts.sum()
+    ruin_probability = np.cumsum(ruin_age_distribution)
+
+    return {'ages': np.asarray(age_list[:num_periods]),
+            'ruin_age_distribution': ruin_age_distribution,
+            'ruin_probability': ruin_probability,
+            'survival': 1.0 - ruin_probability,
+            'probability_of_success': 1.0 - ruin_probability[-1]}
+
 
 def calc_wealth_milestones(trajectories, rates_of_return, age_list, idx_at_retirement, idx_at_final_age, years_to_retire_minus_one):
 
@@ -91,33 +390,50 @@ def calc_wealth_milestones(trajectories, rates_of_return, age_list, idx_at_retir
                                                                           end_value=rates_of_return[i][
                                                                               idx_at_final_age - 1],
                                                                           num_periods=idx_at_final_age - 1)
-        # find the index of the first instance when wealth for a given year
+        # find the age at the first instance when wealth for a given year
         # is negative
-        temp = next((x for x in iter(range(len(trajectories[i]))) if trajectories[i][x] <= 0), 999)
-
-        if temp == 999:
-            wealth_stats[i]['age_at_negative_wealth'] = 999
-        else:
-            wealth_stats[i]['age_at_negative_wealth'] = age_list[temp]
+        wealth_stats[i]['age_at_negative_wealth'] = get_age_at_negative_wealth(trajectories[i], age_list)
 
     return wealth_stats
 
-def financial_plan(params, contributions, equity_returns, bond_returns):
-
-    rates_of_return = equity_returns[:, 1:]
-    rates_of_return = rates_of_return + 1
-    rates_of_return = np.cumprod(rates_of_return, axis=1)
-    rates_of_return = wealth_distributions(rates_of_return)
-            
-    allocations = calc_asset_allocations(user_age=params['user_age'],
-                                            retirement_age=params['user_retirement_age'],
-                                            final_age=params['user_mortality']['1%'],
-                                            percent_at_retirement=0.6,
-                                            glide_length=10)
+def financial_plan(params, contributions, equity_returns, bond_returns, executor=None, rates_of_return=None,
+                   death_periods=None, wealths=None, checkpoint=None):
+    '''
+    simulate the wealth trajectories for a plan and summarize them.
+
+    equity_returns is either a [num_simulations x num_periods] array, or a re-iterable source of blocks of
+    simulated returns (eg RandomWalkBlocks). With a block source, each block is folded into a
+    PlanAccumulator and discarded, so memory does not grow with the number of simulations. In that case
+    the accumulator is returned in place of the wealths array, the starting wealth is returned as a scalar
+    (rather than one element per simulation) and the percentiles are approximate (see QuantileSketch).
+
+    executor is an optional concurrent.futures executor (eg a ProcessPoolExecutor) used to simulate the
+    shards of a block source in parallel. Each shard has its own random stream and the partial
+    accumulators are merged in shard order, so the result for a given seed does not depend on the number
+    of workers.
+
+    the wealth of the batches is kept period-major (as calculated by the 'inplace' engine) for the percentiles.
+
+    rates_of_return is an optional precomputed distribution of the cumulative market growth of
+    equity_returns (as returned by wealth_distributions(), eg from a ScenarioBank). It does not depend on
+    the user, so it can be reused across plans instead of being recalculated from equity_returns.
+
+    death_periods optionally gives the (sampled) last period in which the user is alive in every simulation,
+    sorted in decreasing order (see SurvivalIndex.sample_death_periods()). The simulations then end at death
+    rather than at the 1% survival age: the wealth percentiles of each period are taken over the simulations
+    still alive, running out of money only counts if it happens during the user's lifetime, and
+    wealth_stats['lifetime'] reports the probability of outliving the money. This needs equity_returns as an
+    array whose simulations are independent draws (their order must not matter).
+
+    wealths is an optional precomputed calc_wealth_trajectory() of an equity_returns array for this plan
+    (eg from adaptive_financial_plan()), so that it is not calculated again.
+
+    checkpoint is an optional AccumulationCheckpoint of the savings phase of this plan on the same equity_returns
+    array. Only the retirement periods are then simulated, starting from the wealth before retirement in the
+    checkpoint, and the wealths returned (or given) cover the retirement periods only.
+    '''
 
-    # make an array of allocations for every simulation (previously 'allocations' was a single array of size
-    # [1 x num_periods]. Now let's make it [num_simulations x num_periods] so that it is consistent with other arrays)
-    allocations = np.array([allocations for i in range(params['num_simulations'])])
+    allocations = plan_allocations(params)
 
     # 5b. calculate the contributions and spending in each year
 
@@ -126,26 +442,98 @@ def financial_plan(params, contributions, equity_returns, bond_returns):
     total_user_save = contributions[:params['user_retirement_age'] - params['user_age']].sum()
     total_user_save = dollar_as_text(total_user_save)
 
-    # convert contributions from [num_periods] array to [num_simulations x num_periods]
-    contributions = np.array([contributions for i in range(params['num_simulations'])])
+    # allocations and contributions are the same in every simulation so they stay as [num_periods] arrays
+    # and are broadcast against the [num_simulations x num_periods] returns in calc_wealth_trajectory()
 
     # 5c. calc wealth over time
-    # init an [num_simulations x 1]-sized array with the starting wealth
-    # value for each element
-    starting_wealth_array = np.full(
-        shape=params['num_simulations'], fill_value=params['user_wealth'])
-
-    # calculate the growth of wealth which incorporates market returns,
-    # contributions and spending in each period
-    wealths = calc_wealth_trajectory(starting_wealth=starting_wealth_array,
-                                        equity_returns=equity_returns,
-                                        bond_returns=bond_returns,
-                                        allocations=allocations,
-                                        contributions=contributions)
-
-    # calculate the different wealth trajectories
-    # (eg the median path, 25th percentile path, etc)
-    trajectories = wealth_distributions(wealths)
+    # the starting wealth is built per block of simulations: an array with one element per simulation of an
+    # equity_returns array, or the scalar starting wealth broadcast against every block of a block source
+    # (so that memory does not grow with the number of simulations)
+    starting_wealth_array = params['user_wealth']
+
+    if isinstance(equity_returns, np.ndarray):
+
+        starting_wealth_array = np.full(shape=equity_returns.shape[0], fill_value=params['user_wealth'])
+
+        if rates_of_return is None:
+            rates_of_return = equity_returns[:, 1:]
+            rates_of_return = rates_of_return + 1
+            rates_of_return = np.cumprod(rates_of_return, axis=1)
+            rates_of_return = wealth_distributions(rates_of_return, method=params.get('quantile_method', 'exact'))
+
+        # calculate the growth of wealth which incorporates market returns,
+        # contributions and spending in each period
+        if checkpoint is not None:
+
+            assert death_periods is None, 'error: sampled lifetimes cannot start from a checkpoint'
+
+            # only simulate the retirement periods, the savings phase percentiles come from the checkpoint
+            if wealths is None:
+                wealths = checkpoint.retirement_wealths(params, contributions, equity_returns, bond_returns,
+                                                        engine=params.get('wealth_engine', 'loop'))
+
+            savings_trajectories = checkpoint.savings_distributions(params, contributions, equity_returns, bond_returns,
+                                                                    engine=params.get('wealth_engine', 'loop'),
+                                                                    method=params.get('quantile_method', 'exact'))
+            retirement_trajectories = wealth_distributions(wealths, method=params.get('quantile_method', 'exact'))
+
+            trajectories = {k: np.concatenate([savings_trajectories[k], retirement_trajectories[k]])
+                            for k in retirement_trajectories}
+
+        else:
+
+            if wealths is None:
+                wealths = calc_wealth_trajectory(starting_wealth=starting_wealth_array,
+                                                    equity_returns=equity_returns,
+                                                    bond_returns=bond_returns,
+                                                    allocations=allocations,
+                                                    contributions=contributions,
+                                                    engine=params.get('wealth_engine', 'loop'),
+                                                    death_periods=death_periods)
+
+            # calculate the different wealth trajectories
+            # (eg the median path, 25th percentile path, etc)
+            if death_periods is None:
+                trajectories = wealth_distributions(wealths, method=params.get('quantile_method', 'exact'))
+            else:
+                trajectories = wealth_distributions(wealths, method=params.get('quantile_method', 'exact'),
+                                                    alive_counts=calc_alive_counts(death_periods, len(contributions)))
+
+    else:
+
+        assert death_periods is None, 'error: sampled lifetimes need the equity returns as an array'
+
+        # simulate block by block, keeping only the running statistics
+        wealths = PlanAccumulator(num_periods=len(contributions))
+
+        if executor is None:
+
+            for equity_block in equity_returns:
+                wealth_block = calc_wealth_trajectory(starting_wealth=starting_wealth_array,
+                                                      equity_returns=equity_block,
+                                                      bond_returns=bond_returns,
+                                                      allocations=allocations,
+                                                      contributions=contributions,
+                                                      engine=params.get('wealth_engine', 'loop'))
+                wealths.add(equity_block, wealth_block)
+
+        else:
+
+            shards = equity_returns.shards()
+            partial_accumulators = executor.map(accumulate_shard,
+                                                shards,
+                                                [starting_wealth_array] * len(shards),
+                                                [bond_returns] * len(shards),
+                                                [allocations] * len(shards),
+                                                [contributions] * len(shards),
+                                                [params.get('wealth_engine', 'loop')] * len(shards))
+
+            # executor.map returns results in the order of the shards
+            for partial_accumulator in partial_accumulators:
+                wealths.merge(partial_accumulator)
+
+        rates_of_return = wealths.returns.distributions()
+        trajectories = wealths.wealths.distributions()
 
     # 6. calculate stats about wealth trajectory
 
@@ -157,12 +545,363 @@ def financial_plan(params, contributions, equity_returns, bond_returns):
                                              params['idx_at_final_age'],
                                              params['years_to_retire_minus_one'])
 
+    # when the money runs out across all the simulations (rather than only for the percentile paths)
+    if isinstance(wealths, PlanAccumulator):
+        ruin_counts = wealths.ruin_counts
+    elif checkpoint is not None:
+        ruin_counts = np.bincount(checkpoint.first_ruin_index(wealths), minlength=len(contributions) + 1)
+    else:
+        ruin_counts = np.bincount(calc_first_ruin_index(wealths), minlength=wealths.shape[1] + 1)
+    wealth_stats['ruin'] = calc_ruin_analysis(ruin_counts, params['age_list'])
+
+    # with sampled lifetimes the wealth after death is nan, so ruin above is only counted while alive
+    if death_periods is not None:
+        alive_counts = calc_alive_counts(death_periods, len(contributions))
+        wealth_stats['lifetime'] = {'alive_probability': alive_counts / len(death_periods),
+                                    'probability_of_outliving_money': 1.0 - wealth_stats['ruin']['probability_of_success']}
+
     return total_user_save, starting_wealth_array, allocations, contributions, wealths, trajectories, wealth_stats
 
 
+def plan_allocations(params):
+    '''
+    the equity allocation in every period of a plan (the share in bonds is the rest)
+    '''
+
+    return calc_asset_allocations(user_age=params['user_age'],
+                                  retirement_age=params['user_retirement_age'],
+                                  final_age=params['user_mortality']['1%'],
+                                  percent_at_retirement=0.6,
+                                  glide_length=10)
+
+
+def adaptive_financial_plan(params, contributions, equity_returns, bond_returns, batch_size=1000,
+                            min_simulations=2000, success_tolerance=0.01, wealth_tolerance=0.03, confidence=0.95,
+                            rates_of_return=None, checkpoint=None):
+    '''
+    run financial_plan() on only as many simulations as needed for the key outputs to be precise.
+
+    the simulations are taken batch by batch (batch_size rows at a time of an equity_returns array, or one
+    block at a time of a block source such as RandomWalkBlocks) until the confidence intervals of both
+        - the probability of success, with a half width under success_tolerance (absolute), and
+        - the 5th percentile of wealth at retirement, with a half width under wealth_tolerance (relative)
+    are narrow enough, or the simulations run out. Plans that are clearly safe (or clearly not) stop after
+    min_simulations, plans on the edge use more simulations.
+
+    bond_returns is either a [num_periods] array or, with an equity_returns array, an array with one row per
+    simulation (the rows are taken together with the equity rows). The simulations must be independent draws
+    (their order must not matter) since the first ones are used.
+
+    the wealth of the batches is kept period-major (as calculated by the 'inplace' engine) for the percentiles.
+
+    rates_of_return is an optional precomputed distribution of the cumulative market growth of all the
+    simulations of an equity_returns array (see financial_plan()), only used if all of them are needed.
+
+    checkpoint is an optional AccumulationCheckpoint of the savings phase of the plan on the equity_returns array,
+    so that only the retirement periods of every batch are simulated.
+
+    :return: the same as financial_plan(), run on the simulations used, with wealth_stats['adaptive'] reporting
+    the number of simulations used, the estimates and the half widths of their confidence intervals
+    '''
+
+    allocations = plan_allocations(params)
+    idx_at_retirement = params['idx_at_retirement']
+    z = scipy.stats.norm.ppf(0.5 + confidence / 2)
+
+    if isinstance(equity_returns, np.ndarray):
+        blocks = (equity_returns[start:start + batch_size] for start in range(0, equity_returns.shape[0], batch_size))
+    else:
+        assert bond_returns.ndim == 1, 'error: a block source needs the bond returns as a [num_periods] array'
+        assert checkpoint is None, 'error: a checkpoint needs the equity returns as an array'
+        blocks = iter(equity_returns)
+
+    equity_blocks = []  # only kept for a block source
+    wealth_blocks = []
+    wealths_at_retirement = []
+    successes = 0
+    num_simulations = 0
+
+    for equity_block in blocks:
+
+        bond_block = bond_returns
+        if bond_returns.ndim == 2:
+            bond_block = bond_returns[num_simulations:num_simulations + equity_block.shape[0]]
+
+        if checkpoint is None:
+            wealths = calc_wealth_trajectory(starting_wealth=params['user_wealth'],
+                                             equity_returns=equity_block,
+                                             bond_returns=bond_block,
+                                             allocations=allocations,
+                                             contributions=contributions,
+                                             engine=params.get('wealth_engine', 'loop'))
+            ruin_index = calc_first_ruin_index(wealths)
+            wealth_at_retirement_index = idx_at_retirement
+        else:
+            # the wealths of the retirement periods only
+            wealths = checkpoint.retirement_wealths(params, contributions, equity_block, bond_block,
+                                                    engine=params.get('wealth_engine', 'loop'),
+                                                    start=num_simulations)
+            ruin_index = checkpoint.first_ruin_index(wealths, start=num_simulations)
+            wealth_at_retirement_index = idx_at_retirement - checkpoint.num_periods
+
+        if not isinstance(equity_returns, np.ndarray):
+            equity_blocks.append(equity_block)
+        wealth_blocks.append(wealths)
+        wealths_at_retirement.append(wealths[:, wealth_at_retirement_index])
+        successes += np.count_nonzero(ruin_index == len(contributions))
+        num_simulations += equity_block.shape[0]
+
+        # normal approximation of the confidence interval of the probability of success
+        probability_of_success = successes / num_simulations
+        success_error = z * np.sqrt(probability_of_success * (1 - probability_of_success) / num_simulations)
+
+        # distribution-free confidence interval of the 5th percentile, from the order statistics whose ranks
+        # bracket the percentile (the rank of the 5th percentile is binomial)
+        x = np.concatenate(wealths_at_retirement)
+        rank_error = z * np.sqrt(num_simulations * 0.05 * 0.95)
+        lower_rank = max(int(np.floor(num_simulations * 0.05 - rank_error)), 0)
+        upper_rank = min(int(np.ceil(num_simulations * 0.05 + rank_error)), num_simulations - 1)
+        lower, upper = np.partition(x, [lower_rank, upper_rank])[[lower_rank, upper_rank]]
+        wealth_at_retirement = np.percentile(x, 5)
+        wealth_error = (upper - lower) / 2 / max(abs(wealth_at_retirement), 1.0)
+
+        converged = num_simulations >= min_simulations and success_error <= success_tolerance and \
+                    wealth_error <= wealth_tolerance
+        if converged:
+            break
+
+    if isinstance(equity_returns, np.ndarray):
+        if num_simulations < equity_returns.shape[0]:
+            rates_of_return = None
+        equity_returns = equity_returns[:num_simulations]
+    else:
+        rates_of_return = None
+        equity_returns = np.concatenate(equity_blocks)
+
+    if rates_of_return is None:
+        rates_of_return = milestone_rates_of_return(params, equity_returns)
+    if bond_returns.ndim == 2:
+        bond_returns = bond_returns[:num_simulations]
+
+    plan_params = dict(params)
+    plan_params['num_simulations'] = num_simulations
+    result = financial_plan(plan_params, contributions, equity_returns, bond_returns, rates_of_return=rates_of_return,
+                            wealths=np.concatenate([w.T for w in wealth_blocks], axis=1).T, checkpoint=checkpoint)
+
+    result[6]['adaptive'] = {'num_simulations': num_simulations,
+                             'probability_of_success': float(probability_of_success),
+                             'probability_of_success_error': float(success_error),
+                             'wealth_at_retirement': float(wealth_at_retirement),
+                             'wealth_at_retirement_error': float(wealth_error),
+                             'converged': bool(converged)}
+
+    return result
+
+
+def milestone_rates_of_return(params, equity_returns):
+    '''
+    the distribution of the cumulative market growth (as in financial_plan()) at the periods that
+    calc_wealth_milestones() looks up only: the period before retirement and the period before the final age.
+    The other periods are nan.
+    '''
+
+    periods = [params['idx_at_retirement'] - 1, params['idx_at_final_age'] - 1]
+    growth = np.cumprod(equity_returns[:, 1:max(periods) + 2] + 1, axis=1)
+
+    rates_of_return = {}
+    for k, values in wealth_distributions(growth[:, periods], method=params.get('quantile_method', 'exact')).items():
+        rates_of_return[k] = np.full(equity_returns.shape[1] - 1, np.nan)
+        rates_of_return[k][periods] = values
+
+    return rates_of_return
+
+
+def float32_accuracy_report(params, contributions, equity_returns, bond_returns):
+    '''
+    compare a plan on float32 returns with the same plan on float64 returns, to check that the reduced
+    precision does not change the results that are shown on the retirement page. The float32 plan uses the
+    equity and bond returns (float64 arrays) rounded to float32.
+
+    :return: a dictionary with
+        'trajectories': for every wealth trajectory (mean, median and percentiles), the largest difference in
+            any period relative to the largest wealth of the float64 trajectory
+        'milestones': for every percentile, the largest relative difference of the wealth at retirement and
+            at the end of the plan
+        'probability_of_success': the absolute difference in the probability of never running out of money
+        'same_ages_at_negative_wealth': whether every percentile runs out of money at the same age
+        'max_relative_difference': the largest of the trajectory and milestone differences
+    '''
+
+    results = {}
+    for dtype in [np.float64, np.float32]:
+        results[dtype] = financial_plan(params, contributions, equity_returns.astype(dtype),
+                                        np.asarray(bond_returns).astype(dtype))
+
+    trajectories = {k: float(np.max(np.abs(results[np.float32][5][k] - results[np.float64][5][k])) /
+                         max(np.max(np.abs(results[np.float64][5][k])), 1.0))
+                    for k in results[np.float64][5]}
+
+    milestones = {}
+    for k in ['mean', 75, 50, 25, 5, 1]:
+        differences = []
+        for milestone in ['wealth_at_retirement', 'wealth_at_end']:
+            x32, x64 = results[np.float32][6][k][milestone], results[np.float64][6][k][milestone]
+            differences.append(abs(x32 - x64) / max(abs(x64), 1.0))
+        milestones[k] = float(max(differences))
+
+    return {'trajectories': trajectories,
+            'milestones': milestones,
+            'probability_of_success': abs(results[np.float32][6]['ruin']['probability_of_success'] -
+                                          results[np.float64][6]['ruin']['probability_of_success']),
+            'same_ages_at_negative_wealth': all(results[np.float32][6][k]['age_at_negative_wealth'] ==
+                                                results[np.float64][6][k]['age_at_negative_wealth']
+                                                for k in milestones),
+            'max_relative_difference': max(list(trajectories.values()) + list(milestones.values()))}
+
+
+def accumulate_shard(shard, starting_wealth, bond_returns, allocations, contributions, engine='loop'):
+    '''
+    simulate one shard of a block source and summarize it in a PlanAccumulator. This runs in the worker
+    processes when financial_plan() is given an executor.
+    '''
+
+    equity_returns = shard.simulate()
+    wealths = calc_wealth_trajectory(starting_wealth=starting_wealth,
+                                     equity_returns=equity_returns,
+                                     bond_returns=bond_returns,
+                                     allocations=allocations,
+                                     contributions=contributions,
+                                     engine=engine)
+
+    return PlanAccumulator(num_periods=len(contributions)).add(equity_returns, wealths)
+
+
+class PlanAccumulator:
+    '''
+    running statistics of a plan that is simulated in blocks: sketches of the cumulative market growth and of
+    wealth in every period, and a count of the simulations that first run out of money in each period
+    (ruin_counts[i] for period i, with the last element counting the simulations that never run out).
+    Accumulators built over different blocks can be merged.
+    '''
+
+    def __init__(self, num_periods, relative_accuracy=0.005):
+
+        self.num_periods = num_periods
+        self.returns = QuantileSketch(num_periods - 1, relative_accuracy=relative_accuracy)
+        self.wealths = QuantileSketch(num_periods, relative_accuracy=relative_accuracy)
+        self.ruin_counts = np.zeros(num_periods + 1, dtype=np.int64)
+
+    def add(self, equity_returns, wealths):
+        '''
+        fold a block of simulated equity returns and the resulting wealths (both [block_size x num_periods])
+        into the running statistics
+        '''
+
+        self.returns.add(np.cumprod(equity_returns[:, 1:] + 1, axis=1))
+        self.wealths.add(wealths)
+
+        # the period in which each simulation first has non-positive wealth (num_periods if it never does)
+        self.ruin_counts += np.bincount(calc_first_ruin_index(wealths), minlength=self.num_periods + 1)
+
+        return self
+
+    def merge(self, other):
+
+        self.returns.merge(other.returns)
+        self.wealths.merge(other.wealths)
+        self.ruin_counts += other.ruin_counts
+
+        return self
+
+
+class AccumulationCheckpoint:
+    '''
+    the savings phase of a plan on an array of simulated returns, up to the period before retirement. It does not
+    depend on the spending in retirement, so plans that only change their retirement inputs can start from the
+    checkpoint and only simulate the retirement periods (see financial_plan()).
+
+    for every simulation the checkpoint keeps the wealth in the last period before retirement ('wealths') and the
+    period in which the money first ran out during the savings phase ('ruin_index', the number of savings periods
+    if it did not). The wealth percentiles of the savings periods are kept for every number of simulations (first
+    rows of the returns) they were asked for. build_seconds is the time it took to build the checkpoint, ie the
+    time saved by every plan that reuses it.
+    '''
+
+    def __init__(self, params, contributions, equity_returns, bond_returns, engine='loop'):
+
+        start_time = time.perf_counter()
+
+        self.num_periods = params['idx_at_retirement']
+        assert self.num_periods > 0, 'error: the plan has no savings periods to checkpoint'
+
+        wealths = self._savings_wealths(params, contributions, equity_returns, bond_returns, engine)
+
+        self.wealths = np.ascontiguousarray(wealths[:, -1])
+        self.ruin_index = calc_first_ruin_index(wealths)
+        self.distributions = {}
+        self.build_seconds = time.perf_counter() - start_time
+
+    def _savings_wealths(self, params, contributions, equity_returns, bond_returns, engine):
+
+        k = self.num_periods
+
+        return calc_wealth_trajectory(starting_wealth=params['user_wealth'],
+                                      equity_returns=equity_returns[:, :k],
+                                      bond_returns=np.asarray(bond_returns)[..., :k],
+                                      allocations=plan_allocations(params)[:k],
+                                      contributions=contributions[:k],
+                                      engine=engine)
+
+    def retirement_wealths(self, params, contributions, equity_returns, bond_returns, engine='loop', start=0):
+        '''
+        simulate the retirement periods of the plan for the simulations start, start + 1, ... of the checkpoint,
+        given their equity_returns (and bond returns) over all the periods of the plan
+
+        :return: [num_simulations x num_retirement_periods] array of wealth, identical to the same periods of
+        calc_wealth_trajectory() over the whole plan with the 'loop' and 'inplace' engines
+        '''
+
+        k = self.num_periods
+
+        return calc_wealth_trajectory(starting_wealth=self.wealths[start:start + equity_returns.shape[0]],
+                                      equity_returns=equity_returns[:, k:],
+                                      bond_returns=np.asarray(bond_returns)[..., k:],
+                                      allocations=plan_allocations(params)[k:],
+                                      contributions=contributions[k:],
+                                      engine=engine)
+
+    def first_ruin_index(self, retirement_wealths, start=0):
+        '''
+        the period in which the money first runs out over the whole plan (see calc_first_ruin_index()), given the
+        retirement_wealths of the simulations start, start + 1, ...
+        '''
+
+        ruin_index = self.ruin_index[start:start + retirement_wealths.shape[0]]
+
+        return np.where(ruin_index < self.num_periods, ruin_index,
+                        self.num_periods + calc_first_ruin_index(retirement_wealths))
+
+    def savings_distributions(self, params, contributions, equity_returns, bond_returns, engine='loop',
+                              method='exact'):
+        '''
+        the wealth_distributions() of the savings periods over the first equity_returns.shape[0] simulations,
+        calculated (from the returns) the first time they are needed for that number of simulations
+        '''
+
+        key = (equity_returns.shape[0], method)
+
+        if key not in self.distributions:
+            wealths = self._savings_wealths(params, contributions, equity_returns, bond_returns, engine)
+            self.distributions[key] = wealth_distributions(wealths, method=method)
+
+        return self.distributions[key]
+
 
 def depleted_text(depleted_age, final_wealth, wealth_at_retirement):
-    if (depleted_age == 999) & (final_wealth > (1.2 * wealth_at_retirement)):
+    # the wealth is nan if no simulation is still alive (with sampled lifetimes)
+    if (depleted_age == 999) & (np.isnan(final_wealth) | np.isnan(wealth_at_retirement)):
+        return "n/a"
+    elif (depleted_age == 999) & (final_wealth > (1.2 * wealth_at_retirement)):
         return "👍 Grow Forever"
     elif (depleted_age == 999) & (final_wealth <= (1.2 * wealth_at_retirement)) & (final_wealth > (0.8 * wealth_at_retirement)):
         return "👍 Remain Roughly Stable Over Your Life"
@@ -246,33 +985,273 @@ def calc_asset_allocations(user_age, retirement_age, final_age, percent_at_retir
     return allocations
 
 
-def random_walk_simulations(mean, stdev, periods, num_simulations, set_first_obs_as_zero=True):
+# the variance reduction modes of random_walk_simulations()
+VARIANCE_REDUCTION_MODES = [None, 'antithetic', 'moment_matching', 'sobol']
+
+# the number of simulations drawn at a time for float32 random walks
+DRAW_BLOCK_SIZE = 65536
+
+
+def random_walk_simulations(mean, stdev, periods, num_simulations, set_first_obs_as_zero=True, random_state=None,
+                            variance_reduction=None, dtype=np.float64):
     '''
     simulate market returns by sampling from a normal distribution. Create a set of
     simulations, each composed of a series of returns.
 
+    random_state is an optional np.random.Generator (or RandomState) to draw from. By default the global
+    numpy random state is used.
+
+    variance_reduction selects how the normal draws are generated:
+        None: independent draws
+        'antithetic': every draw z is paired with -z, so the simulated returns are symmetric around the mean
+        'moment_matching': the draws of every period are rescaled to have exactly zero mean and unit
+            standard deviation across the simulations
+        'sobol': quasi-Monte Carlo, the draws are the inverse normal cdf of a scrambled Sobol sequence with one
+            dimension per period (needs scipy >= 1.7)
+    the modes give the same distribution of returns as independent draws but the percentiles of the
+    simulated wealth converge faster, so fewer simulations are needed for the same precision
+    (see benchmarks/variance_reduction.py)
+
+    dtype is the precision of the returns, np.float64 or np.float32. float32 returns halve the memory of the
+    simulations and of the wealth calculated from them (see calc_wealth_trajectory() and
+    float32_accuracy_report()). They are the float64 returns rounded to float32 (without variance reduction
+    the draws are made in float64 blocks and rounded block by block, so no float64 copy of the whole array
+    is made).
 
     return a numpy array of size [num_simulations x periods] that represents several sequences
     of returns. 
     '''
 
-    # draw random numbers from a normal distribution with specified mean and standard deviation
-    # the result is an [num_simulations x periods] array of simulated returns
-    random_returns = np.random.normal(
-        mean, stdev, size=[num_simulations, periods])
+    assert variance_reduction in VARIANCE_REDUCTION_MODES, \
+        'error: invalid variance reduction mode: {}'.format(variance_reduction)
+    assert np.dtype(dtype) in [np.float64, np.float32], 'error: invalid dtype: {}'.format(dtype)
 
-    if set_first_obs_as_zero:
-        random_returns[:, 0] = 0
+    if random_state is None:
+        random_state = np.random
+
+    if variance_reduction is None and np.dtype(dtype) == np.float64:
+
+        # draw random numbers from a normal distribution with specified mean and standard deviation
+        # the result is an [num_simulations x periods] array of simulated returns
+        random_returns = random_state.normal(
+            mean, stdev, size=[num_simulations, periods])
+
+        if set_first_obs_as_zero:
+            random_returns[:, 0] = 0
+
+    elif variance_reduction is None:
+
+        # the same draws as above (consecutive blocks of rows continue the same random stream), rounded
+        random_returns = np.empty([num_simulations, periods], dtype=dtype)
+        for start in range(0, num_simulations, DRAW_BLOCK_SIZE):
+            random_returns[start:start + DRAW_BLOCK_SIZE] = random_state.normal(
+                mean, stdev, size=[min(DRAW_BLOCK_SIZE, num_simulations - start), periods])
+
+        if set_first_obs_as_zero:
+            random_returns[:, 0] = 0
+
+    else:
+
+        # only draw the periods that are not zeroed (the first dimensions of a sobol sequence are the most
+        # evenly spread)
+        first_period = 1 if set_first_obs_as_zero else 0
+
+        # scale the (float64) draws before they are rounded to dtype
+        draws = standard_normal_draws(num_simulations, periods - first_period, random_state, variance_reduction)
+        draws *= stdev
+        draws += mean
+
+        random_returns = np.zeros([num_simulations, periods], dtype=dtype)
+        random_returns[:, first_period:] = draws
+
+    return random_returns
+
+
+def standard_normal_draws(num_simulations, periods, random_state, variance_reduction):
+    '''
+    [num_simulations x periods] array of standard normal draws generated with one of the variance reduction
+    modes of random_walk_simulations()
+    '''
+
+    if variance_reduction == 'antithetic':
+
+        # draw half of the simulations and mirror them (an odd number of simulations drops the last mirror)
+        draws = random_state.standard_normal(size=[(num_simulations + 1) // 2, periods])
+        return np.concatenate([draws, -draws], axis=0)[:num_simulations]
+
+    elif variance_reduction == 'moment_matching':
+
+        assert num_simulations > 1, 'error: moment matching needs more than one simulation'
+
+        draws = random_state.standard_normal(size=[num_simulations, periods])
+        draws -= draws.mean(axis=0)
+        draws /= draws.std(axis=0)
+        return draws
+
+    elif variance_reduction == 'sobol':
+
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise ImportError('error: the sobol variance reduction mode needs scipy >= 1.7 (scipy.stats.qmc)')
+        from scipy.special import ndtri
+
+        # the scrambling is seeded from the random state (the global random state has no generator to pass)
+        seed = random_state if isinstance(random_state, (np.random.Generator, np.random.RandomState)) else None
+        sampler = qmc.Sobol(d=periods, scramble=True, seed=seed)
+
+        # sobol points are balanced in blocks of powers of two, draw the next one up and keep the first points
+        points = sampler.random_base2(m=int(np.ceil(np.log2(max(num_simulations, 2)))))[:num_simulations]
+        return ndtri(points)
+
+
+def correlated_random_walk_simulations(means, stdevs, correlations, periods, num_simulations,
+                                       set_first_obs_as_zero=True, random_state=None, variance_reduction=None):
+    '''
+    simulate the returns of several assets with correlated normal distributions (the multi-asset version of
+    random_walk_simulations()). The independent standard normal draws are multiplied by the cholesky factor
+    of the covariance matrix, so that the simulated returns have the given means, standard deviations and
+    correlations. Returns are independent over time.
+
+    means and stdevs have one value per asset, correlations is the [num_assets x num_assets] correlation
+    matrix (eg from historical_return_moments()). random_state and variance_reduction are the same as in
+    random_walk_simulations().
+
+    :return: a [num_simulations x periods x num_assets] array
+    '''
+
+    assert variance_reduction in VARIANCE_REDUCTION_MODES, \
+        'error: invalid variance reduction mode: {}'.format(variance_reduction)
+
+    means = np.asarray(means, dtype=float)
+    stdevs = np.asarray(stdevs, dtype=float)
+    correlations = np.asarray(correlations, dtype=float)
+
+    num_assets = len(means)
+    assert stdevs.shape == (num_assets,) and correlations.shape == (num_assets, num_assets), \
+        'error: means, stdevs and correlations must have one value (or row) per asset'
+
+    # raises a LinAlgError if the correlation matrix is not positive definite
+    cholesky = np.linalg.cholesky(correlations * np.outer(stdevs, stdevs))
+
+    if random_state is None:
+        random_state = np.random
+
+    # only draw the periods that are not zeroed
+    first_period = 1 if set_first_obs_as_zero else 0
+
+    if variance_reduction is None:
+        draws = random_state.standard_normal(size=[num_simulations, periods - first_period, num_assets])
+    else:
+        draws = standard_normal_draws(num_simulations, (periods - first_period) * num_assets, random_state,
+                                      variance_reduction).reshape(num_simulations, periods - first_period, num_assets)
+
+    random_returns = np.zeros([num_simulations, periods, num_assets])
+    random_returns[:, first_period:] = draws @ cholesky.T
+    random_returns[:, first_period:] += means
 
     return random_returns
 
 
-def wealth_distributions(x):
+class RandomWalkBlocks:
+    '''
+    a re-iterable source of random walk return simulations, generated block_size simulations at a time.
+
+    the simulations are split into shards of block_size simulations and every shard draws from its own
+    independent random stream, spawned from the seed with np.random.SeedSequence. Iterating twice gives the
+    same simulations (eg to run the scenario analysis on the same market paths as the main plan), and the
+    shards can be simulated in any order or in separate processes (see financial_plan()) without changing
+    the result. If no seed is given, a random one is drawn once when the source is created.
+
+    variance_reduction is applied to every block separately (see random_walk_simulations()), the blocks are
+    simulated with the given dtype.
+    '''
+
+    def __init__(self, mean, stdev, periods, num_simulations, seed=None, block_size=50000, variance_reduction=None,
+                 dtype=np.float64):
+
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+
+        self.mean = mean
+        self.stdev = stdev
+        self.periods = periods
+        self.num_simulations = num_simulations
+        self.seed = seed
+        self.block_size = block_size
+        self.variance_reduction = variance_reduction
+        self.dtype = dtype
+
+    def shards(self):
+        '''
+        the list of RandomWalkShard that make up the simulations, in order
+        '''
+
+        block_sizes = [min(self.block_size, self.num_simulations - start)
+                       for start in range(0, self.num_simulations, self.block_size)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(block_sizes))
+
+        return [RandomWalkShard(self.mean, self.stdev, self.periods, n, seed, self.variance_reduction, self.dtype)
+                for n, seed in zip(block_sizes, seeds)]
+
+    def __iter__(self):
+
+        for shard in self.shards():
+            yield shard.simulate()
+
+
+class RandomWalkShard:
+    '''
+    one block of RandomWalkBlocks: the parameters and the random stream needed to simulate it. Shards are
+    small and picklable so they can be sent to worker processes.
+    '''
+
+    def __init__(self, mean, stdev, periods, num_simulations, seed_sequence, variance_reduction=None,
+                 dtype=np.float64):
+
+        self.mean = mean
+        self.stdev = stdev
+        self.periods = periods
+        self.num_simulations = num_simulations
+        self.seed_sequence = seed_sequence
+        self.variance_reduction = variance_reduction
+        self.dtype = dtype
+
+    def simulate(self):
+
+        return random_walk_simulations(mean=self.mean,
+                                       stdev=self.stdev,
+                                       periods=self.periods,
+                                       num_simulations=self.num_simulations,
+                                       random_state=np.random.default_rng(self.seed_sequence),
+                                       variance_reduction=self.variance_reduction,
+                                       dtype=self.dtype)
+
+
+DEFAULT_PERCENTILES = (75, 50, 25, 10, 5, 1)
+
+
+def wealth_distributions(x, percentiles=DEFAULT_PERCENTILES, method='exact', relative_accuracy=0.005,
+                         alive_counts=None):
     '''
     calculate the distribution statistics for a set of wealth trajectories over time. 
-    for each period, calculate the mean, median, 25th, 10th, 5th and 1st percentiles of wealth across
-    the simulated wealth trajectories
+    for each period, calculate the mean, median and the requested percentiles (by default the 75th, 50th,
+    25th, 10th, 5th and 1st) of wealth across the simulated wealth trajectories
+
+    method selects how the percentiles are computed:
+        'exact': all percentiles are taken from a single partition of each period's values
+        'sketch': approximate percentiles from a QuantileSketch, which are accurate to roughly
+            relative_accuracy and only need a fixed number of bins per period (useful for very large
+            numbers of simulations)
+
+    alive_counts optionally gives the number of simulations to use in each period, for simulations that are
+    sorted by the sampled death of the user (see calc_wealth_trajectory()). The statistics of period i are
+    then taken over the first alive_counts[i] simulations only (nan if there are none). With the 'sketch'
+    method the wealth after death must be nan, as calc_wealth_trajectory() returns it, since the sketch
+    leaves nan values out.
 
+    float32 wealth is summarized without upcasting the whole array: the means are accumulated in float64 and the
+    percentiles are taken in float32. The statistics are returned as float64.
 
     let the input x be an array of size [num_simulations x num_periods].
     :return: a dictionary of arrays. For example, given an input array x that represents 
@@ -281,28 +1260,178 @@ def wealth_distributions(x):
     mean across the m simulations for the ith period. 
     '''
 
-    means = np.mean(x, axis=0)
-    medians = np.median(x, axis=0)
-    p75 = np.percentile(x, 75, axis=0)
-    p50 = np.percentile(x, 50, axis=0)
-    p25 = np.percentile(x, 25, axis=0)
-    p10 = np.percentile(x, 10, axis=0)
-    p5 = np.percentile(x, 5, axis=0)
-    p1 = np.percentile(x, 1, axis=0)
+    assert method in ['exact', 'sketch'], 'error: invalid method: {}'.format(method)
+
+    if method == 'sketch':
+        sketch = QuantileSketch(num_periods=x.shape[1], relative_accuracy=relative_accuracy)
+        sketch.add(x)
+        distributions = sketch.distributions(percentiles)
+        if alive_counts is not None:
+            assert (sketch.period_counts() == alive_counts).all(), \
+                'error: the wealth after death must be nan to be left out of the sketch'
+        return distributions
+
+    # the median is reported alongside the requested percentiles, so compute it in the same pass
+    all_percentiles = sorted(set(percentiles) | {50})
+
+    if alive_counts is None:
+        values = np.percentile(x, all_percentiles, axis=0).astype(np.float64, copy=False)
+        means = np.mean(x, axis=0, dtype=np.float64)
+    else:
+        values = np.full((len(all_percentiles), x.shape[1]), np.nan)
+        means = np.full(x.shape[1], np.nan)
+        for i, n in enumerate(alive_counts):
+            if n > 0:
+                values[:, i] = np.percentile(x[:n, i], all_percentiles)
+                means[i] = np.mean(x[:n, i], dtype=np.float64)
+
+    values = dict(zip(all_percentiles, values))
+
+    distributions = {'mean': means,
+                     'median': values[50]}
+    for p in percentiles:
+        distributions[p] = values[p]
+
+    return distributions
+
+
+class QuantileSketch:
+    '''
+    a mergeable sketch of the distribution of wealth in every period, for computing approximate percentiles
+    without keeping all the simulations in memory.
+
+    values are counted in logarithmically sized bins (the same scheme as DDSketch) so that any percentile
+    read back from the sketch is within relative_accuracy of the simulated value at that rank. Negative values
+    are binned symmetrically and values with a magnitude below min_value share a single zero bin. Bin counts (and the
+    running sums used for the means) are simply added when sketches are merged, so simulations can be added
+    in blocks, or sketched separately and merged, and give the same counts as sketching them all at once.
+
+    nan values (eg the wealth after the death of the user, see calc_wealth_trajectory()) are left out, so every
+    period has its own count of values. The statistics of a period without any values are nan.
+    '''
+
+    def __init__(self, num_periods, relative_accuracy=0.005, min_value=1e-6, max_value=1e15):
+
+        self.num_periods = num_periods
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+
+        # bins are laid out as [negative keys (descending) | zero bin | positive keys (ascending)]
+        self.min_key = int(np.ceil(np.log(min_value) / self.log_gamma))
+        self.num_keys = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.min_key + 1
+        self.num_bins = 2 * self.num_keys + 1
+
+        self.counts = np.zeros((num_periods, self.num_bins), dtype=np.int64)
+        self.sums = np.zeros(num_periods)
+        self.count = 0
+
+    def _bin_index(self, x):
+
+        magnitude = np.abs(x)
+        key = np.ceil(np.log(np.maximum(magnitude, self.min_value)) / self.log_gamma) - self.min_key + 1
+        key = np.clip(key, 1, self.num_keys).astype(np.int64)
+        key[magnitude < self.min_value] = 0
+
+        return self.num_keys + np.sign(x).astype(np.int64) * key
+
+    def _bin_value(self, index):
+
+        key = np.abs(index - self.num_keys)
+        value = 2 * self.gamma ** (key + self.min_key - 1) / (self.gamma + 1)
+        value[key == 0] = 0.0
+
+        return np.sign(index - self.num_keys) * value
 
-    return {'mean': means,
-            'median': medians,
-            75: p75,
-            50: p50,
-            25: p25,
-            10: p10,
-            5: p5,
-            1: p1
-            }
+    def add(self, x, block_size=65536):
+        '''
+        add a [num_simulations x num_periods] array of values to the sketch
+        '''
+
+        assert x.shape[1] == self.num_periods, 'error: expected {} periods, got {}'.format(self.num_periods, x.shape[1])
+
+        offsets = np.arange(self.num_periods) * self.num_bins
+
+        for start in range(0, x.shape[0], block_size):
+            block = x[start:start + block_size]
+            missing = np.isnan(block)
+
+            if missing.any():
+                index = (self._bin_index(np.where(missing, 0, block)) + offsets)[~missing]
+                self.sums += np.where(missing, 0, block).sum(axis=0, dtype=np.float64)
+            else:
+                index = (self._bin_index(block) + offsets).ravel()
+                self.sums += block.sum(axis=0, dtype=np.float64)
+
+            self.counts += np.bincount(index, minlength=self.counts.size).reshape(self.counts.shape)
+
+        self.count += x.shape[0]
+
+        return self
+
+    def merge(self, other):
+        '''
+        fold the counts of another sketch (built with the same settings) into this one
+        '''
+
+        assert self.counts.shape == other.counts.shape and self.gamma == other.gamma, \
+            'error: can only merge sketches with the same settings'
+
+        self.counts += other.counts
+        self.sums += other.sums
+        self.count += other.count
+
+        return self
+
+    def period_counts(self):
+        return self.counts.sum(axis=1)
+
+    def mean(self):
+
+        counts = self.period_counts()
+
+        return np.where(counts > 0, self.sums / np.maximum(counts, 1), np.nan)
+
+    def percentile(self, p):
+        '''
+        approximate p-th percentile (0-100) of every period, as an array of size [num_periods]
+        '''
+
+        cum_counts = np.cumsum(self.counts, axis=1)
+        counts = cum_counts[:, -1]
+
+        # as with np.percentile, interpolate linearly between the values at the ranks either side of
+        # p / 100 * (count - 1). The value at a given rank is read from the bin that holds it
+        rank = p / 100 * np.maximum(counts - 1, 0)
+        lower_rank = np.floor(rank)
+        fraction = rank - lower_rank
+
+        lower = self._bin_value((cum_counts <= lower_rank[:, np.newaxis]).sum(axis=1))
+        upper = self._bin_value((cum_counts <= np.minimum(lower_rank + 1, counts - 1)[:, np.newaxis]).sum(axis=1))
+
+        return np.where(counts > 0, lower + fraction * (upper - lower), np.nan)
+
+    def distributions(self, percentiles=DEFAULT_PERCENTILES):
+        '''
+        the same dictionary of statistics as wealth_distributions()
+        '''
+
+        distributions = {'mean': self.mean(),
+                         'median': self.percentile(50)}
+        for p in percentiles:
+            distributions[p] = self.percentile(p)
+
+        return distributions
 
 
 def dollar_as_text(x):
-    if x >= 1000000:
+    # eg the wealth at an age that no simulation reaches alive (with sampled lifetimes)
+    if np.isnan(x):
+        return 'n/a'
+    elif x >= 1000000:
         text = round((x / 1000000), 2)
         if text.is_integer():
             text = int(text)
@@ -318,54 +1447,224 @@ def dollar_as_text(x):
 def percent_as_text(x):
     return str(round(x*100,2)) + '%'
 
+def load_mortality_table(path='data/mortality_table.csv'):
+    '''
+    read the actuarial mortality table, indexed by current age, with the 1 year forward survival
+    probability averaged across the male and female statistics
+    '''
+
+    mortality_table = pd.read_csv(path)
+    mortality_table.set_index('current_age', inplace=True)
+    mortality_table['forward_survival_prob_1y'] = 1 - ((mortality_table['forward_death_prob_1y_male'] +
+                                                       mortality_table['forward_death_prob_1y_female']) / 2)
+
+    return mortality_table
+
+
+# the survival probabilities reported for every user, by name
+SURVIVAL_THRESHOLDS = {'25%': 0.25, '10%': 0.10, '5%': 0.05, '1%': 0.01}
+
+
+class SurvivalIndex:
+    '''
+    the mortality table precomputed for every starting age: the conditional cumulative survival
+    curve and the ages at which it falls to the standard survival thresholds, so that a lookup per
+    request is a dictionary access instead of a cumprod and a linear scan
+
+    arbitrary thresholds (and arrays of starting ages) are answered by horizon_ages()
+    '''
+
+    def __init__(self, mortality_table, thresholds=SURVIVAL_THRESHOLDS):
+
+        self.ages = mortality_table.index.to_numpy()
+        self.positions = {int(age): i for i, age in enumerate(self.ages)}
+        num_ages = len(self.ages)
+
+        # curves[i, j] is the probability of surviving from age i through the j-th following age
+        # (zero past the end of the table)
+        survival_probs = mortality_table['forward_survival_prob_1y'].to_numpy()
+        self.curves = np.zeros((num_ages, num_ages))
+        for i in range(num_ages):
+            self.curves[i, :num_ages - i] = np.cumprod(survival_probs[i:])
+
+        # expected age at death (average between male and female statistics)
+        expected_years = mortality_table['expected_years_till_death_male'].to_numpy() + \
+                         mortality_table['expected_years_till_death_female'].to_numpy()
+        expected_years /= 2
+
+        horizons = self.horizon_ages(self.ages, list(thresholds.values()))
+
+        self.stats = {}
+        for i, age in enumerate(self.ages):
+            user_mortality = {'expected_age_at_death': int(expected_years[i]) + int(age)}
+            for j, name in enumerate(thresholds):
+                user_mortality[name] = int(horizons[i, j])
+            self.stats[int(age)] = user_mortality
+
+    def survival_curve(self, user_age):
+        '''
+        :return: the ages from the user's age to the end of the table and the cumulative probability
+        of surviving through each of them
+        '''
+        i = self.positions[int(user_age)]
+        return self.ages[i:], self.curves[i, :len(self.ages) - i]
+
+    def horizon_ages(self, user_ages, thresholds):
+        '''
+        the first age at which the survival probability conditional on each starting age falls to or
+        below each threshold (999 if the table ends first)
+
+        :return: an int array of shape [len(user_ages) x len(thresholds)]
+        '''
+
+        user_ages = np.atleast_1d(user_ages).astype(int)
+        thresholds = np.atleast_1d(thresholds)
+
+        # work on the distinct starting ages only (batches repeat them a lot)
+        unique_ages, inverse = np.unique(user_ages, return_inverse=True)
+        positions = np.array([self.positions[age] for age in unique_ages])
+
+        # the curves are non-increasing, so the offset of the first probability at or below a
+        # threshold is the number of probabilities above it
+        offsets = (self.curves[positions][:, :, None] > thresholds[None, None, :]).sum(axis=1)
+        remaining = (len(self.ages) - positions)[:, None]
+
+        horizons = self.ages[np.minimum(positions[:, None] + offsets, len(self.ages) - 1)]
+        horizons = np.where(offsets < remaining, horizons, 999)
+
+        return horizons[inverse.ravel()]
+
+    def sample_death_periods(self, user_age, num_periods, num_simulations, random_state=None):
+        '''
+        draw the age at death of the user in every simulation from the survival curve conditional on their
+        current age, by inverse transform sampling: with u uniform in [0, 1), the user is alive through the
+        ages whose survival probability is above u.
+
+        random_state is an optional np.random.Generator (or RandomState), by default the global numpy random
+        state is used.
+
+        :return: int array of size [num_simulations] with the last period (index from the user's age) in which
+        the user is alive, capped at num_periods - 1 and sorted in decreasing order (see
+        calc_wealth_trajectory())
+        '''
+
+        if random_state is None:
+            random_state = np.random
+
+        ages, survival_curve = self.survival_curve(user_age)
+        uniforms = random_state.uniform(size=num_simulations)
+
+        # the curve is non-increasing, so the number of ages survived is the number of probabilities above u
+        death_periods = np.searchsorted(-survival_curve, -uniforms, side='left')
+        death_periods = np.minimum(death_periods, num_periods - 1)
+
+        return np.ascontiguousarray(np.sort(death_periods)[::-1])
+
+    def user_mortality_stats(self, user_age):
+        '''
+        :return: the user's mortality statistics (expected age at death and the ages at the
+        standard survival thresholds) and the list of ages from the user's age to the end of the table
+        '''
+        i = self.positions[int(user_age)]
+        return dict(self.stats[int(user_age)]), self.ages[i:].tolist()
+
+
+# process-wide store of the SurvivalIndex of every mortality table given to get_user_mortality_stats(), keyed by
+# the id of the table (the table is kept with its index so that the id cannot be reused by another table)
+survival_index_store = {}
+
+
 def get_user_mortality_stats(user_age, mortality_table):
+    '''
+    the user's mortality statistics, from either a mortality table or a precomputed SurvivalIndex. The
+    SurvivalIndex of a table is only built the first time the table is given, so the table must not be
+    modified afterwards.
 
-    user_mortality = {}
+    :return: a dictionary with the expected age at death and the ages at which the user is expected
+    to be alive with 25%, 10%, 5% and 1% probability, and the list of ages from the user's age on
+    '''
 
-    # 1. get the expected age at death (average between male and female statistics)
-    expected_age_at_death = mortality_table.loc[user_age, 'expected_years_till_death_male']
-    expected_age_at_death += mortality_table.loc[user_age, 'expected_years_till_death_female']
-    expected_age_at_death /= 2
-    expected_age_at_death = int(expected_age_at_death) + user_age
+    if not isinstance(mortality_table, SurvivalIndex):
+        if id(mortality_table) not in survival_index_store:
+            survival_index_store[id(mortality_table)] = (mortality_table, SurvivalIndex(mortality_table))
+        mortality_table = survival_index_store[id(mortality_table)][1]
 
-    user_mortality['expected_age_at_death'] = expected_age_at_death
+    return mortality_table.user_mortality_stats(user_age)
 
-    # 2. calculate the cumulative survival probabilities
-    # (what age is the user expected to live to with 25%, 5%, 1% probability conditional
-    # on their current age)
 
-    # first, subset the dataset to drop ages that are less than the users expected age at death
-    # (this is going to be the 50% survivial probability)
-    this_mortality_df = mortality_table[user_age:]
-    this_mortality_df['cum_survival_prob'] = this_mortality_df['forward_survival_prob_1y'].cumprod()
+HISTORICAL_RETURNS_CSV = 'data/lt_annual_asset_returns.csv'
+HISTORICAL_RETURN_COLUMNS = ['sp500_including_dividends_real_return', 'ust_3m_real_return', 'ust_real_return',
+                             'bbb_corporate_real_return']
 
-    age_list = this_mortality_df.index.tolist()
-    cum_survival_prob_list = this_mortality_df['cum_survival_prob'].tolist()
+# process-wide store of the parsed historical returns, filled on first use by load_historical_returns()
+historical_returns_store = {}
 
-    user_mortality['25%'] = calc_age_for_survival_prob(0.25, age_list, cum_survival_prob_list)
-    user_mortality['10%'] = calc_age_for_survival_prob(0.10, age_list, cum_survival_prob_list)
-    user_mortality['5%'] = calc_age_for_survival_prob(0.05, age_list, cum_survival_prob_list)
-    user_mortality['1%'] = calc_age_for_survival_prob(0.01, age_list, cum_survival_prob_list)
 
-    return user_mortality, age_list
+def load_historical_returns(path=HISTORICAL_RETURNS_CSV):
+    '''
+    get the historical annual real returns as a dictionary of read-only float64 arrays (plus the int64
+    'year' array), keyed by the column names in HISTORICAL_RETURN_COLUMNS.
 
+    the csv is only parsed once per process. The parsed arrays are also saved to a binary cache next to the
+    csv (eg data/lt_annual_asset_returns.npz) together with the csv's modification time, so that other
+    processes can load the arrays directly. The cache is rebuilt whenever the csv's modification time
+    changes.
+    '''
 
-def get_historical_annual_returns():
+    csv_mtime = os.path.getmtime(path)
+
+    if path in historical_returns_store and historical_returns_store[path]['csv_mtime'] == csv_mtime:
+        return historical_returns_store[path]['returns']
+
+    cache_path = os.path.splitext(path)[0] + '.npz'
+    returns = None
+
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cache:
+            if float(cache['csv_mtime']) == csv_mtime:
+                returns = {col: cache[col] for col in ['year'] + HISTORICAL_RETURN_COLUMNS}
 
-    df = pd.read_csv('data/lt_annual_asset_returns.csv')
-    df = df[['year', 'sp500_including_dividends_real_return',
-             'ust_3m_real_return', 'ust_real_return', 'bbb_corporate_real_return']]
+    if returns is None:
 
-    # return columns are given as strings like '-2.56%'. Convert these to
-    # floats
-    for col in ['sp500_including_dividends_real_return', 'ust_3m_real_return', 'ust_real_return', 'bbb_corporate_real_return']:
-        df[col] = df[col].map(lambda x: float(x.strip('%'))) / 100
+        df = pd.read_csv(path)
 
-    years = df['year'].tolist()
-    sp500 = df['sp500_including_dividends_real_return'].tolist()
-    ust_3m = df['ust_3m_real_return'].tolist()
-    ust = df['ust_real_return'].tolist()
-    bbb = df['bbb_corporate_real_return'].tolist()
+        # return columns are given as strings like '-2.56%'. Convert these to
+        # floats
+        returns = {'year': df['year'].to_numpy(dtype=np.int64)}
+        for col in HISTORICAL_RETURN_COLUMNS:
+            returns[col] = df[col].str.strip('%').astype(float).to_numpy(dtype=np.float64) / 100
+
+        # write the cache to a temporary file first so that other processes never read a partial cache
+        # (if the data folder is read-only, just parse the csv in every process)
+        try:
+            temp_path = '{}.{}.tmp.npz'.format(os.path.splitext(path)[0], os.getpid())
+            np.savez(temp_path, csv_mtime=csv_mtime, **returns)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
+
+    for col in returns:
+        returns[col] = np.ascontiguousarray(returns[col])
+        returns[col].setflags(write=False)
+
+    historical_returns_store[path] = {'csv_mtime': csv_mtime, 'returns': returns}
+
+    return returns
+
+
+def get_historical_annual_returns():
+    '''
+    :return: the years and the sp500, 3 month treasury, treasury and bbb corporate real returns, as read-only
+    numpy arrays (views of the process-wide store, see load_historical_returns())
+    '''
+
+    returns = load_historical_returns()
+
+    years = returns['year']
+    sp500 = returns['sp500_including_dividends_real_return']
+    ust_3m = returns['ust_3m_real_return']
+    ust = returns['ust_real_return']
+    bbb = returns['bbb_corporate_real_return']
 
     return years, sp500, ust_3m, ust, bbb
 
@@ -385,12 +1684,47 @@ def build_single_continuous_sample_series(start_i, max_i, num_periods):
     return index_list
 
 
+def random_integers(high, size, random_state=None):
+    '''
+    draw uniform random integers in [0, high) from a np.random.Generator, a RandomState or (by default) the
+    global numpy random state
+    '''
+
+    if random_state is None:
+        random_state = np.random
+
+    if isinstance(random_state, np.random.Generator):
+        return random_state.integers(0, high, size=size)
+
+    return random_state.randint(0, high, size=size)
+
+
+def gather_sampled_returns(index, year_list, sp500_list, ust_list, set_first_obs_as_zero=True):
+    '''
+    look up the years and returns for an array of sampled indices into the historical series
+
+    :return: three arrays (years, sp500 returns, ust returns) with the same shape as index
+    '''
+
+    all_sampled_years = np.asarray(year_list)[index]
+    all_sampled_sp500_returns = np.asarray(sp500_list)[index]
+    all_sampled_ust_returns = np.asarray(ust_list)[index]
+
+    if set_first_obs_as_zero:
+        all_sampled_years[:, 0] = 0
+        all_sampled_sp500_returns[:, 0] = 0
+        all_sampled_ust_returns[:, 0] = 0
+
+    return all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns
+
+
 def build_continuous_sampled_returns(num_periods_per_simulation,
                                      num_simulations,
                                      year_list,
                                      sp500_list,
                                      ust_list,
-                                     set_first_obs_as_zero=True):
+                                     set_first_obs_as_zero=True,
+                                     random_state=None):
     '''
     build simulated returns based on sampling continuous historical return series
 
@@ -406,6 +1740,9 @@ def build_continuous_sampled_returns(num_periods_per_simulation,
     of 1928. For example, the 90th observation is 2017 and will use a return history based on [2017, 2018 ,2019 , 1928, 
     1929, 1930, ...]
 
+    all the simulations are indexed at once: the wrapped indices are (start + period) modulo the number of
+    samples, and the years and returns are gathered with a single fancy index.
+
     :num_periods: number of periods to simulate
     :num simulations: number of simulations to run
 
@@ -415,37 +1752,12 @@ def build_continuous_sampled_returns(num_periods_per_simulation,
 
     # pick N random numbers (uniform) over all sample periods
     # (for example, if we have 150 samples, we are going to pick a number between 0 and 149)
-    randoms = np.random.randint(0, num_of_samples, size=num_simulations)
-
-    all_sampled_sp500_returns = []
-    all_sampled_ust_returns = []
-    all_sampled_years = []
-
-    for i in randoms:
-        index_list = build_single_continuous_sample_series(start_i=i,
-                                                           max_i=num_of_samples,
-                                                           num_periods=num_periods_per_simulation)
-
-        sampled_years = [year_list[i] for i in index_list]
-        all_sampled_years.append(sampled_years)
+    randoms = random_integers(num_of_samples, size=num_simulations, random_state=random_state)
 
-        sampled_ust = [ust_list[i] for i in index_list]
-        all_sampled_ust_returns.append(sampled_ust)
+    # [num_simulations x num_periods_per_simulation] array of indices into the historical series
+    index = (randoms[:, np.newaxis] + np.arange(num_periods_per_simulation)) % num_of_samples
 
-        sampled_sp500 = [sp500_list[i] for i in index_list]
-        all_sampled_sp500_returns.append(sampled_sp500)
-
-    # convert list of lists to numpy array
-    all_sampled_years = np.array(all_sampled_years)
-    all_sampled_sp500_returns = np.array(all_sampled_sp500_returns)
-    all_sampled_ust_returns = np.array(all_sampled_ust_returns)
-
-    if set_first_obs_as_zero:
-        all_sampled_years[:, 0] = 0
-        all_sampled_sp500_returns[:, 0] = 0
-        all_sampled_ust_returns[:, 0] = 0
-
-    return all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns
+    return gather_sampled_returns(index, year_list, sp500_list, ust_list, set_first_obs_as_zero)
 
 
 def build_discontinuous_sampled_returns(num_periods_per_simulation,
@@ -454,7 +1766,8 @@ def build_discontinuous_sampled_returns(num_periods_per_simulation,
                                         year_list,
                                         sp500_list,
                                         ust_list,
-                                        set_first_obs_as_zero=True):
+                                        set_first_obs_as_zero=True,
+                                        random_state=None):
     '''
     construct simulated return series by sampling small windows from historical data. For example, we may want
     to construct a simualted 42 year return history. We want to sample random 5-year windows in history. We can 
@@ -474,49 +1787,104 @@ def build_discontinuous_sampled_returns(num_periods_per_simulation,
 
     # pick num_sub_periods + 1 random numbers (uniform) over all sample periods
     num_of_samples = len(year_list)
-    randoms = np.random.randint(0, num_of_samples, size=[
-                                num_simulations, num_sub_periods])
+    randoms = random_integers(num_of_samples, size=[num_simulations, num_sub_periods], random_state=random_state)
+
+    # expand every window start into sub_sample_length wrapped indices, string the windows of each
+    # simulation together and trim any extra samples
+    index = (randoms[:, :, np.newaxis] + np.arange(sub_sample_length)) % num_of_samples
+    index = index.reshape(num_simulations, num_sub_periods * sub_sample_length)
+    index = index[:, :num_periods_per_simulation]
+
+    return gather_sampled_returns(index, year_list, sp500_list, ust_list, set_first_obs_as_zero)
+
+
+def build_stationary_sampled_returns(num_periods_per_simulation,
+                                     mean_block_length,
+                                     num_simulations,
+                                     year_list,
+                                     sp500_list,
+                                     ust_list,
+                                     set_first_obs_as_zero=True,
+                                     random_state=None):
+    '''
+    construct simulated return series with the stationary bootstrap (Politis and Romano, 1994). This is like
+    build_discontinuous_sampled_returns() but the windows have random lengths: in every period a new window
+    is started at a random year with probability 1 / mean_block_length, otherwise the simulation continues
+    with the year after the previous one (wrapping around at the end of the history). Window lengths are
+    therefore geometric with mean mean_block_length (any number of years from 1), which keeps the serial
+    correlation of the history without the simulated series depending on where fixed windows start and end.
+    '''
 
-    all_sampled_sp500_returns = []
-    all_sampled_ust_returns = []
-    all_sampled_years = []
+    assert mean_block_length >= 1, 'error: mean_block_length {} is less than 1 year'.format(mean_block_length)
 
-    for i in randoms:
+    if random_state is None:
+        random_state = np.random
 
-        # build a single simulation that consists of num_periods_per_simulation
-        index_list = []
-        for random_num in i:
+    num_of_samples = len(year_list)
+    periods = np.arange(num_periods_per_simulation)
 
-            # based on the random num, get the next sub_sample_length numbers
-            # (if the random num is 14 and sub_sample_length=6, then make a list
-            # of [14,15,16])
-            one_window = build_single_continuous_sample_series(start_i=random_num,
-                                                               max_i=num_of_samples,
-                                                               num_periods=sub_sample_length)
+    # a random start year for every period, and whether a new window starts in that period
+    # (the first period always starts a window)
+    starts = random_integers(num_of_samples, size=[num_simulations, num_periods_per_simulation],
+                             random_state=random_state)
+    # (a new window starts when a uniform draw is below 1 / mean_block_length)
+    new_window = random_state.uniform(size=[num_simulations, num_periods_per_simulation]) < 1.0 / mean_block_length
+    new_window[:, 0] = True
 
-            index_list = index_list + one_window
+    # the period in which the current window of each simulation started
+    window_start = np.maximum.accumulate(np.where(new_window, periods, 0), axis=1)
 
-        # trim any extra samples from the simulation
-        index_list = index_list[:num_periods_per_simulation]
+    # continue counting from the start year of the current window
+    start_year = np.take_along_axis(starts, window_start, axis=1)
+    index = (start_year + periods - window_start) % num_of_samples
 
-        # record this one simulation
+    return gather_sampled_returns(index, year_list, sp500_list, ust_list, set_first_obs_as_zero)
 
-        sampled_years = [year_list[i] for i in index_list]
-        all_sampled_years.append(sampled_years)
 
-        sampled_ust = [ust_list[i] for i in index_list]
-        all_sampled_ust_returns.append(sampled_ust)
+# the historical returns of the assets in the joint bootstrap and multi-asset plans: equity, treasuries and
+# corporate bonds
+JOINT_RETURN_COLUMNS = ['sp500_including_dividends_real_return', 'ust_real_return', 'bbb_corporate_real_return']
 
-        sampled_sp500 = [sp500_list[i] for i in index_list]
-        all_sampled_sp500_returns.append(sampled_sp500)
 
-    all_sampled_years = np.array(all_sampled_years)
-    all_sampled_sp500_returns = np.array(all_sampled_sp500_returns)
-    all_sampled_ust_returns = np.array(all_sampled_ust_returns)
+def historical_return_moments(columns=JOINT_RETURN_COLUMNS):
+    '''
+    the means, standard deviations and correlation matrix of the historical annual real returns, eg to calibrate
+    correlated_random_walk_simulations()
+    '''
+
+    returns = load_historical_returns()
+    x = np.column_stack([returns[col] for col in columns])
+
+    return x.mean(axis=0), x.std(axis=0, ddof=1), np.corrcoef(x, rowvar=False)
+
+
+def build_joint_sampled_returns(num_periods_per_simulation,
+                                num_simulations,
+                                columns=JOINT_RETURN_COLUMNS,
+                                set_first_obs_as_zero=True,
+                                random_state=None):
+    '''
+    build simulated returns of several assets by sampling continuous historical return series (as in
+    build_continuous_sampled_returns()). All the assets of a simulation are sampled from the same years, which
+    keeps the correlation between the assets (and the serial correlation of every asset) of the history.
+
+    :return: the sampled years, as a [num_simulations x num_periods_per_simulation] array, and the returns, as a
+    [num_simulations x num_periods_per_simulation x len(columns)] array
+    '''
+
+    returns = load_historical_returns()
+    num_of_samples = len(returns['year'])
+
+    randoms = random_integers(num_of_samples, size=num_simulations, random_state=random_state)
+    index = (randoms[:, np.newaxis] + np.arange(num_periods_per_simulation)) % num_of_samples
+
+    # [num_samples x num_assets] history, gathered for every simulation and period at once
+    history = np.column_stack([returns[col] for col in columns])
+    all_sampled_years = returns['year'][index]
+    all_sampled_returns = history[index]
 
     if set_first_obs_as_zero:
         all_sampled_years[:, 0] = 0
-        all_sampled_sp500_returns[:, 0] = 0
-        all_sampled_ust_returns[:, 0] = 0
+        all_sampled_returns[:, 0] = 0
 
-    return all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns
+    return all_sampled_years, all_sampled_returns
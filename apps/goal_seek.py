@@ -0,0 +1,156 @@
+'''
+goal seek: find the plan input that reaches a target probability of success, eg the minimum annual saving or
+the maximum annual spending for which 90% of the simulations never run out of money.
+
+every candidate value is planned on the same simulated market returns (common random numbers), so the
+probability of success is a deterministic and monotone function of the value and can be bisected. Each round
+evaluates a batch of candidates at once with a stacked [candidates x simulations] wealth recursion and keeps
+the interval between the two candidates that bracket the target, so the interval shrinks by a factor of
+(num_candidates + 1) per round.
+'''
+
+import numpy as np
+
+from apps import functions as fn
+
+
+# the plan inputs that can be solved for, and whether the probability of success increases with them
+GOAL_VARIABLES = {'user_save': True, 'user_spend': False}
+
+
+def candidate_contributions(params, variable, values):
+    '''
+    the contribution schedule of the plan for every candidate value of variable
+
+    :return: [num_candidates x num_periods] array
+    '''
+
+    contributions = []
+    for value in values:
+        plan_inputs = {'user_save': params['user_save'], 'user_spend': params['user_spend']}
+        plan_inputs[variable] = value
+        contributions.append(fn.calc_contributions(user_age=params['user_age'],
+                                                   retirement_age=params['user_retirement_age'],
+                                                   final_age=params['user_mortality']['1%'],
+                                                   user_save=plan_inputs['user_save'],
+                                                   user_spend=plan_inputs['user_spend'],
+                                                   user_social_security_age=params['user_social_security_age'],
+                                                   user_social_security_benefit=params['user_social_security_benefit']))
+
+    return np.array(contributions)
+
+
+def success_probabilities(params, contributions, equity_returns, bond_returns):
+    '''
+    the probability of success (never running out of money, as in financial_plan()) of the plan under every
+    row of contributions, on shared market returns. The floating point operations are the same as in
+    calc_wealth_trajectory(), so the probabilities are identical to planning every candidate on its own.
+
+    :param contributions: [num_candidates x num_periods] array
+    :param equity_returns: [num_simulations x num_periods] array
+    :param bond_returns: [num_periods] array, or [num_simulations x num_periods] array
+    :return: array of size [num_candidates]
+    '''
+
+    num_candidates, num_periods = contributions.shape
+    num_simulations = equity_returns.shape[0]
+
+    allocations = fn.plan_allocations(params)
+    bond_returns = fn.as_schedule(bond_returns, num_periods, 'bond returns')
+
+    wealths = np.full((num_candidates, num_simulations), float(params['user_wealth']))
+    scratch = np.empty((num_candidates, num_simulations))
+    ruined = np.zeros((num_candidates, num_simulations), dtype=bool)
+
+    for i in range(num_periods):
+
+        equity_growth = (1 + equity_returns[:, i]) * allocations[i]
+        bond_growth = (1 + bond_returns[:, i]) * (1.0 - allocations[i])
+
+        # wealths = (wealth * equity growth) + (wealth * bond growth) + contribution
+        np.multiply(wealths, bond_growth, out=scratch)
+        np.multiply(wealths, equity_growth, out=wealths)
+        np.add(wealths, scratch, out=wealths)
+        np.add(wealths, contributions[:, i, np.newaxis], out=wealths)
+
+        ruined |= wealths <= 0
+
+    return 1.0 - ruined.mean(axis=1)
+
+
+def goal_seek(params, equity_returns, bond_returns, variable='user_save', target_probability=0.9, low=0, high=None,
+              num_candidates=4, tolerance=100):
+    '''
+    find the minimum user_save (or the maximum user_spend) in [low, high] for which the probability of success
+    is at least target_probability, to within tolerance dollars.
+
+    high defaults to twice the larger of the user's savings and spending (and at least $100,000).
+
+    :return: a dictionary with
+        'value': the solution (None if no value in [low, high] reaches the target)
+        'probability_of_success': the probability of success at the solution (or at the best value tried)
+        'status': 'solved', 'infeasible' (no value reaches the target) or 'at_bound' (the solution is low or
+            high, so the answer may lie outside of the search range)
+        'rounds' and 'evaluations': the number of batches and of candidate plans evaluated
+    '''
+
+    assert variable in GOAL_VARIABLES, 'error: cannot solve for {}'.format(variable)
+    increasing = GOAL_VARIABLES[variable]
+
+    if high is None:
+        high = 2 * max(params['user_save'], params['user_spend'], 50000)
+
+    def evaluate(values):
+        contributions = candidate_contributions(params, variable, values)
+        result['rounds'] += 1
+        result['evaluations'] += len(values)
+        return success_probabilities(params, contributions, equity_returns, bond_returns)
+
+    result = {'rounds': 0, 'evaluations': 0}
+
+    # the first round includes both ends of the search range
+    values = np.unique(np.linspace(low, high, num_candidates + 2).round().astype(int))
+    probabilities = evaluate(values)
+    meets = probabilities >= target_probability
+
+    # the target is not reached anywhere in the range, or already at the end of the range
+    if not meets.any():
+        best = np.argmax(probabilities)
+        result.update(value=None, probability_of_success=float(probabilities[best]), status='infeasible')
+        return result
+    if meets[0 if increasing else -1]:
+        best = 0 if increasing else -1
+        result.update(value=int(values[best]), probability_of_success=float(probabilities[best]), status='at_bound')
+        return result
+
+    while True:
+
+        # the bracket around the boundary between the candidates that meet the target and those that do not
+        # (the saving is the first candidate that meets it, the spending the last)
+        if increasing:
+            j = np.argmax(meets) - 1
+        else:
+            j = len(meets) - 1 - np.argmax(meets[::-1])
+        lower, upper = values[j], values[j + 1]
+        lower_probability, upper_probability = probabilities[j], probabilities[j + 1]
+
+        if upper - lower <= tolerance:
+            break
+
+        # the next batch of candidates splits the bracket evenly
+        candidates = np.unique(np.linspace(lower, upper, num_candidates + 2).round().astype(int))
+        candidates = candidates[(candidates > lower) & (candidates < upper)]
+        if len(candidates) == 0:
+            break
+
+        values = np.concatenate([[lower], candidates, [upper]])
+        probabilities = np.concatenate([[lower_probability], evaluate(candidates), [upper_probability]])
+        meets = probabilities >= target_probability
+
+    if increasing:
+        result.update(value=int(upper), probability_of_success=float(upper_probability))
+    else:
+        result.update(value=int(lower), probability_of_success=float(lower_probability))
+    result['status'] = 'solved'
+
+    return result
@@ -0,0 +1,173 @@
+import collections
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+
+# params that do not change the simulated plan and are left out of the cache key
+EXCLUDED_PARAMS = ['current_year']
+
+
+def normalize(x):
+    '''
+    convert a (nested) params value into plain json-serializable python types so that equal inputs always
+    give the same cache key (eg np.int64(40) and 40, or a tuple and a list)
+    '''
+
+    if isinstance(x, dict):
+        return {str(k): normalize(v) for k, v in x.items()}
+    elif isinstance(x, (list, tuple, np.ndarray)):
+        return [normalize(v) for v in x]
+    elif isinstance(x, np.generic):
+        return x.item()
+    elif isinstance(x, float) and x.is_integer():
+        return int(x)
+    else:
+        return x
+
+
+def plan_key(params, contributions, seed):
+    '''
+    build the cache key of a plan from the normalized params, the contribution schedule and the rng seed
+
+    :return: a hex digest, as string
+    '''
+
+    key = {'params': normalize({k: v for k, v in params.items() if k not in EXCLUDED_PARAMS}),
+           'contributions': normalize(contributions),
+           'seed': normalize(seed)}
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class PlanCache:
+    '''
+    a bounded LRU cache of plan results with a time-to-live, optionally backed by a directory on local disk
+    that is shared by all the gunicorn workers on the same machine.
+
+    lookups check the in-process LRU first, then the disk store. Entries older than ttl seconds are treated
+    as missing. Hit and miss counts are available from stats().
+    '''
+
+    def __init__(self, max_entries=512, ttl=24 * 60 * 60, directory=None, max_disk_entries=10000):
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, '{}.pkl'.format(key))
+
+    def _read_disk(self, key):
+
+        path = self._disk_path(key)
+
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _write_disk(self, key, value):
+
+        path = self._disk_path(key)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+
+            # drop the oldest entries once the store grows past its limit
+            files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith('.pkl')]
+            if len(files) > self.max_disk_entries:
+                files.sort(key=os.path.getmtime)
+                for f in files[:len(files) - self.max_disk_entries]:
+                    os.remove(f)
+        except OSError:
+            pass
+
+    def get(self, key):
+        '''
+        :return: the cached value, or None if there is no fresh entry for the key
+        '''
+
+        with self.lock:
+
+            if key in self.entries:
+                created, value = self.entries[key]
+                if time.time() - created <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.counts['hits'] += 1
+                    return value
+                del self.entries[key]
+
+        value = self._read_disk(key) if self.directory is not None else None
+
+        with self.lock:
+            if value is None:
+                self.counts['misses'] += 1
+            else:
+                self.counts['disk_hits'] += 1
+                self._store(key, value)
+
+        return value
+
+    def _store(self, key, value):
+
+        self.entries[key] = (time.time(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def set(self, key, value):
+
+        with self.lock:
+            self._store(key, value)
+
+        if self.directory is not None:
+            self._write_disk(key, value)
+
+    def get_or_compute(self, key, compute):
+        '''
+        return the cached value for the key, or call compute() and cache its result
+        '''
+
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+
+        return value
+
+    def stats(self):
+
+        with self.lock:
+            stats = dict(self.counts)
+            stats['size'] = len(self.entries)
+
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+
+        return stats
+
+    def clear(self):
+
+        with self.lock:
+            self.entries.clear()
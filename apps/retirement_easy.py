@@ -6,6 +6,8 @@ import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 
 import datetime
+import flask
+import os
 import pandas as pd
 import numpy as np
 import scipy.stats
@@ -14,6 +16,10 @@ from utilities import *
 import config
 from app import app
 from apps import functions as fn
+from apps import goal_seek
+from apps import plan_cache
+from apps import scenario_bank
+from apps import sensitivity
 import visdcc
 
 # source data for actuarial calculations
@@ -162,10 +168,264 @@ def serve_layout():
 
 layout = serve_layout
 
-mortality_df = pd.read_csv('data/mortality_table.csv')
-mortality_df.set_index('current_age', inplace=True)
-mortality_df['forward_survival_prob_1y'] = 1 - ((mortality_df['forward_death_prob_1y_male'] +
-                                                 mortality_df['forward_death_prob_1y_female']) / 2)
+mortality_df = fn.load_mortality_table()
+survival_index = fn.SurvivalIndex(mortality_df)
+
+
+# plans are cached by their inputs so that repeated requests (eg the default values) are not simulated again.
+# Set PLAN_CACHE_DIR to also share the cache between the gunicorn workers through a local directory
+SIMULATION_SEED = 0
+
+# the random walk of the equity returns and the constant bond return of the simulations (a scenario bank is only
+# used if it was built with the same ones, see open_scenario_bank())
+EQUITY_MEAN = 0.08
+EQUITY_STDEV = 0.14
+BOND_RETURN = 0.01
+
+cache = plan_cache.PlanCache(max_entries=512,
+                             ttl=24 * 60 * 60,
+                             directory=os.environ.get('PLAN_CACHE_DIR'))
+
+
+@app.server.route('/retirement-planning-in-easy-mode/cache-stats')
+def plan_cache_stats():
+    return flask.jsonify(cache.stats())
+
+
+# checkpoints of the savings phase of the plans (see fn.AccumulationCheckpoint()), so that plans that only change
+# the spending in retirement do not simulate the savings periods again. They hold arrays of the size of the
+# simulations, so they are kept in memory only
+RETIREMENT_PARAMS = ['user_spend', 'user_social_security_age', 'user_social_security_benefit']
+checkpoints = plan_cache.PlanCache(max_entries=64, ttl=24 * 60 * 60)
+checkpoint_seconds_saved = {'seconds': 0.0}
+
+
+@app.server.route('/retirement-planning-in-easy-mode/checkpoint-stats')
+def checkpoint_stats():
+    return flask.jsonify(dict(checkpoints.stats(), seconds_saved=checkpoint_seconds_saved['seconds']))
+
+
+# the paths of scenario banks that do not match the page's simulations (reported once per process)
+mismatched_banks = set()
+
+
+def open_scenario_bank(params):
+    '''
+    the scenario bank of the page (params['scenario_bank']), or None if it has not been built or it does not
+    match the simulations of the page: the random walk and bond return (EQUITY_MEAN, EQUITY_STDEV and
+    BOND_RETURN), and enough simulations and periods. Requests never build the bank, the web dyno builds it when
+    it starts (see the Procfile).
+    '''
+
+    path = params['scenario_bank']
+
+    try:
+        bank = scenario_bank.load_scenario_bank(path)
+    except FileNotFoundError:
+        return None
+
+    metadata = bank.metadata
+    matches = np.isclose([metadata['mean'], metadata['stdev'], metadata['bond_return']],
+                         [EQUITY_MEAN, EQUITY_STDEV, BOND_RETURN], rtol=0, atol=1e-12).all() and \
+        metadata['num_simulations'] >= params['num_simulations'] and metadata['max_periods'] >= params['num_periods']
+
+    if not matches:
+        if path not in mismatched_banks:
+            mismatched_banks.add(path)
+            print('scenario bank at {} does not match the simulations of the page, simulating per request: '
+                  '{}'.format(path, metadata))
+        return None
+
+    return bank
+
+
+def simulate_market_returns(params):
+    '''
+    simulate the equity and bond returns used by every plan of a request
+
+    :return: equity returns (an array, or a block source in high precision mode), bond returns and the
+    distribution of cumulative market growth if it is already known (otherwise None)
+    '''
+
+    # plain random walk plans reuse the paths of the precomputed scenario bank (display_page() only keeps the bank
+    # in params for those plans, and only if it matches them)
+    if params['scenario_bank'] is not None:
+
+        bank = scenario_bank.load_scenario_bank(params['scenario_bank'])
+        equity_returns, bond_returns = bank.returns(params['num_periods'], params['num_simulations'])
+
+        rates_of_return = None
+        if params['num_simulations'] == bank.num_simulations:
+            rates_of_return = bank.rates_of_return(params['num_periods'])
+
+        return (equity_returns.astype(params['simulation_dtype'], copy=False),
+                bond_returns.astype(params['simulation_dtype'], copy=False), rates_of_return)
+
+    random_state = np.random.default_rng(params['seed'])
+
+    # simulate equity market returns based on a random walk
+    if params['high_precision']:
+
+        # generate the simulations block by block as the plans are calculated rather than all at once
+        equity_return_sim1 = fn.RandomWalkBlocks(mean=EQUITY_MEAN,
+                                                 stdev=EQUITY_STDEV,
+                                                 periods=params['num_periods'],
+                                                 num_simulations=params['num_simulations'],
+                                                 seed=params['seed'],
+                                                 block_size=params['simulation_block_size'],
+                                                 variance_reduction=params['variance_reduction'],
+                                                 dtype=params['simulation_dtype'])
+
+    else:
+        num_random_walk_simulations = params['num_simulations']
+        if params['historical_sampling']:
+            num_random_walk_simulations = params['num_simulations'] // 3
+
+        equity_return_sim1 = fn.random_walk_simulations(mean=EQUITY_MEAN,
+                                                        stdev=EQUITY_STDEV,
+                                                        periods=params[
+                                                            'num_periods'],
+                                                        num_simulations=num_random_walk_simulations,
+                                                        random_state=random_state,
+                                                        variance_reduction=params['variance_reduction'],
+                                                        dtype=params['simulation_dtype'])
+
+    # set bond market returns
+    # (bond returns are the same in every simulation so keep them as a [num_periods] array that is
+    # broadcast against the equity returns)
+    bond_return_sim1 = np.full(params['num_periods'], fill_value=BOND_RETURN, dtype=params['simulation_dtype'])
+    bond_return_sim1[0] = 0.0
+
+    equity_returns = equity_return_sim1
+    bond_returns = bond_return_sim1
+
+    # OFF BY DEFAULT, USE RANDOM WALK RETURNS FOR SIMULATIONS
+    # (THE HISTORICAL RETURNS ARE CONSIDERED TO BE TOO HIGH TO BE USED FOR MODELING FUTURE RETURNS)
+    # when switched on, add simulations that sample the historical return series to the random walk
+    # simulations (the samplers are vectorized, see benchmarks/historical_sampling.py)
+    if params['historical_sampling'] and not params['high_precision']:
+
+        # get historical annual returns to use in sampling
+        years, sp500, ust_3m, ust, bbb = fn.get_historical_annual_returns()
+
+        # simulate market returns based on continuous historical sampling
+        _, equity_return_sim2, bond_return_sim2 = fn.build_continuous_sampled_returns(num_periods_per_simulation=params['num_periods'],
+                                                                                      num_simulations=num_random_walk_simulations,
+                                                                                      year_list=years,
+                                                                                      sp500_list=sp500,
+                                                                                      ust_list=ust,
+                                                                                      random_state=random_state)
+
+        # simulate market returns based on discontinuous historical sampling
+        _, equity_return_sim3, bond_return_sim3 = fn.build_discontinuous_sampled_returns(num_periods_per_simulation=params['num_periods'],
+                                                                                         sub_sample_length=5,
+                                                                                         num_simulations=num_random_walk_simulations,
+                                                                                         year_list=years,
+                                                                                         sp500_list=sp500,
+                                                                                         ust_list=ust,
+                                                                                         random_state=random_state)
+
+        # the historical bond returns differ across simulations, so the random walk bond returns
+        # need one row per simulation as well
+        equity_returns = np.concatenate(
+            [equity_return_sim1, equity_return_sim2, equity_return_sim3], axis=0).astype(params['simulation_dtype'],
+                                                                                         copy=False)
+        bond_returns = np.concatenate(
+            [np.broadcast_to(bond_return_sim1, equity_return_sim1.shape), bond_return_sim2, bond_return_sim3],
+            axis=0).astype(params['simulation_dtype'], copy=False)
+
+        # sampled lifetimes are matched to the simulations in order and adaptive plans use the first
+        # simulations, so mix the three kinds of simulations
+        if params['lifetime_sampling'] or params['adaptive_simulations']:
+            order = random_state.permutation(equity_returns.shape[0])
+            equity_returns, bond_returns = equity_returns[order], bond_returns[order]
+
+    return equity_returns, bond_returns, None
+
+
+def goal_seek_text(goals, target_probability):
+    '''
+    describe the goal seek results for the saving and the spending (see goal_seek.goal_seek())
+    '''
+
+    save, spend = goals['user_save'], goals['user_spend']
+
+    options = []
+    if save['status'] != 'infeasible':
+        options.append('save at least {} per year until you retire'.format(fn.dollar_as_text(save['value'])))
+    if spend['status'] == 'at_bound':
+        options.append('spend {} or more per year in retirement'.format(fn.dollar_as_text(spend['value'])))
+    elif spend['status'] != 'infeasible':
+        options.append('spend at most {} per year in retirement'.format(fn.dollar_as_text(spend['value'])))
+
+    if not options:
+        return "Saving more or spending less alone won't give you a {:.0%} chance of never running out of money.".format(
+            target_probability)
+
+    return 'To have a {:.0%} chance of never running out of money, you could {}.'.format(target_probability,
+                                                                                     ', or '.join(options))
+
+
+def sensitivity_figures(params, grids):
+    '''
+    make the heatmaps of the probability of success over savings x spending and over retirement age x spending
+    (see sensitivity.py), with the user's plan marked
+
+    :return: a list of figures (without the retirement age heatmap if the user is past all of its ages)
+    '''
+
+    def heatmap(x, y, z, x_title, y_title, title, hover):
+        return {'data': [{'type': 'heatmap',
+                          'x': list(x),
+                          'y': list(y),
+                          'z': np.asarray(z).tolist(),
+                          'zmin': 0,
+                          'zmax': 1,
+                          'colorscale': 'RdYlGn',
+                          'colorbar': {'tickformat': '.0%'},
+                          'hovertemplate': hover + '<br>Probability of success: %{z:.0%}<extra></extra>'},
+                         {'type': 'scatter',
+                          'x': [params['user_spend']],
+                          'y': [params['user_retirement_age'] if y_title == 'Retirement Age' else params['user_save']],
+                          'mode': 'markers',
+                          'marker': {'symbol': 'x', 'size': 12, 'color': 'black'},
+                          'name': 'Your Plan',
+                          'showlegend': False}],
+                'layout': {'title': '<b>{}</b>'.format(title),
+                           'titlefont': {'color': '#267B83'},
+                           'xaxis': {'title': x_title, 'tickformat': '$,.0f'},
+                           'yaxis': {'title': y_title},
+                           'height': 400,
+                           'margin': {'t': 40, 'r': 10}}}
+
+    figures = [heatmap(grids['spends'], grids['saves'], grids['save_spend'],
+                       'Spending per Year', 'Savings per Year', 'Chance of Never Running Out of Money',
+                       'Spending: %{x:$,.0f}<br>Savings: %{y:$,.0f}')]
+    figures[0]['layout']['yaxis']['tickformat'] = '$,.0f'
+
+    if len(grids['retirement_ages']) > 0:
+        figures.append(heatmap(grids['spends'], grids['retirement_ages'], grids['age_spend'],
+                               'Spending per Year', 'Retirement Age', 'Chance of Never Running Out of Money by Retirement Age',
+                               'Spending: %{x:$,.0f}<br>Retirement age: %{y}'))
+
+    return figures
+
+
+def sample_death_periods(params):
+    '''
+    draw the user's lifetime in every simulation from the mortality table (if lifetime sampling is switched
+    on), using a random stream separate from the market returns
+
+    :return: the last period alive in every simulation, sorted in decreasing order, or None
+    '''
+
+    if not params['lifetime_sampling'] or params['high_precision']:
+        return None
+
+    return survival_index.sample_death_periods(params['user_age'],
+                                               num_periods=params['num_periods'],
+                                               num_simulations=params['num_simulations'],
+                                               random_state=np.random.default_rng([params['seed'], 1]))
 
 
 @app.callback(dash.dependencies.Output('javascript', 'run'),
@@ -248,6 +508,51 @@ def display_page(n_clicks,
                   'user_social_security_age': 67,
                   'user_social_security_benefit': 18000,
                   'num_simulations': 10000,
+                  'wealth_engine': 'inplace',
+
+                  # high precision plans simulate 1,000,000 paths in blocks so that memory use stays bounded
+                  'high_precision': False,
+                  'high_precision_num_simulations': 1000000,
+                  'simulation_block_size': 50000,
+
+                  # add simulations sampled from historical returns to the random walk simulations. The samplers
+                  # are fast enough for production (benchmarks/historical_sampling.py), but this stays off because
+                  # the historical returns are considered too high for modeling future returns
+                  'historical_sampling': False,
+
+                  # only simulate as many paths (up to num_simulations, in batches) as needed for the probability
+                  # of success and the 5th percentile of wealth at retirement of the user's plan to be precise
+                  # (see fn.adaptive_financial_plan(), not used in high precision mode or with sampled lifetimes).
+                  # The scenarios, the goal seek and the heatmaps then run on the same paths as the user's plan
+                  'adaptive_simulations': True,
+                  'adaptive_batch_size': 2000,
+
+                  # the probability of success that the suggested saving and spending reach (see goal_seek.py)
+                  'goal_seek_target': 0.9,
+
+                  # the success probability heatmaps over savings x spending and retirement age x spending
+                  # (see sensitivity.py)
+                  'sensitivity_grid_size': sensitivity.GRID_SIZE,
+                  'sensitivity_retirement_ages': sensitivity.RETIREMENT_AGES,
+
+                  # variance reduction mode of the random walk simulations (None, 'antithetic', 'moment_matching'
+                  # or 'sobol', see fn.random_walk_simulations()). The precomputed scenario bank only has
+                  # independent draws, so the other modes simulate per request
+                  'variance_reduction': None,
+
+                  # precision of the simulated returns and wealth ('float64' or 'float32'). float32 halves the
+                  # memory of the simulations, see fn.float32_accuracy_report() and benchmarks/float32.py
+                  'simulation_dtype': 'float64',
+
+                  # end every simulation at a sampled age at death instead of the 1% survival age
+                  # (wealth_stats['lifetime'] then has the probability of outliving the money)
+                  'lifetime_sampling': False,
+
+                  # every plan uses the same seed so that identical inputs give identical (cacheable) plans
+                  'seed': SIMULATION_SEED,
+
+                  # reuse the market paths of the precomputed scenario bank (None to simulate per request)
+                  'scenario_bank': scenario_bank.DEFAULT_BANK_PATH,
 
                   # derive extra parameters for modelling wealth trajectory
                   'years_to_retire': int(user_retirement_age) - int(user_age),
@@ -258,7 +563,7 @@ def display_page(n_clicks,
 
         # expected age at death based on mortality tables
         user_mortality, age_list = fn.get_user_mortality_stats(
-            params['user_age'], mortality_df)
+            params['user_age'], survival_index)
 
         params['user_mortality'] = user_mortality
         params['age_list'] = age_list
@@ -273,45 +578,163 @@ def display_page(n_clicks,
             'user_retirement_age'] - params['user_age']
         params['idx_at_final_age'] = user_mortality['1%'] - params['user_age']
 
-        # 3. simulate equity market returns based on a random walk
-        equity_return_sim1 = fn.random_walk_simulations(mean=0.08,
-                                                        stdev=0.14,
-                                                        periods=params[
-                                                            'num_periods'],
-                                                        num_simulations=params['num_simulations'])
-
-        # set bond market returns
-        bond_return_sim1 = np.full_like(equity_return_sim1, fill_value=0.01)
-        bond_return_sim1[:, 0] = 0.0
-
-        # INACTIVE FOR NOW, USE RANDOM WALK RETURNS FOR SIMULATIONS
-        # (THE HISTORICAL RETURNS ARE CONSIDERED TP BE TOO HIGH TO BE USED FOR MODELING FUTURE RETURNS)
-        # # get historical annual returns to use in sampling
-        # years, sp500, ust_3m, ust, bbb = fn.get_historical_annual_returns()
-        # num_historical_samples = len(years)
-
-        # # simulate market returns based on continuous historical sampling
-        # _, equity_return_sim2, bond_return_sim2 = fn.build_continuous_sampled_returns(num_periods_per_simulation=num_periods,
-        #                                                                               num_simulations=num_simulations,
-        #                                                                               year_list=years,
-        #                                                                               sp500_list=sp500,
-        # ust_list=ust)
-
-        # # simulate market returns based on discontinuous historical sampling
-        # _, equity_return_sim3, bond_return_sim3 = fn.build_discontinuous_sampled_returns(num_periods_per_simulation=num_periods,
-        #                                                                                  sub_sample_length=5,
-        #                                                                                  num_simulations=num_simulations,
-        #                                                                                  year_list=years,
-        #                                                                                  sp500_list=sp500,
-        # ust_list=ust)
-
-        # equity_returns = np.concatenate(
-        #     [equity_return_sim1, equity_return_sim2, equity_return_sim2], axis=0)
-        # bond_returns = np.concatenate(
-        #     [bond_return_sim1, bond_return_sim2, bond_return_sim2], axis=0)
-
-        equity_returns = equity_return_sim1
-        bond_returns = bond_return_sim1
+        # 3. set the number of simulations
+        # (the returns are only simulated if a plan is not already in the plan cache, see plan() below)
+        if params['high_precision']:
+            params['num_simulations'] = params['high_precision_num_simulations']
+        elif params['historical_sampling']:
+            params['num_simulations'] = 3 * params['num_simulations']
+
+        # plain random walk plans reuse the paths of the scenario bank if it matches the page, else they simulate
+        # per request. The plan cache key has the seed of the paths: the bank's seed and metadata when the plans use
+        # the bank (so a rebuilt bank does not serve the plans of the old one), the page's seed when they simulate
+        bank = None
+        if params['scenario_bank'] is not None and not params['high_precision'] and not params['historical_sampling'] \
+                and params['variance_reduction'] is None:
+            bank = open_scenario_bank(params)
+        if bank is None:
+            params['scenario_bank'] = None
+            simulation_seed = params['seed']
+        else:
+            simulation_seed = {'seed': params['seed'], 'bank_seed': bank.seed, 'bank': bank.key}
+
+        market_returns = {}
+
+        def simulated_market_returns():
+            '''
+            the market returns (and sampled lifetimes) shared by all the plans of the request, simulated the first
+            time a plan is not in the plan cache
+            '''
+
+            if not market_returns:
+                market_returns['equity'], market_returns['bond'], market_returns['growth'] = simulate_market_returns(params)
+                market_returns['death_periods'] = sample_death_periods(params)
+
+            return market_returns
+
+        def shared_market_returns(num_simulations):
+            '''
+            the market returns of the first num_simulations simulated paths (all of them in high precision mode)
+            '''
+
+            market_returns = simulated_market_returns()
+            equity_returns = market_returns['equity']
+
+            if not isinstance(equity_returns, np.ndarray) or num_simulations >= equity_returns.shape[0]:
+                return market_returns
+
+            # (sampled lifetimes are sorted, so they cannot be cut short, see sample_death_periods())
+            assert market_returns['death_periods'] is None, 'error: sampled lifetimes need all the simulations'
+
+            bond_returns = market_returns['bond']
+            if bond_returns.ndim == 2:
+                bond_returns = bond_returns[:num_simulations]
+
+            return {'equity': equity_returns[:num_simulations], 'bond': bond_returns, 'growth': None,
+                    'death_periods': None}
+
+        def accumulation_checkpoint(plan_params, plan_contributions):
+            '''
+            the checkpoint of the savings phase of the plan, shared by all the plans with the same inputs up to
+            retirement (None if it cannot be used, ie in high precision mode, with sampled lifetimes or if the user
+            is already retired)
+            '''
+
+            if params['high_precision'] or params['lifetime_sampling'] or plan_params['idx_at_retirement'] <= 0:
+                return None
+
+            def compute():
+                market_returns = shared_market_returns(plan_params['num_simulations'])
+                return fn.AccumulationCheckpoint(plan_params, plan_contributions, market_returns['equity'],
+                                                 market_returns['bond'],
+                                                 engine=plan_params.get('wealth_engine', 'loop'))
+
+            key = plan_cache.plan_key({k: v for k, v in plan_params.items() if k not in RETIREMENT_PARAMS},
+                                      plan_contributions[:plan_params['idx_at_retirement']], simulation_seed)
+
+            checkpoint = checkpoints.get(key)
+            if checkpoint is None:
+                checkpoint = compute()
+                checkpoints.set(key, checkpoint)
+            else:
+                checkpoint_seconds_saved['seconds'] += checkpoint.build_seconds
+
+            return checkpoint
+
+        def plan(plan_params, plan_contributions, adaptive=False):
+            '''
+            run financial_plan() for the given params and contributions on the first plan_params['num_simulations']
+            paths, or return the cached result of an identical plan. All the plans of a request share the same
+            simulated market returns.
+
+            with adaptive=True, the plan only uses as many of the paths as it needs (see fn.adaptive_financial_plan(),
+            the number used is in wealth_stats['adaptive'])
+            '''
+
+            def compute():
+
+                market_returns = shared_market_returns(plan_params['num_simulations'])
+                checkpoint = accumulation_checkpoint(plan_params, plan_contributions)
+
+                if adaptive and not params['high_precision'] and not params['lifetime_sampling']:
+                    total_user_save, _, _, _, _, trajectories, wealth_stats = fn.adaptive_financial_plan(
+                        plan_params, plan_contributions, market_returns['equity'], market_returns['bond'],
+                        batch_size=params['adaptive_batch_size'], rates_of_return=market_returns['growth'],
+                        checkpoint=checkpoint)
+                else:
+                    total_user_save, _, _, _, _, trajectories, wealth_stats = fn.financial_plan(
+                        plan_params, plan_contributions, market_returns['equity'], market_returns['bond'],
+                        rates_of_return=market_returns['growth'], death_periods=market_returns['death_periods'],
+                        checkpoint=checkpoint)
+
+                return total_user_save, trajectories, wealth_stats
+
+            return cache.get_or_compute(plan_cache.plan_key(dict(plan_params, adaptive_simulations=adaptive),
+                                                            plan_contributions, simulation_seed), compute)
+
+        def solve(variable):
+            '''
+            goal seek the minimum saving (variable='user_save') or the maximum spending ('user_spend') that reaches
+            the target probability of success, on the market returns of the request (cached like the plans)
+            '''
+
+            def compute():
+
+                market_returns = shared_market_returns(shared_params['num_simulations'])
+
+                return goal_seek.goal_seek(shared_params, market_returns['equity'], market_returns['bond'],
+                                           variable=variable,
+                                           target_probability=params['goal_seek_target'])
+
+            return cache.get_or_compute(plan_cache.plan_key(dict(shared_params, goal_seek=variable), contributions,
+                                                            simulation_seed), compute)
+
+        def sensitivity_grids():
+            '''
+            the probability of success over the savings x spending and the retirement age x spending grids, on the
+            market returns of the request (cached like the plans)
+            '''
+
+            def compute():
+
+                market_returns = shared_market_returns(shared_params['num_simulations'])
+                equity_returns, bond_returns = market_returns['equity'], market_returns['bond']
+
+                saves = sensitivity.grid_values(params['user_save'], params['sensitivity_grid_size'])
+                spends = sensitivity.grid_values(params['user_spend'], params['sensitivity_grid_size'])
+                retirement_ages, age_spend = sensitivity.retirement_age_grid(
+                    shared_params, equity_returns, bond_returns, spends,
+                    retirement_ages=params['sensitivity_retirement_ages'])
+
+                return {'saves': saves,
+                        'spends': spends,
+                        'save_spend': sensitivity.success_probability_grid(shared_params, equity_returns, bond_returns,
+                                                                           saves, spends),
+                        'retirement_ages': retirement_ages,
+                        'age_spend': age_spend}
+
+            return cache.get_or_compute(plan_cache.plan_key(dict(shared_params, sensitivity=True), contributions,
+                                                            simulation_seed), compute)
 
         # 5. calculate wealth scenarios
 
@@ -328,8 +751,13 @@ def display_page(n_clicks,
                                                   'user_social_security_age'],
                                               user_social_security_benefit=params['user_social_security_benefit'])
 
-        total_user_save, starting_wealth_array, allocations, contributions, wealths, trajectories, wealth_stats = fn.financial_plan(params, contributions, equity_returns,
-                                                                                                                                    bond_returns)
+        total_user_save, trajectories, wealth_stats = plan(params, contributions, adaptive=params['adaptive_simulations'])
+
+        # every other plan of the request (the scenarios, the goal seek and the heatmaps) runs on the same paths as
+        # the user's plan, ie on the first paths only if the plan stopped early, so that they compare like for like
+        shared_params = dict(params)
+        if 'adaptive' in wealth_stats:
+            shared_params['num_simulations'] = wealth_stats['adaptive']['num_simulations']
 
         # 2. build a dataframe that we'll use for making charts that show wealth over time
         # the ages range from the current user age to the age that the user has a 1% probability of reaching
@@ -630,8 +1058,7 @@ def display_page(n_clicks,
                                                        'user_social_security_age'],
                                                    user_social_security_benefit=params['user_social_security_benefit'])
 
-            _, _, _, _, _, _, _wealth_stats = fn.financial_plan(
-                params, _contributions, equity_returns, bond_returns)
+            _, _, _wealth_stats = plan(shared_params, _contributions)
 
             for pct in [75, 'mean', 25, 5]:
                 scenario_analysis['save_more'][i]['age_at_negative_wealth'][
@@ -658,11 +1085,10 @@ def display_page(n_clicks,
                                                        'user_social_security_age'],
                                                    user_social_security_benefit=params['user_social_security_benefit'])
 
-            new_params = params.copy()
+            new_params = shared_params.copy()
             new_params['idx_at_retirement'] = new_params[
                 'user_retirement_age'] + (1 + i) - params['user_age']
-            _, _, _, _, _, _, _wealth_stats = fn.financial_plan(
-                new_params, _contributions, equity_returns, bond_returns)
+            _, _, _wealth_stats = plan(new_params, _contributions)
             for pct in [75, 'mean', 25, 5]:
                 scenario_analysis['work_longer'][i]['age_at_negative_wealth'][
                     pct] = _wealth_stats[pct]['age_at_negative_wealth']
@@ -689,8 +1115,7 @@ def display_page(n_clicks,
                                                        'user_social_security_age'],
                                                    user_social_security_benefit=params['user_social_security_benefit'])
 
-            _, _, _, _, _, _, _wealth_stats = fn.financial_plan(
-                params, _contributions, equity_returns, bond_returns)
+            _, _, _wealth_stats = plan(shared_params, _contributions)
             for pct in [75, 'mean', 25, 5]:
                 scenario_analysis['spend_less'][i]['age_at_negative_wealth'][
                     pct] = _wealth_stats[pct]['age_at_negative_wealth']
@@ -719,6 +1144,20 @@ def display_page(n_clicks,
                                       'Run out of Money at': [scenario_analysis['spend_less'][i]['age_at_negative_wealth'][5] for i in range(4)]
                                       })
 
+        # the saving and the spending that would reach the target probability of success
+        # (the goal seek needs the simulations as an array, so it is skipped in high precision mode)
+        goal_text = ''
+        if not params['high_precision']:
+            goal_text = goal_seek_text({variable: solve(variable) for variable in goal_seek.GOAL_VARIABLES},
+                                       params['goal_seek_target'])
+
+        # the success probability heatmaps (also skipped in high precision mode)
+        sensitivity_graphs = []
+        if not params['high_precision']:
+            sensitivity_graphs = [dbc.Col(html.Div(dcc.Graph(id='sensitivity-chart-{}'.format(i), figure=figure)),
+                                          width=6)
+                                  for i, figure in enumerate(sensitivity_figures(params, sensitivity_grids()))]
+
         outlook_header = "You're in Excellent Shape!"
         outlook_note = "You are on track for financial security for the rest of your life"
         expected_terminal_wealth = wealth_stats['mean']['wealth_at_end']
@@ -989,6 +1428,25 @@ def display_page(n_clicks,
 
                 ]),
 
+                html.Br(),
+
+                html.Details([
+
+                    html.Summary('View Sensitivity Heatmaps'),
+
+                    html.Br(),
+                    html.Br(),
+
+                    html.Div('''How your chance of never running out of money changes with what you save, what you
+                        spend and when you retire (the X marks your plan)''', className='text-note',
+                             style={'color': '#267B83'}),
+
+                    html.Br(),
+
+                    dbc.Row(sensitivity_graphs)
+
+                ]),
+
 
 
             ], style={'margin-left': '8%', 'margin-right': '8%'}),
@@ -1014,6 +1472,10 @@ def display_page(n_clicks,
                 html.Div('''You can't control the market, but you do have three main avenues for reducing the chance you'd 
                     run out of money during retirement, even in the pessimistic scenario''', className='white-text text-note'),
 
+                html.Br(),
+
+                html.Div(goal_text, className='white-text text-note'),
+
                 html.Br(),
                 html.Br(),
                 html.Br(),
@@ -0,0 +1,229 @@
+'''
+a fixed bank of simulated market return paths, built once offline and memory-mapped by every process that
+plans with it. The market paths do not depend on the user, so with a bank only the user-specific
+contribution/allocation recursion runs per request.
+
+build the bank from the root of the repo with
+
+    python -m apps.scenario_bank --path data/scenario_bank --num-simulations 10000
+
+the web dyno builds the default bank when it starts, before the workers are forked (see the Procfile), so
+that no request has to build it.
+'''
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from apps import functions as fn
+
+
+DEFAULT_BANK_PATH = 'data/scenario_bank'
+
+# enough periods for any starting age in data/mortality_table.csv
+DEFAULT_MAX_PERIODS = 120
+
+# open banks, keyed by path, so that every process maps each bank only once
+open_banks = {}
+
+
+class ScenarioBank:
+    '''
+    a read-only view of a scenario bank on disk. Return paths are memory-mapped, so the operating system
+    shares a single copy between all the processes that use the bank.
+
+    key identifies the paths of the bank (a hash of its metadata, which includes the seed), eg for the cache
+    keys of the plans that use them.
+    '''
+
+    def __init__(self, path):
+
+        with open(os.path.join(path, 'metadata.json')) as f:
+            self.metadata = json.load(f)
+
+        self.path = path
+        self.key = hashlib.sha256(json.dumps(self.metadata, sort_keys=True).encode('utf-8')).hexdigest()
+        self.seed = self.metadata['seed']
+        self.num_simulations = self.metadata['num_simulations']
+        self.max_periods = self.metadata['max_periods']
+
+        self.equity = np.load(os.path.join(path, 'equity_returns.npy'), mmap_mode='r')
+        self.bond = np.load(os.path.join(path, 'bond_returns.npy'))
+
+        with np.load(os.path.join(path, 'growth_distributions.npz')) as f:
+            self.growth = {key_from_name(name): f[name] for name in f.files}
+
+    def returns(self, num_periods, num_simulations=None):
+        '''
+        :return: the equity returns ([num_simulations x num_periods] memory-mapped view) and the bond
+        returns ([num_periods] array) of the first num_simulations paths
+        '''
+
+        num_simulations = self.num_simulations if num_simulations is None else num_simulations
+
+        assert num_periods <= self.max_periods, \
+            'error: the bank has {} periods, {} requested'.format(self.max_periods, num_periods)
+        assert num_simulations <= self.num_simulations, \
+            'error: the bank has {} simulations, {} requested'.format(self.num_simulations, num_simulations)
+
+        return self.equity[:num_simulations, :num_periods], self.bond[:num_periods]
+
+    def rates_of_return(self, num_periods):
+        '''
+        :return: the distribution of cumulative market growth (as from wealth_distributions()) for a plan
+        with num_periods periods, over all the paths in the bank
+        '''
+
+        return {k: v[:num_periods - 1] for k, v in self.growth.items()}
+
+
+def name_from_key(key):
+    return 'p{}'.format(key) if isinstance(key, int) else key
+
+
+def key_from_name(name):
+    return int(name[1:]) if name.startswith('p') else name
+
+
+@contextlib.contextmanager
+def bank_lock(path, exclusive):
+    '''
+    hold a lock on the bank at path (a lock file next to the bank directory): exclusive while a bank is built
+    and moved into place, shared while a bank is opened, so that only one process builds a missing bank and
+    no process opens a bank while it is being replaced. If the lock file cannot be created (eg on a read-only
+    file system, where no bank can be built either) the bank is used without a lock.
+    '''
+
+    try:
+        lock_file = open('{}.lock'.format(path.rstrip('/')), 'a')
+    except OSError:
+        yield
+        return
+
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def bank_exists(path):
+    return os.path.exists(os.path.join(path, 'metadata.json'))
+
+
+def build_scenario_bank(path=DEFAULT_BANK_PATH, num_simulations=10000, max_periods=DEFAULT_MAX_PERIODS, seed=0,
+                        mean=0.08, stdev=0.14, bond_return=0.01, block_size=50000, if_missing=False):
+    '''
+    simulate a bank of random walk equity returns (as on the retirement page) and constant bond returns and
+    write it to the path directory. The paths are simulated and written in blocks so memory stays bounded.
+    The bank is built in a temporary directory and then moved into place, so processes never see a
+    partially written bank, and the whole build holds the exclusive bank_lock(), so concurrent builds run one
+    after the other. With if_missing, a bank that already exists (eg built by another process while this one
+    waited for the lock) is kept.
+    '''
+
+    with bank_lock(path, exclusive=True):
+        if not (if_missing and bank_exists(path)):
+            write_scenario_bank(path, num_simulations, max_periods, seed, mean, stdev, bond_return, block_size)
+
+    open_banks.pop(path, None)
+
+    return load_scenario_bank(path)
+
+
+def write_scenario_bank(path, num_simulations, max_periods, seed, mean, stdev, bond_return, block_size):
+    '''
+    build the bank (see build_scenario_bank(), which holds the lock)
+    '''
+
+    temp_path = '{}.{}.tmp'.format(path.rstrip('/'), os.getpid())
+    os.makedirs(temp_path)
+
+    # 1. equity returns, written block by block into a .npy file
+    equity = np.lib.format.open_memmap(os.path.join(temp_path, 'equity_returns.npy'), mode='w+',
+                                       dtype=np.float64, shape=(num_simulations, max_periods))
+    growth = np.lib.format.open_memmap(os.path.join(temp_path, 'growth.npy'), mode='w+',
+                                       dtype=np.float64, shape=(num_simulations, max_periods - 1))
+
+    start = 0
+    for block in fn.RandomWalkBlocks(mean, stdev, max_periods, num_simulations, seed=seed, block_size=block_size):
+        equity[start:start + len(block)] = block
+        growth[start:start + len(block)] = np.cumprod(block[:, 1:] + 1, axis=1)
+        start += len(block)
+
+    equity.flush()
+    del equity
+
+    # 2. bond returns are the same in every simulation
+    bond = np.full(max_periods, fill_value=bond_return)
+    bond[0] = 0.0
+    np.save(os.path.join(temp_path, 'bond_returns.npy'), bond)
+
+    # 3. the distribution of cumulative market growth in each period, a few periods at a time
+    # (each chunk holds about as many values as 8 blocks of a single period)
+    columns = max(1, (block_size * 8) // num_simulations)
+    chunks = [fn.wealth_distributions(np.asarray(growth[:, i:i + columns]))
+              for i in range(0, max_periods - 1, columns)]
+    growth_distributions = {name_from_key(k): np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+    np.savez(os.path.join(temp_path, 'growth_distributions.npz'), **growth_distributions)
+
+    del growth
+    os.remove(os.path.join(temp_path, 'growth.npy'))
+
+    with open(os.path.join(temp_path, 'metadata.json'), 'w') as f:
+        json.dump({'num_simulations': num_simulations,
+                   'max_periods': max_periods,
+                   'seed': seed,
+                   'mean': mean,
+                   'stdev': stdev,
+                   'bond_return': bond_return}, f, indent=2)
+
+    # swap the new bank into place
+    if os.path.exists(path):
+        old_path = '{}.{}.old'.format(path.rstrip('/'), os.getpid())
+        os.rename(path, old_path)
+        os.rename(temp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(temp_path, path)
+
+
+def load_scenario_bank(path=DEFAULT_BANK_PATH, build_if_missing=False):
+    '''
+    open the scenario bank at path (once per process). If build_if_missing is set and there is no bank at
+    path yet, build one with the default settings first (only one process builds it, the others wait for it).
+    Without a bank at path, opening it raises FileNotFoundError.
+    '''
+
+    if path not in open_banks:
+
+        if build_if_missing and not bank_exists(path):
+            return build_scenario_bank(path, if_missing=True)
+
+        with bank_lock(path, exclusive=False):
+            open_banks[path] = ScenarioBank(path)
+
+    return open_banks[path]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='build a scenario bank of simulated market returns')
+    parser.add_argument('--path', default=DEFAULT_BANK_PATH)
+    parser.add_argument('--num-simulations', type=int, default=10000)
+    parser.add_argument('--max-periods', type=int, default=DEFAULT_MAX_PERIODS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--if-missing', action='store_true', help='keep the bank at path if there is one')
+    args = parser.parse_args()
+
+    bank = build_scenario_bank(args.path, args.num_simulations, args.max_periods, args.seed,
+                               if_missing=args.if_missing)
+    print('scenario bank at {} ({} simulations x {} periods)'.format(args.path, bank.num_simulations,
+                                                                    bank.max_periods))
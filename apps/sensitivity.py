@@ -0,0 +1,187 @@
+'''
+sensitivity grids: the probability of success (never running out of money, as in financial_plan()) of a plan
+over a grid of annual savings x annual spending, and over a range of retirement ages.
+
+every cell of a grid is planned on the same simulated market returns. Wealth is linear in the contributions,
+so for a given retirement age the wealth of any (save, spend) cell is
+
+    wealth = base wealth + save * (wealth of saving $1 a year) - spend * (wealth of spending $1 a year)
+
+where the three trajectories on the right are simulated once. A simulation runs out of money at a given saving
+as soon as the spending reaches (base wealth + save * wealth of saving $1) / (wealth of spending $1) in any
+period, so the success of every spending level follows from one minimum per simulation instead of one
+wealth recursion per cell.
+'''
+
+import numpy as np
+
+from apps import functions as fn
+
+
+# the number of values on each axis of the savings x spending grid
+GRID_SIZE = 20
+
+# the retirement ages of the retirement age grid
+RETIREMENT_AGES = list(range(55, 71))
+
+
+def grid_values(value, num_points=GRID_SIZE):
+    '''
+    the values on a grid axis: evenly spaced from 0 to twice the user's value (and at least $20,000), rounded
+    to the nearest $100
+    '''
+
+    return np.linspace(0, 2 * max(value, 10000), num_points).round(-2).astype(int)
+
+
+def unit_contributions(params, retirement_age=None):
+    '''
+    the contribution schedule of the plan split into its parts, so that the schedule for any saving and
+    spending is base + user_save * per_save - user_spend * per_spend (see fn.calc_contributions())
+
+    :return: base (social security only), per_save and per_spend arrays of size [num_periods]
+    '''
+
+    if retirement_age is None:
+        retirement_age = params['user_retirement_age']
+
+    def schedule(user_save, user_spend, user_social_security_benefit):
+        return fn.calc_contributions(user_age=params['user_age'],
+                                     retirement_age=retirement_age,
+                                     final_age=params['user_mortality']['1%'],
+                                     user_save=user_save,
+                                     user_spend=user_spend,
+                                     user_social_security_age=params['user_social_security_age'],
+                                     user_social_security_benefit=user_social_security_benefit)
+
+    base = schedule(0, 0, params['user_social_security_benefit'])
+    per_save = schedule(1, 0, 0)
+    per_spend = -schedule(0, 1, 0)
+
+    return base, per_save, per_spend
+
+
+def grid_contributions(params, saves, spends, retirement_age=None):
+    '''
+    the contribution schedule of every cell of the grid, broadcast from unit_contributions()
+
+    :return: [num_saves x num_spends x num_periods] array
+    '''
+
+    base, per_save, per_spend = unit_contributions(params, retirement_age)
+    saves = np.asarray(saves)[:, np.newaxis, np.newaxis]
+    spends = np.asarray(spends)[np.newaxis, :, np.newaxis]
+
+    return base + saves * per_save - spends * per_spend
+
+
+def success_counts(equity_returns, bond_returns, starting_wealth, allocations, base, per_save, per_spend, saves,
+                   spends, engine='loop'):
+    '''
+    count the simulations that never run out of money in every cell of a savings x spending grid. This runs
+    in the worker processes when success_probability_grid() is given an executor.
+
+    :return: [num_saves x num_spends] array of counts
+    '''
+
+    def trajectory(wealth, contributions):
+        return fn.calc_wealth_trajectory(starting_wealth=wealth,
+                                         equity_returns=equity_returns,
+                                         bond_returns=bond_returns,
+                                         allocations=allocations,
+                                         contributions=contributions,
+                                         engine=engine)
+
+    # the wealth at the first saving, and the wealth added by every extra $1 of saving (if there are others)
+    first_wealths = trajectory(float(starting_wealth), base + saves[0] * per_save)
+    if len(saves) > 1:
+        save_wealths = trajectory(0.0, per_save)
+    spend_wealths = trajectory(0.0, per_spend)
+
+    # the wealth spent by $1 of annual spending is positive in retirement (and zero before), it can only be
+    # negative after a period with returns below -100%
+    positive = spend_wealths > 0
+    negative = spend_wealths < 0
+    zero = ~(positive | negative)
+    divisor = np.where(zero, 1.0, spend_wealths)
+
+    spends = np.asarray(spends, dtype=float)
+    counts = np.zeros((len(saves), len(spends)), dtype=int)
+
+    for i, save in enumerate(saves):
+
+        # wealth = wealths - spend * spend_wealths, which runs out (is <= 0) in a period when
+        # spend >= wealths / spend_wealths (or spend <= wealths / spend_wealths if spend_wealths < 0)
+        wealths = first_wealths if i == 0 else first_wealths + (save - saves[0]) * save_wealths
+        ratios = wealths / divisor
+
+        upper = np.where(positive, ratios, np.inf).min(axis=1)
+        lower = np.where(negative, ratios, -np.inf).max(axis=1)
+        ruined = (zero & (wealths <= 0)).any(axis=1)
+
+        success = (spends < upper[:, np.newaxis]) & (spends > lower[:, np.newaxis]) & ~ruined[:, np.newaxis]
+        counts[i] = np.count_nonzero(success, axis=0)
+
+    return counts
+
+
+def success_probability_grid(params, equity_returns, bond_returns, saves, spends, retirement_age=None,
+                             executor=None, chunk_size=2000):
+    '''
+    the probability of success of the plan for every combination of annual saving and spending, on shared
+    market returns.
+
+    the simulations are processed in chunks of chunk_size rows. executor is an optional concurrent.futures
+    executor (eg a ProcessPoolExecutor) that evaluates the chunks in parallel.
+
+    :param equity_returns: [num_simulations x num_periods] array
+    :param bond_returns: [num_periods] array, or [num_simulations x num_periods] array
+    :param retirement_age: the retirement age of the grid (defaults to the user's)
+    :return: [num_saves x num_spends] array
+    '''
+
+    if retirement_age is None:
+        retirement_age = params['user_retirement_age']
+
+    base, per_save, per_spend = unit_contributions(params, retirement_age)
+    allocations = fn.plan_allocations(dict(params, user_retirement_age=retirement_age))
+    bond_returns = fn.as_schedule(bond_returns, len(base), 'bond returns')
+
+    num_simulations = equity_returns.shape[0]
+    starts = list(range(0, num_simulations, chunk_size))
+    equity_chunks = [equity_returns[start:start + chunk_size] for start in starts]
+    if bond_returns.shape[0] == 1:
+        bond_chunks = [bond_returns] * len(starts)
+    else:
+        bond_chunks = [bond_returns[start:start + chunk_size] for start in starts]
+
+    arguments = [equity_chunks, bond_chunks] + [[x] * len(starts) for x in [params['user_wealth'], allocations,
+                                                                              base, per_save, per_spend, saves,
+                                                                              spends,
+                                                                              params.get('wealth_engine', 'loop')]]
+
+    if executor is None:
+        counts = sum(map(success_counts, *arguments))
+    else:
+        counts = sum(executor.map(success_counts, *arguments))
+
+    return counts / num_simulations
+
+
+def retirement_age_grid(params, equity_returns, bond_returns, spends, retirement_ages=RETIREMENT_AGES,
+                        executor=None, chunk_size=2000):
+    '''
+    the probability of success of the plan for every combination of retirement age and annual spending, at the
+    user's annual saving. Retirement ages before the user's age are left out.
+
+    :return: the retirement ages used, and a [num_ages x num_spends] array
+    '''
+
+    retirement_ages = [age for age in retirement_ages if age >= params['user_age']]
+
+    probabilities = np.array([success_probability_grid(params, equity_returns, bond_returns, [params['user_save']],
+                                                       spends, retirement_age=age, executor=executor,
+                                                       chunk_size=chunk_size)[0]
+                              for age in retirement_ages])
+
+    return retirement_ages, probabilities.reshape(len(retirement_ages), len(spends))
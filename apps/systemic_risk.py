@@ -975,7 +975,7 @@ def update_theory_purpose(tab):
 
 
         ```py
-        def absorption_ratio(df: pd.DataFrame, half_life: int) -> np.ndarray:
+        def absorption_ratio(df: pd.DataFrame, half_life: int, check: bool = False) -> np.ndarray:
 
             """
             calculate the sum of weighted variances of the principal components
@@ -983,6 +983,7 @@ def update_theory_purpose(tab):
 
             :param df: returns in the columns and date as index, as dataframe
             :half_life: the half-life to use that parameterizes the decay of exponential weights, as int
+            :param check: check that the total weighted variance of the PCs equals that of the original features
             :return: the cumulative proportion of total variance for each pc, as numpy array
             """
 
@@ -1003,44 +1004,42 @@ def update_theory_purpose(tab):
             # 3. eigen decomposition
             values, vectors = np.linalg.eig(cov_matrix)
 
-            # 4. construct the principal components from the original data and the eigenvectors
-            pcs = X.dot(vectors)
-
-            # pcs is with observations in rows and pc features in columns
-
-            # 5. construct exponential weights
+            # 4. construct exponential weights and the weighted covariance matrix of the features
             num_obs = X.shape[0]
             weights = calc_exponential_weights(num_obs=num_obs, half_life=half_life)
+            weighted_cov = calc_weighted_covariance(X=X, weights=weights)
 
-            # 6. discard the eigenvalues from (3) above (which is the variance of each eigenvector or the sum of squared distances of each element in the eigenvector) and calculate weighted variance for each principal component
-            pc_variances = []
+            # 5. discard the eigenvalues from (3) above and calculate the weighted variance of every principal
+            # component (the pcs are X.dot(vectors)) at once, as the diagonal of vectors' weighted_cov vectors
+            pc_variances = (vectors * weighted_cov.dot(vectors)).sum(axis=0)
 
-            # iterate through each column (principal component)
-            for i in range(pcs.shape[1]):
+            explanatory_power = pc_variances / pc_variances.sum()
+            cum_explanatory_power = explanatory_power.cumsum()
 
-                # calculate weighted variance of the given principal component
-                pc_variances.append(calc_weighted_variance(x=pcs[:, i], weights=weights))
+            # 6. diagnostic: check that the total weighted variance of original features is equal to the total weighted variance of the PCs
+            if check:
+                feature_variances = [calc_weighted_variance(x=X[:, i], weights=weights) for i in range(X.shape[1])]
 
-            total_variance = sum(pc_variances)
-            explanatory_power = np.array(pc_variances) / total_variance
-            cum_explanatory_power = explanatory_power.cumsum()
+                assert np.isclose(
+                    pc_variances.sum(), sum(feature_variances), 0.00001
+                ), """error: pc variance {} does not equal feature
+                variance {}""".format(
+                    pc_variances.sum(), sum(feature_variances)
+                )
 
-            # 7. diagnostic: check that the total weighted variance of original features is equal to the total weighted variance of the PCs
-            feature_variances = []
+            return cum_explanatory_power
 
-            for i in range(X.shape[1]):
+        def calc_weighted_covariance(X: np.array, weights: np.array) -> np.array:
 
-                # calculate weighted variance of the given principal component
-                feature_variances.append(calc_weighted_variance(x=X[:, i], weights=weights))
+            """
+            calc the weighted covariance matrix of the columns of X (observations in rows), with weights that
+            sum to 1. The weighted variance of any linear combination X.dot(v) of the columns is
+            v.dot(covariance).dot(v)
+            """
 
-            assert np.isclose(
-                sum(pc_variances), sum(feature_variances), 0.00001
-            ), """error: pc variance {} does not equal feature
-            variance {}""".format(
-                sum(pc_variances), sum(feature_variances)
-            )
+            deviations = X - weights.dot(X)
 
-            return cum_explanatory_power
+            return (deviations * weights[:, np.newaxis]).T.dot(deviations)
 
         def calc_weighted_variance(x: np.array, weights: np.array) -> float:
 
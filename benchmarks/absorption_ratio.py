@@ -0,0 +1,193 @@
+'''
+time the rolling absorption ratio engine (absorption_ratio.rolling_absorption_ratio()) on the full 1972 to
+today history of data/weighted_and_unweighted_absorption_ratio.csv against one covariance matrix and one
+eigen decomposition per date, and against the reference absorption_ratio() of the methodology tab. The two
+per-date methods are timed on a sample of dates and extrapolated to the full history. The daily refresh
+(absorption_ratio.refresh()) is timed on the last date, from the state saved on the date before, and so is
+the streaming AR shift (absorption_ratio.ARShiftCalculator) against calc_ar_shift() over the whole history.
+The streaming AR shift is checked to match calc_ar_shift() to 1e-12 on the AR history of data/ar_shift.csv.
+
+the industry returns behind the AR are not in the repo, so the returns are simulated from a one factor model
+(a market factor plus independent industry noise) on the dates of the csv, with window - 1 extra dates of
+warm-up before the first one
+
+    python -m benchmarks.absorption_ratio --assets 50 --sample 200
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from apps import absorption_ratio as ar
+from benchmarks import common
+
+
+def simulated_industry_returns(num_assets, seed=0):
+    '''
+    daily returns of num_assets industries on the business days from window - 1 days before the first date of
+    the csv to its last date, with betas between 0.6 and 1.4 to a market factor whose volatility drifts
+    '''
+
+    dates = pd.read_csv('data/weighted_and_unweighted_absorption_ratio.csv', parse_dates=['date'])['date']
+    warmup = pd.bdate_range(end=dates.iloc[0], periods=ar.WINDOW)[:-1]
+    dates = warmup.append(pd.DatetimeIndex(dates))
+
+    rng = np.random.RandomState(seed)
+    volatility = 0.01 * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates))).clip(-1, 1))
+    market = rng.normal(0, 1, len(dates)) * volatility
+    betas = np.linspace(0.6, 1.4, num_assets)
+    noise = rng.normal(0, 0.008, (len(dates), num_assets))
+
+    return pd.DataFrame(market[:, np.newaxis] * betas + noise, index=dates)
+
+
+def per_date_ratio(returns, t, k):
+    '''
+    the AR of one date from its own weighted covariance matrix (np.cov with the exponential weights) and a
+    full symmetric eigen decomposition
+    '''
+
+    x = ar.normalize(returns[t - ar.WINDOW + 1:t + 1])
+    weights = ar.calc_exponential_weights(ar.WINDOW, ar.HALF_LIFE)
+    covariance = np.cov(x.T, aweights=weights, bias=True)
+    eigenvalues = np.linalg.eigvalsh(covariance)
+
+    return eigenvalues[-k:].sum() / np.trace(covariance)
+
+
+def time_refresh(df, ratios):
+    '''
+    time the update of the covariance accumulator (including the AR of the new date, from the saved state)
+    and the whole refresh of the AR and AR shift csvs and of the state with the last date of df, starting
+    from the state on the date before
+
+    :param ratios: the AR of every date of df
+    '''
+
+    history = pd.DataFrame({'date': df.index[ar.WINDOW - 1:-1], 'ar': ratios[ar.WINDOW - 1:-1]})
+    state = ar.refresh_state(df.iloc[:-1], history)
+
+    def update():
+        accumulator = ar.CovarianceAccumulator.from_state(state)
+        accumulator.update(df.values[-1], df.index[-1])
+        return accumulator.ratio()
+
+    update_time, ratio = common.best_of(update)
+    assert np.isclose(ratio, ratios[-1], rtol=0, atol=1e-12), 'error: the refreshed AR differs from the engine'
+
+    with tempfile.TemporaryDirectory() as path:
+        ar_path, shift_path, state_path = [os.path.join(path, name) for name in ['ar.csv', 'shift.csv', 'state.npz']]
+        history.to_csv(ar_path, index=False, date_format='%Y-%m-%d')
+        ar.calc_ar_shift(history).to_csv(shift_path, date_format='%Y-%m-%d')
+        ar.save_state(state_path, **state)
+
+        start = time.perf_counter()
+        ar.refresh(df.iloc[-1:], ar_path, shift_path, state_path)
+        refresh_time = time.perf_counter() - start
+
+    return update_time, refresh_time
+
+
+def time_ar_shift(ratios):
+    '''
+    time the AR shift of the last date: calc_ar_shift() over the whole history, against one update of an
+    ARShiftCalculator that has seen the history before it
+
+    :return: the two times, and the largest difference between the AR shift of the two methods over the history
+    '''
+
+    history = pd.DataFrame({'date': np.arange(len(ratios)), 'ar': ratios})
+
+    full_time, shift = common.best_of(lambda: ar.calc_ar_shift(history))
+
+    calculator = ar.ARShiftCalculator()
+    streamed = np.array([calculator.update(ratio)['ar_shift'] for ratio in ratios[:-1]])
+
+    start = time.perf_counter()
+    last = calculator.update(ratios[-1])
+    update_time = time.perf_counter() - start
+
+    difference = np.nanmax(np.abs(np.append(streamed, last['ar_shift']) - shift['ar_shift'].values))
+
+    return full_time, update_time, difference
+
+
+def check_ar_shift(path='data/ar_shift.csv', tolerance=1e-12):
+    '''
+    assert that the streaming AR shift matches calc_ar_shift() to tolerance on the AR history of path
+
+    :return: the largest difference in any column
+    '''
+
+    history = pd.read_csv(path, parse_dates=['date'])
+    shift = ar.calc_ar_shift(history)
+
+    calculator = ar.ARShiftCalculator()
+    streamed = pd.DataFrame([calculator.update(ratio) for ratio in history['ar'].values])
+
+    columns = ['avg_15', 'avg_252', 'std_252', 'ar_shift']
+    difference = np.nanmax(np.abs(streamed[columns].values - shift[columns].values))
+    assert difference <= tolerance, 'error: the streaming AR shift is {:.1e} from calc_ar_shift() on {}'.format(
+        difference, path)
+    assert (streamed['action'].values == shift['action'].values).all(), \
+        'error: the streaming action differs from calc_ar_shift() on {}'.format(path)
+
+    return difference
+
+
+def main(num_assets, sample_size):
+
+    df = simulated_industry_returns(num_assets)
+    returns = df.values
+    num_dates = len(df) - ar.WINDOW + 1
+    k = ar.num_components(num_assets)
+    sample = np.linspace(ar.WINDOW - 1, len(df) - 1, sample_size).astype(int)
+
+    engine_time, ratios = common.best_of(lambda: ar.rolling_absorption_ratio(returns), repeats=1)
+
+    start = time.perf_counter()
+    per_date = np.array([per_date_ratio(returns, t, k) for t in sample])
+    per_date_time = (time.perf_counter() - start) / sample_size * num_dates
+
+    start = time.perf_counter()
+    for t in sample:
+        ar.absorption_ratio(df.iloc[t - ar.WINDOW + 1:t + 1], ar.HALF_LIFE)
+    reference_time = (time.perf_counter() - start) / sample_size * num_dates
+
+    update_time, refresh_time = time_refresh(df, ratios)
+    full_shift_time, shift_update_time, shift_difference = time_ar_shift(ratios[ar.WINDOW - 1:])
+    csv_shift_difference = check_ar_shift()
+
+    print('{:,} dates ({} to {}), {} industries, top {} components'.format(
+        num_dates, df.index[ar.WINDOW - 1].date(), df.index[-1].date(), num_assets, k))
+    print('max difference from the per-date eigen decomposition: {:.1e}'.format(
+        np.abs(ratios[sample] - per_date).max()))
+    print()
+
+    common.print_table(['method', 'time (s)', 'per date (ms)'],
+                       [[name, '{:.2f}'.format(seconds), '{:.3f}'.format(seconds / num_dates * 1000)]
+                        for name, seconds in [('reference absorption_ratio() (extrapolated)', reference_time),
+                                              ('per-date np.cov + eigvalsh (extrapolated)', per_date_time),
+                                              ('rolling_absorption_ratio()', engine_time)]])
+    print()
+    print('daily refresh of the last date: accumulator update and AR {:.2f} ms, refresh() of the csvs and state '
+          '{:.1f} ms'.format(update_time * 1000, refresh_time * 1000))
+    print('AR shift of the last date: calc_ar_shift() over the history {:.2f} ms, ARShiftCalculator.update() '
+          '{:.1f} us (max difference over the history {:.0e})'.format(full_shift_time * 1000, shift_update_time * 1e6,
+                                                                      shift_difference))
+    print('max difference between the streaming AR shift and calc_ar_shift() on data/ar_shift.csv: {:.0e}'.format(
+        csv_shift_difference))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--assets', type=int, default=50)
+    parser.add_argument('--sample', type=int, default=200)
+    args = parser.parse_args()
+
+    main(args.assets, args.sample)
@@ -0,0 +1,60 @@
+'''
+compare fixed 10,000 simulation plans with adaptive_financial_plan(), which stops simulating once the
+probability of success and the 5th percentile of wealth at retirement are precise enough, for a few
+households from clearly safe to clearly failing
+
+    python -m benchmarks.adaptive_simulations --sims 10000 --batch-size 2000
+'''
+
+import argparse
+
+from apps import functions as fn
+from benchmarks import common
+
+
+# (user_save, user_spend) of the households, the other inputs are the defaults
+HOUSEHOLDS = [(50000, 40000), (20000, 60000), (20000, 80000), (5000, 80000), (0, 100000)]
+
+
+def main(num_simulations, batch_size, repeats):
+
+    rows = []
+    for user_save, user_spend in HOUSEHOLDS:
+
+        household = dict(common.DEFAULT_HOUSEHOLD, user_save=user_save, user_spend=user_spend)
+        allocations, contributions = common.household_schedules(household)
+        params = common.plan_params(num_simulations, household)
+        params['wealth_engine'] = 'inplace'
+
+        equity_returns, bond_returns = common.simulated_returns(num_simulations, params['num_periods'])
+        bond_returns = bond_returns[0]
+
+        fixed_time, fixed = common.best_of(
+            lambda: fn.financial_plan(params, contributions, equity_returns, bond_returns), repeats)
+        adaptive_time, adaptive = common.best_of(
+            lambda: fn.adaptive_financial_plan(params, contributions, equity_returns, bond_returns,
+                                               batch_size=batch_size), repeats)
+
+        report = adaptive[6]['adaptive']
+        rows.append(['{:,} / {:,}'.format(user_save, user_spend),
+                     '{:.1%}'.format(fixed[6]['ruin']['probability_of_success']),
+                     '{:,}'.format(report['num_simulations']),
+                     '+/-{:.2%}'.format(report['probability_of_success_error']),
+                     '+/-{:.1%}'.format(report['wealth_at_retirement_error']),
+                     str(report['converged']),
+                     '{:.1f}'.format(fixed_time * 1000),
+                     '{:.1f}'.format(adaptive_time * 1000)])
+
+    common.print_table(['save / spend', 'success', 'sims used', 'success error', '5th pct wealth error',
+                        'converged', 'fixed (ms)', 'adaptive (ms)'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=2000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.sims, args.batch_size, args.repeats)
@@ -0,0 +1,90 @@
+'''
+measure the throughput (households per second) of the batch planning api against planning each household
+with financial_plan() on the same simulated returns
+
+    python -m benchmarks.batch_planning --households 200 --sims 10000
+'''
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from apps import batch_planning
+from apps import functions as fn
+from benchmarks import common
+
+
+def random_households(num_households, seed=0):
+
+    random_state = np.random.default_rng(seed)
+    households = pd.DataFrame({'user_age': random_state.integers(25, 60, num_households),
+                               'user_wealth': random_state.integers(0, 1000000, num_households),
+                               'user_save': random_state.integers(0, 50000, num_households),
+                               'user_spend': random_state.integers(20000, 100000, num_households)})
+    households['user_retirement_age'] = households['user_age'] + random_state.integers(5, 30, num_households)
+
+    return households
+
+
+def plan_one_by_one(households, equity_returns, bond_returns, mortality_table):
+
+    for household in households.itertuples(index=False):
+
+        user_mortality, age_list = fn.get_user_mortality_stats(int(household.user_age), mortality_table)
+        num_periods = user_mortality['1%'] - household.user_age + 1
+        params = {'user_age': int(household.user_age),
+                  'user_retirement_age': int(household.user_retirement_age),
+                  'user_wealth': int(household.user_wealth),
+                  'num_simulations': equity_returns.shape[0],
+                  'user_mortality': user_mortality,
+                  'age_list': age_list,
+                  'idx_at_retirement': int(household.user_retirement_age - household.user_age),
+                  'idx_at_final_age': int(num_periods - 1),
+                  'years_to_retire_minus_one': int(household.user_retirement_age - household.user_age - 1),
+                  'wealth_engine': 'inplace'}
+        contributions = fn.calc_contributions(int(household.user_age), int(household.user_retirement_age),
+                                              user_mortality['1%'], int(household.user_save),
+                                              int(household.user_spend), 67, 18000)
+        fn.financial_plan(params, contributions, equity_returns[:, :num_periods], bond_returns[:num_periods])
+
+
+def main(num_households, sims):
+
+    households = random_households(num_households)
+    mortality_table = fn.load_mortality_table()
+    survival_index = fn.SurvivalIndex(mortality_table)
+
+    rows = []
+    for num_simulations in sims:
+
+        equity_returns = fn.random_walk_simulations(mean=0.08, stdev=0.14, periods=len(mortality_table),
+                                                    num_simulations=num_simulations,
+                                                    random_state=np.random.default_rng(0))
+        bond_returns = np.full(len(mortality_table), fill_value=0.01)
+        bond_returns[0] = 0.0
+
+        start = time.perf_counter()
+        plan_one_by_one(households, equity_returns, bond_returns, survival_index)
+        one_by_one = num_households / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        batch_planning.plan_households(households, equity_returns, bond_returns, survival_index)
+        batch = num_households / (time.perf_counter() - start)
+
+        rows.append([num_households, num_simulations, '{:.1f}'.format(one_by_one), '{:.1f}'.format(batch),
+                     '{:.1f}x'.format(batch / one_by_one)])
+
+    common.print_table(['households', 'sims', 'one by one (households/s)', 'batch (households/s)', 'speedup'],
+                       rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--households', type=int, default=200)
+    parser.add_argument('--sims', type=int, nargs='+', default=[1000, 10000])
+    args = parser.parse_args()
+
+    main(args.households, args.sims)
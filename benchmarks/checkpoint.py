@@ -0,0 +1,92 @@
+'''
+time a sweep of retirement spending levels (as a user trying out what they can afford would) with and without
+a checkpoint of the savings phase (fn.AccumulationCheckpoint()), for the fixed and the adaptive plans
+
+    python -m benchmarks.checkpoint --sims 10000 --spending 40000 50000 60000 70000 80000
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from apps import functions as fn
+from apps import plan_cache
+from benchmarks import common
+
+
+def sweep(params, equity_returns, bond_returns, spending, adaptive, use_checkpoint):
+    '''
+    plan every spending level, reusing the checkpoint of the savings phase through a PlanCache if use_checkpoint
+
+    :return: seconds, the checkpoint cache stats and the probability of success of every plan
+    '''
+
+    checkpoints = plan_cache.PlanCache(max_entries=8)
+    probabilities = []
+
+    start = time.perf_counter()
+    for user_spend in spending:
+
+        household = dict(common.DEFAULT_HOUSEHOLD, user_spend=user_spend)
+        allocations, contributions = common.household_schedules(household)
+        plan_params = dict(params, user_spend=user_spend)
+
+        checkpoint = None
+        if use_checkpoint:
+            key = plan_cache.plan_key({k: v for k, v in plan_params.items() if k != 'user_spend'},
+                                      contributions[:params['idx_at_retirement']], 0)
+            checkpoint = checkpoints.get(key)
+            if checkpoint is None:
+                checkpoint = fn.AccumulationCheckpoint(plan_params, contributions, equity_returns, bond_returns,
+                                                       engine=params['wealth_engine'])
+                checkpoints.set(key, checkpoint)
+
+        if adaptive:
+            wealth_stats = fn.adaptive_financial_plan(plan_params, contributions, equity_returns, bond_returns,
+                                                      checkpoint=checkpoint)[6]
+        else:
+            wealth_stats = fn.financial_plan(plan_params, contributions, equity_returns, bond_returns,
+                                             checkpoint=checkpoint)[6]
+        probabilities.append(wealth_stats['ruin']['probability_of_success'])
+
+    return time.perf_counter() - start, checkpoints.stats(), probabilities
+
+
+def main(num_simulations, spending, repeats):
+
+    params = common.plan_params(num_simulations)
+    params['wealth_engine'] = 'inplace'
+    equity_returns, bond_returns = common.simulated_returns(num_simulations, params['num_periods'])
+    bond_returns = bond_returns[0]
+
+    rows = []
+    for adaptive in [False, True]:
+
+        results = {}
+        for use_checkpoint in [False, True]:
+            results[use_checkpoint] = min((sweep(params, equity_returns, bond_returns, spending, adaptive,
+                                                 use_checkpoint) for _ in range(repeats)), key=lambda x: x[0])
+
+        seconds, stats, probabilities = results[True]
+        rows.append(['adaptive' if adaptive else 'fixed',
+                     len(spending),
+                     '{:.0%}'.format(stats['hit_rate']),
+                     '{:.1f}'.format(results[False][0] * 1000),
+                     '{:.1f}'.format(seconds * 1000),
+                     '{:.1f}'.format((results[False][0] - seconds) * 1000),
+                     str(np.array_equal(probabilities, results[False][2]))])
+
+    common.print_table(['plan', 'plans', 'checkpoint hit rate', 'without (ms)', 'with (ms)', 'saved (ms)',
+                        'identical'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, default=10000)
+    parser.add_argument('--spending', type=int, nargs='+', default=[40000, 50000, 60000, 70000, 80000])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.sims, args.spending, args.repeats)
@@ -0,0 +1,122 @@
+'''
+shared helpers for the benchmark scripts in this folder.
+
+run the benchmarks from the root of the repo so that the apps package and the data folder resolve, e.g.
+
+    python -m benchmarks.wealth_trajectory
+'''
+
+import time
+import tracemalloc
+
+import numpy as np
+
+from apps import functions as fn
+
+
+# the default household used by the benchmarks (matches the defaults shown on the retirement page)
+DEFAULT_HOUSEHOLD = {'user_age': 40,
+                     'user_retirement_age': 65,
+                     'user_wealth': 100000,
+                     'user_save': 20000,
+                     'user_spend': 60000,
+                     'user_social_security_age': 67,
+                     'user_social_security_benefit': 18000,
+                     'final_age': 99}
+
+
+def best_of(func, repeats=3):
+    '''
+    run func() several times and return the fastest wall clock time in seconds (and the last result)
+    '''
+
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def household_schedules(household=DEFAULT_HOUSEHOLD):
+    '''
+    build the 1-d allocation and contribution schedules for a household
+    '''
+
+    allocations = fn.calc_asset_allocations(user_age=household['user_age'],
+                                            retirement_age=household['user_retirement_age'],
+                                            final_age=household['final_age'],
+                                            percent_at_retirement=0.6,
+                                            glide_length=10)
+
+    contributions = fn.calc_contributions(user_age=household['user_age'],
+                                          retirement_age=household['user_retirement_age'],
+                                          final_age=household['final_age'],
+                                          user_save=household['user_save'],
+                                          user_spend=household['user_spend'],
+                                          user_social_security_age=household['user_social_security_age'],
+                                          user_social_security_benefit=household['user_social_security_benefit'])
+
+    return allocations, contributions
+
+
+def simulated_returns(num_simulations, num_periods, seed=0):
+    '''
+    equity and bond returns as simulated on the retirement page
+    '''
+
+    np.random.seed(seed)
+    equity_returns = fn.random_walk_simulations(mean=0.08, stdev=0.14, periods=num_periods,
+                                                num_simulations=num_simulations)
+    bond_returns = np.full_like(equity_returns, fill_value=0.01)
+    bond_returns[:, 0] = 0.0
+
+    return equity_returns, bond_returns
+
+
+def print_table(header, rows):
+    '''
+    print a list of rows as a fixed width table
+    '''
+
+    widths = [max(len(str(x)) for x in col) for col in zip(header, *rows)]
+    line = '  '.join('{:>' + str(w) + '}' for w in widths)
+    print(line.format(*header))
+    for row in rows:
+        print(line.format(*row))
+
+
+def plan_params(num_simulations, household=DEFAULT_HOUSEHOLD):
+    '''
+    build the params dictionary that financial_plan() expects, in the same way as the retirement page
+    (with a fixed final age instead of a mortality table lookup)
+    '''
+
+    params = dict(household)
+    params['num_simulations'] = num_simulations
+    params['user_mortality'] = {'1%': household['final_age']}
+    params['age_list'] = list(range(household['user_age'], household['final_age'] + 1))
+    params['num_periods'] = household['final_age'] - household['user_age'] + 1
+    params['idx_at_retirement'] = household['user_retirement_age'] - household['user_age']
+    params['idx_at_final_age'] = household['final_age'] - household['user_age']
+    params['years_to_retire_minus_one'] = household['user_retirement_age'] - household['user_age'] - 1
+
+    return params
+
+
+def peak_memory(func):
+    '''
+    run func() and return the peak memory (in MB) allocated while it ran, as tracked by tracemalloc
+    (numpy reports its array buffers to tracemalloc), along with the result
+    '''
+
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak / 1e6, result
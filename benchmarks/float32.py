@@ -0,0 +1,100 @@
+'''
+compare float64 and float32 simulations: the throughput (simulated paths per second) and the peak resident
+memory of simulating the returns, the wealth trajectories (calc_wealth_trajectory()) and their distributions
+(wealth_distributions()) at several numbers of simulations, and the accuracy of a float32 plan
+(fn.float32_accuracy_report()).
+
+every run is made in a fresh process so that its peak RSS is not inflated by the runs before it
+
+    python -m benchmarks.float32 --sims 100000 500000 --engine inplace
+'''
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+
+from apps import functions as fn
+from benchmarks import common
+
+
+def simulate(num_simulations, dtype, engine):
+    '''
+    run the three steps of a plan once and return the seconds of each step and the peak RSS of the process (MB)
+    '''
+
+    allocations, contributions = common.household_schedules()
+    num_periods = len(contributions)
+    bond_returns = np.full(num_periods, fill_value=0.01, dtype=dtype)
+    bond_returns[0] = 0.0
+
+    seconds = []
+
+    start = time.perf_counter()
+    equity_returns = fn.random_walk_simulations(mean=0.08, stdev=0.14, periods=num_periods,
+                                                num_simulations=num_simulations,
+                                                random_state=np.random.default_rng(0), dtype=dtype)
+    seconds.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    wealths = fn.calc_wealth_trajectory(starting_wealth=common.DEFAULT_HOUSEHOLD['user_wealth'],
+                                        equity_returns=equity_returns,
+                                        bond_returns=bond_returns,
+                                        allocations=allocations,
+                                        contributions=contributions,
+                                        engine=engine)
+    seconds.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    fn.wealth_distributions(wealths)
+    seconds.append(time.perf_counter() - start)
+
+    # ru_maxrss is in KB on linux
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(sims, engine, accuracy_sims):
+
+    context = multiprocessing.get_context('spawn')
+
+    rows = []
+    for num_simulations in sims:
+        for dtype in ['float64', 'float32']:
+
+            with context.Pool(1) as pool:
+                seconds, peak_rss = pool.apply(simulate, (num_simulations, dtype, engine))
+
+            rows.append(['{:,}'.format(num_simulations), dtype] +
+                         ['{:.3f}'.format(x) for x in seconds] +
+                         ['{:,.0f}'.format(num_simulations / sum(seconds)), '{:,.0f}'.format(peak_rss)])
+
+    common.print_table(['sims', 'dtype', 'returns (s)', 'wealth (s)', 'distributions (s)', 'paths / s',
+                        'peak RSS (MB)'], rows)
+
+    # the accuracy of a float32 plan on the same (rounded) returns
+    params = common.plan_params(accuracy_sims)
+    params['wealth_engine'] = engine
+    allocations, contributions = common.household_schedules()
+    equity_returns, bond_returns = common.simulated_returns(accuracy_sims, params['num_periods'])
+    report = fn.float32_accuracy_report(params, contributions, equity_returns, bond_returns[0])
+
+    print()
+    print('float32 accuracy on {:,} simulations:'.format(accuracy_sims))
+    common.print_table(['trajectory', 'max relative difference'],
+                       [[k, '{:.1e}'.format(v)] for k, v in report['trajectories'].items()])
+    print('largest milestone difference: {:.1e}, probability of success difference: {:.4f}, same ages at negative '
+          'wealth: {}'.format(max(report['milestones'].values()), report['probability_of_success'],
+                              report['same_ages_at_negative_wealth']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, nargs='+', default=[100000, 500000])
+    parser.add_argument('--engine', default='inplace')
+    parser.add_argument('--accuracy-sims', type=int, default=10000)
+    args = parser.parse_args()
+
+    main(args.sims, args.engine, args.accuracy_sims)
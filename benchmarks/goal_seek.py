@@ -0,0 +1,80 @@
+'''
+time the goal seek (minimum saving and maximum spending for a 90% probability of success) against finding
+the same answer with one financial_plan() call per guess (a plain bisection, as a user clicking through the
+retirement page would)
+
+    python -m benchmarks.goal_seek --sims 10000 --candidates 2 4 8
+'''
+
+import argparse
+import time
+
+from apps import functions as fn
+from apps import goal_seek
+from benchmarks import common
+
+
+def bisect_with_financial_plan(params, equity_returns, bond_returns, variable, target_probability, high, tolerance):
+    '''
+    the same search as goal_seek.goal_seek(), one financial_plan() per candidate
+    '''
+
+    increasing = goal_seek.GOAL_VARIABLES[variable]
+    lower, upper = 0, high
+    calls = 0
+
+    while upper - lower > tolerance:
+        value = (lower + upper) // 2
+        contributions = goal_seek.candidate_contributions(params, variable, [value])[0]
+        wealth_stats = fn.financial_plan(dict(params, **{variable: value}), contributions, equity_returns,
+                                         bond_returns)[6]
+        calls += 1
+
+        if (wealth_stats['ruin']['probability_of_success'] >= target_probability) == increasing:
+            upper = value
+        else:
+            lower = value
+
+    return (upper if increasing else lower), calls
+
+
+def main(num_simulations, candidates, target_probability, tolerance):
+
+    params = common.plan_params(num_simulations)
+    params['wealth_engine'] = 'inplace'
+    equity_returns, bond_returns = common.simulated_returns(num_simulations, params['num_periods'])
+    bond_returns = bond_returns[0]
+    high = 2 * max(params['user_save'], params['user_spend'], 50000)
+
+    rows = []
+    for variable in goal_seek.GOAL_VARIABLES:
+
+        start = time.perf_counter()
+        value, calls = bisect_with_financial_plan(params, equity_returns, bond_returns, variable,
+                                                  target_probability, high, tolerance)
+        rows.append([variable, 'financial_plan bisection', '{:,}'.format(value), calls, calls,
+                     '{:.3f}'.format(time.perf_counter() - start)])
+
+        for num_candidates in candidates:
+            seconds, result = common.best_of(lambda: goal_seek.goal_seek(params, equity_returns, bond_returns,
+                                                                         variable=variable,
+                                                                         target_probability=target_probability,
+                                                                         high=high,
+                                                                         num_candidates=num_candidates,
+                                                                         tolerance=tolerance))
+            rows.append([variable, 'goal_seek ({} candidates)'.format(num_candidates), '{:,}'.format(result['value']),
+                         result['rounds'], result['evaluations'], '{:.3f}'.format(seconds)])
+
+    common.print_table(['variable', 'method', 'value', 'rounds', 'plans', 'time (s)'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, default=10000)
+    parser.add_argument('--candidates', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--target', type=float, default=0.9)
+    parser.add_argument('--tolerance', type=int, default=100)
+    args = parser.parse_args()
+
+    main(args.sims, args.candidates, args.target, args.tolerance)
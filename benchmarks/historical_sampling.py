@@ -0,0 +1,143 @@
+'''
+benchmark the vectorized historical samplers against the previous per-simulation python loops, and time a
+complete historical-mode plan (random walk + continuous + discontinuous samples) as run on the retirement page
+
+    python -m benchmarks.historical_sampling --sims 10000 100000
+'''
+
+import argparse
+
+import numpy as np
+
+from apps import functions as fn
+from benchmarks import common
+
+
+def looped_continuous(num_periods_per_simulation, num_simulations, year_list, sp500_list, ust_list):
+    '''
+    the previous implementation of build_continuous_sampled_returns()
+    '''
+
+    num_of_samples = len(year_list)
+    randoms = np.random.randint(0, num_of_samples, size=num_simulations)
+
+    all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns = [], [], []
+    for i in randoms:
+        index_list = fn.build_single_continuous_sample_series(start_i=i, max_i=num_of_samples,
+                                                              num_periods=num_periods_per_simulation)
+        all_sampled_years.append([year_list[i] for i in index_list])
+        all_sampled_ust_returns.append([ust_list[i] for i in index_list])
+        all_sampled_sp500_returns.append([sp500_list[i] for i in index_list])
+
+    all_sampled_years = np.array(all_sampled_years)
+    all_sampled_sp500_returns = np.array(all_sampled_sp500_returns)
+    all_sampled_ust_returns = np.array(all_sampled_ust_returns)
+    all_sampled_years[:, 0] = 0
+    all_sampled_sp500_returns[:, 0] = 0
+    all_sampled_ust_returns[:, 0] = 0
+
+    return all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns
+
+
+def looped_discontinuous(num_periods_per_simulation, sub_sample_length, num_simulations, year_list, sp500_list,
+                         ust_list):
+    '''
+    the previous implementation of build_discontinuous_sampled_returns()
+    '''
+
+    num_sub_periods = int(num_periods_per_simulation / sub_sample_length) + 1
+    num_of_samples = len(year_list)
+    randoms = np.random.randint(0, num_of_samples, size=[num_simulations, num_sub_periods])
+
+    all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns = [], [], []
+    for i in randoms:
+        index_list = []
+        for random_num in i:
+            index_list = index_list + fn.build_single_continuous_sample_series(start_i=random_num,
+                                                                               max_i=num_of_samples,
+                                                                               num_periods=sub_sample_length)
+        index_list = index_list[:num_periods_per_simulation]
+        all_sampled_years.append([year_list[i] for i in index_list])
+        all_sampled_ust_returns.append([ust_list[i] for i in index_list])
+        all_sampled_sp500_returns.append([sp500_list[i] for i in index_list])
+
+    all_sampled_years = np.array(all_sampled_years)
+    all_sampled_sp500_returns = np.array(all_sampled_sp500_returns)
+    all_sampled_ust_returns = np.array(all_sampled_ust_returns)
+    all_sampled_years[:, 0] = 0
+    all_sampled_sp500_returns[:, 0] = 0
+    all_sampled_ust_returns[:, 0] = 0
+
+    return all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns
+
+
+def seeded(func, seed=0):
+    np.random.seed(seed)
+    return func()
+
+
+def historical_plan(num_simulations, years, sp500, ust):
+    '''
+    the historical mode of the retirement page: random walk, continuous and discontinuous samples
+    combined into one plan
+    '''
+
+    params = common.plan_params(num_simulations)
+    params['wealth_engine'] = 'inplace'
+    allocations, contributions = common.household_schedules()
+    num_periods = len(contributions)
+
+    equity_sim1, bond_sim1 = common.simulated_returns(num_simulations, num_periods)
+    _, equity_sim2, bond_sim2 = fn.build_continuous_sampled_returns(num_periods, num_simulations, years, sp500, ust)
+    _, equity_sim3, bond_sim3 = fn.build_discontinuous_sampled_returns(num_periods, 5, num_simulations, years,
+                                                                       sp500, ust)
+
+    equity_returns = np.concatenate([equity_sim1, equity_sim2, equity_sim3], axis=0)
+    bond_returns = np.concatenate([bond_sim1, bond_sim2, bond_sim3], axis=0)
+    params['num_simulations'] = equity_returns.shape[0]
+
+    return fn.financial_plan(params, contributions, equity_returns, bond_returns)
+
+
+def main(sims, repeats):
+
+    years, sp500, ust_3m, ust, bbb = fn.get_historical_annual_returns()
+    num_periods = len(common.household_schedules()[1])
+
+    rows = []
+    for num_simulations in sims:
+
+        samplers = [
+            ('continuous',
+             lambda: looped_continuous(num_periods, num_simulations, years, sp500, ust),
+             lambda: fn.build_continuous_sampled_returns(num_periods, num_simulations, years, sp500, ust)),
+            ('discontinuous',
+             lambda: looped_discontinuous(num_periods, 5, num_simulations, years, sp500, ust),
+             lambda: fn.build_discontinuous_sampled_returns(num_periods, 5, num_simulations, years, sp500, ust)),
+        ]
+
+        for name, looped, vectorized in samplers:
+            looped_time, looped_result = common.best_of(lambda: seeded(looped), repeats)
+            vectorized_time, vectorized_result = common.best_of(lambda: seeded(vectorized), repeats)
+            identical = all(np.array_equal(a, b) for a, b in zip(looped_result, vectorized_result))
+            rows.append([num_simulations, name, '{:.4f}'.format(looped_time), '{:.4f}'.format(vectorized_time),
+                         '{:.0f}x'.format(looped_time / vectorized_time), str(identical)])
+
+        stationary_time, _ = common.best_of(
+            lambda: fn.build_stationary_sampled_returns(num_periods, 5, num_simulations, years, sp500, ust), repeats)
+        rows.append([num_simulations, 'stationary', '', '{:.4f}'.format(stationary_time), '', ''])
+
+        plan_time, _ = common.best_of(lambda: historical_plan(num_simulations, years, sp500, ust), repeats)
+        rows.append([num_simulations, 'historical plan (3x sims)', '', '{:.4f}'.format(plan_time), '', ''])
+
+    common.print_table(['sims', 'sampler', 'looped (s)', 'vectorized (s)', 'speedup', 'identical'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.sims, args.repeats)
@@ -0,0 +1,114 @@
+'''
+time the multi-asset return generator (fn.correlated_random_walk_simulations()) and the tensor wealth engine
+(fn.calc_multi_asset_wealth_trajectory()) for portfolios of 2, 5 and 10 assets, against a per-asset loop that
+applies every asset's growth to wealth separately (the way calc_wealth_trajectory() handles equity and bonds).
+The two asset portfolio is also compared with calc_wealth_trajectory() itself.
+
+the assets are equity plus bond-like assets with a one factor correlation structure, the non-equity share of
+the default glide path is split evenly between the bond-like assets
+
+    python -m benchmarks.multi_asset --sims 10000 --assets 2 5 10
+'''
+
+import argparse
+
+import numpy as np
+
+from apps import functions as fn
+from benchmarks import common
+
+
+def asset_moments(num_assets, correlation=0.3):
+    '''
+    means, standard deviations and correlations of equity (first) and num_assets - 1 bond-like assets
+    '''
+
+    means = np.concatenate([[0.08], np.linspace(0.01, 0.05, num_assets - 1)])
+    stdevs = np.concatenate([[0.14], np.linspace(0.02, 0.10, num_assets - 1)])
+    correlations = np.full((num_assets, num_assets), correlation)
+    np.fill_diagonal(correlations, 1.0)
+
+    return means, stdevs, correlations
+
+
+def per_asset_loop(starting_wealth, asset_returns, allocations, contributions):
+    '''
+    the reference recursion: wealth = sum over assets of wealth * allocation * (1 + return), plus contributions
+    '''
+
+    num_simulations, num_periods, num_assets = asset_returns.shape
+    wealths = np.zeros([num_simulations, num_periods])
+    previous_wealths = np.full(num_simulations, float(starting_wealth))
+
+    for i in range(num_periods):
+        wealth = np.zeros(num_simulations)
+        for j in range(num_assets):
+            wealth += previous_wealths * allocations[i, j] * (1 + asset_returns[:, i, j])
+        wealths[:, i] = wealth + contributions[i]
+        previous_wealths = wealths[:, i]
+
+    return wealths
+
+
+def main(num_simulations, assets, repeats):
+
+    params = common.plan_params(num_simulations)
+    equity_allocations, contributions = common.household_schedules()
+    num_periods = len(contributions)
+
+    rows = []
+    for num_assets in assets:
+
+        means, stdevs, correlations = asset_moments(num_assets)
+        allocations = fn.calc_multi_asset_allocations(equity_allocations, np.ones(num_assets - 1))
+
+        generate_time, asset_returns = common.best_of(
+            lambda: fn.correlated_random_walk_simulations(means, stdevs, correlations, num_periods, num_simulations,
+                                                          random_state=np.random.default_rng(0)), repeats)
+        loop_time, reference = common.best_of(
+            lambda: per_asset_loop(params['user_wealth'], asset_returns, allocations, contributions), repeats)
+        tensor_time, wealths = common.best_of(
+            lambda: fn.calc_multi_asset_wealth_trajectory(params['user_wealth'], asset_returns, allocations,
+                                                          contributions), repeats)
+        peak, _ = common.peak_memory(
+            lambda: fn.calc_multi_asset_wealth_trajectory(params['user_wealth'], asset_returns, allocations,
+                                                          contributions))
+
+        if num_assets == 2:
+            two_asset_time, two_asset = common.best_of(
+                lambda: fn.calc_wealth_trajectory(params['user_wealth'], asset_returns[..., 0],
+                                                  asset_returns[..., 1], equity_allocations, contributions,
+                                                  engine='inplace'), repeats)
+            two_asset_time = '{:.1f}'.format(two_asset_time * 1000)
+        else:
+            two_asset_time = '-'
+
+        rows.append([num_assets,
+                     '{:.1f}'.format(generate_time * 1000),
+                     '{:.1f}'.format(loop_time * 1000),
+                     '{:.1f}'.format(tensor_time * 1000),
+                     two_asset_time,
+                     '{:.1f}'.format(peak),
+                     '{:.0e}'.format(np.max(np.abs(wealths - reference) / np.maximum(1, np.abs(reference))))])
+
+    common.print_table(['assets', 'generate (ms)', 'per-asset loop (ms)', 'tensor engine (ms)',
+                        'calc_wealth_trajectory (ms)', 'engine peak (MB)', 'max rel difference'], rows)
+
+    # the joint bootstrap of the historical sp500, treasury and corporate bond returns
+    bootstrap_time, (_, sampled_returns) = common.best_of(
+        lambda: fn.build_joint_sampled_returns(num_periods, num_simulations, random_state=np.random.default_rng(0)),
+        repeats)
+    print()
+    print('joint bootstrap of {} historical assets: {:.1f} ms'.format(sampled_returns.shape[2],
+                                                                      bootstrap_time * 1000))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, default=10000)
+    parser.add_argument('--assets', type=int, nargs='+', default=[2, 5, 10])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.sims, args.assets, args.repeats)
@@ -0,0 +1,80 @@
+'''
+compare the peak memory of financial_plan() when the allocation/contribution schedules are broadcast as
+[num_periods] vectors against the previous behaviour of materializing them as [num_simulations x num_periods]
+arrays
+
+    python -m benchmarks.plan_memory --sims 10000 100000 1000000
+'''
+
+import argparse
+
+import numpy as np
+
+from apps import functions as fn
+from benchmarks import common
+
+
+def materialized_plan(params, allocations, contributions, equity_returns, bond_returns):
+    '''
+    the wealth recursion as financial_plan() used to run it, with a copy of every schedule per simulation
+    '''
+
+    allocations = np.array([allocations for i in range(params['num_simulations'])])
+    contributions = np.array([contributions for i in range(params['num_simulations'])])
+    bond_returns = np.array([bond_returns for i in range(params['num_simulations'])])
+    starting_wealth_array = np.full(shape=params['num_simulations'], fill_value=params['user_wealth'])
+
+    return fn.calc_wealth_trajectory(starting_wealth_array, equity_returns, bond_returns, allocations,
+                                     contributions, engine='inplace')
+
+
+def broadcast_plan(params, allocations, contributions, equity_returns, bond_returns):
+
+    starting_wealth_array = np.full(shape=params['num_simulations'], fill_value=params['user_wealth'])
+
+    return fn.calc_wealth_trajectory(starting_wealth_array, equity_returns, bond_returns, allocations,
+                                     contributions, engine='inplace')
+
+
+def main(sims):
+
+    allocations, contributions = common.household_schedules()
+    num_periods = len(contributions)
+    bond_returns = np.full(num_periods, fill_value=0.01)
+    bond_returns[0] = 0.0
+
+    rows = []
+    for num_simulations in sims:
+
+        params = common.plan_params(num_simulations)
+        equity_returns, _ = common.simulated_returns(num_simulations, num_periods)
+        return_matrix_mb = equity_returns.nbytes / 1e6
+
+        old_peak, old_wealths = common.peak_memory(
+            lambda: materialized_plan(params, allocations, contributions, equity_returns, bond_returns))
+        new_peak, new_wealths = common.peak_memory(
+            lambda: broadcast_plan(params, allocations, contributions, equity_returns, bond_returns))
+        plan_peak, _ = common.peak_memory(
+            lambda: fn.financial_plan(params, contributions, equity_returns, bond_returns))
+
+        rows.append([num_simulations,
+                     '{:.0f}'.format(return_matrix_mb),
+                     '{:.0f}'.format(old_peak),
+                     '{:.0f}'.format(new_peak),
+                     '{:.1f}x'.format(old_peak / new_peak),
+                     '{:.0f}'.format(plan_peak),
+                     str(np.array_equal(old_wealths, new_wealths))])
+
+        del equity_returns, old_wealths, new_wealths
+
+    common.print_table(['sims', 'return matrix (MB)', 'materialized peak (MB)', 'broadcast peak (MB)',
+                        'reduction', 'financial_plan peak (MB)', 'identical'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    main(args.sims)
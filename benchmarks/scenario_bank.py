@@ -0,0 +1,92 @@
+'''
+compare planning with the precomputed scenario bank against simulating the market returns per request:
+the one-off cost of building and opening the bank, and the latency of a single plan
+
+    python -m benchmarks.scenario_bank --sims 10000 100000
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from apps import functions as fn
+from apps import scenario_bank
+from benchmarks import common
+
+
+def simulated_plan(params, contributions):
+
+    equity_returns = fn.random_walk_simulations(mean=0.08, stdev=0.14, periods=params['num_periods'],
+                                                num_simulations=params['num_simulations'],
+                                                random_state=np.random.default_rng(0))
+    bond_returns = np.full(params['num_periods'], fill_value=0.01)
+    bond_returns[0] = 0.0
+
+    return fn.financial_plan(params, contributions, equity_returns, bond_returns)
+
+
+def bank_plan(bank, params, contributions):
+
+    equity_returns, bond_returns = bank.returns(params['num_periods'], params['num_simulations'])
+
+    return fn.financial_plan(params, contributions, equity_returns, bond_returns,
+                             rates_of_return=bank.rates_of_return(params['num_periods']))
+
+
+def main(sims, repeats):
+
+    contributions = common.household_schedules()[1]
+    directory = tempfile.mkdtemp()
+
+    rows = []
+    try:
+        for num_simulations in sims:
+
+            path = os.path.join(directory, 'bank_{}'.format(num_simulations))
+            params = common.plan_params(num_simulations)
+            params['wealth_engine'] = 'inplace'
+
+            start = time.perf_counter()
+            scenario_bank.build_scenario_bank(path, num_simulations=num_simulations)
+            build_time = time.perf_counter() - start
+
+            # opening the bank again (as a new worker process would)
+            scenario_bank.open_banks.clear()
+            start = time.perf_counter()
+            bank = scenario_bank.load_scenario_bank(path)
+            open_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            bank_plan(bank, params, contributions)
+            first_plan_time = time.perf_counter() - start
+
+            simulated_time, _ = common.best_of(lambda: simulated_plan(params, contributions), repeats)
+            bank_time, _ = common.best_of(lambda: bank_plan(bank, params, contributions), repeats)
+
+            rows.append([num_simulations,
+                         '{:.3f}'.format(build_time),
+                         '{:.4f}'.format(open_time),
+                         '{:.4f}'.format(first_plan_time),
+                         '{:.4f}'.format(simulated_time),
+                         '{:.4f}'.format(bank_time),
+                         '{:.1f}x'.format(simulated_time / bank_time)])
+    finally:
+        scenario_bank.open_banks.clear()
+        shutil.rmtree(directory)
+
+    common.print_table(['sims', 'build (s)', 'open (s)', 'first bank plan (s)', 'simulated plan (s)',
+                        'bank plan (s)', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.sims, args.repeats)
@@ -0,0 +1,101 @@
+'''
+time the savings x spending success probability grid (sensitivity.success_probability_grid()) against one
+financial_plan() per cell (timed on a sample of cells and scaled to the whole grid) and against a stacked
+[cells x simulations] wealth recursion (goal_seek.success_probabilities()), which is also the reference for
+the grid's probabilities
+
+    python -m benchmarks.sensitivity_grid --sims 10000 --sizes 10 20 40 --workers 2
+'''
+
+import argparse
+import concurrent.futures
+import time
+
+import numpy as np
+
+from apps import functions as fn
+from apps import goal_seek
+from apps import sensitivity
+from benchmarks import common
+
+
+def financial_plan_seconds(params, equity_returns, bond_returns, saves, spends, num_cells=10):
+    '''
+    the time of one financial_plan() per cell, averaged over num_cells cells spread across the grid
+    '''
+
+    contributions = sensitivity.grid_contributions(params, saves, spends).reshape(-1, params['num_periods'])
+    cells = np.linspace(0, len(contributions) - 1, num_cells).astype(int)
+
+    start = time.perf_counter()
+    for cell in cells:
+        fn.financial_plan(params, contributions[cell], equity_returns, bond_returns)
+
+    return (time.perf_counter() - start) / num_cells
+
+
+def main(num_simulations, sizes, workers, repeats):
+
+    params = common.plan_params(num_simulations)
+    params['wealth_engine'] = 'inplace'
+    equity_returns, bond_returns = common.simulated_returns(num_simulations, params['num_periods'])
+    bond_returns = bond_returns[0]
+
+    executor = concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else None
+
+    rows = []
+    for size in sizes:
+
+        saves = sensitivity.grid_values(params['user_save'], size)
+        spends = sensitivity.grid_values(params['user_spend'], size)
+        contributions = sensitivity.grid_contributions(params, saves, spends).reshape(-1, params['num_periods'])
+
+        per_plan = financial_plan_seconds(params, equity_returns, bond_returns, saves, spends)
+        stacked_time, reference = common.best_of(
+            lambda: goal_seek.success_probabilities(params, contributions, equity_returns, bond_returns), 1)
+        grid_time, grid = common.best_of(
+            lambda: sensitivity.success_probability_grid(params, equity_returns, bond_returns, saves, spends),
+            repeats)
+
+        row = ['{0}x{0}'.format(size),
+               '{:.2f}'.format(per_plan * size * size),
+               '{:.3f}'.format(stacked_time),
+               '{:.3f}'.format(grid_time)]
+
+        if executor is not None:
+            parallel_time, parallel = common.best_of(
+                lambda: sensitivity.success_probability_grid(params, equity_returns, bond_returns, saves, spends,
+                                                             executor=executor), repeats)
+            assert np.array_equal(parallel, grid), 'error: the parallel grid differs'
+            row.append('{:.3f}'.format(parallel_time))
+
+        row.append('{:.0e}'.format(np.abs(grid - reference.reshape(size, size)).max()))
+        rows.append(row)
+
+    ages_time, (retirement_ages, _) = common.best_of(
+        lambda: sensitivity.retirement_age_grid(params, equity_returns, bond_returns,
+                                                sensitivity.grid_values(params['user_spend'])), repeats)
+
+    if executor is not None:
+        executor.shutdown()
+
+    columns = ['grid', 'financial_plan per cell (s)', 'stacked recursion (s)', 'grid engine (s)']
+    if executor is not None:
+        columns.append('grid engine, {} workers (s)'.format(workers))
+    common.print_table(columns + ['max difference'], rows)
+
+    print()
+    print('retirement ages {}-{} x {} spending levels: {:.3f}s'.format(retirement_ages[0], retirement_ages[-1],
+                                                                      sensitivity.GRID_SIZE, ages_time))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, default=10000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 20, 40])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.sims, args.sizes, args.workers, args.repeats)
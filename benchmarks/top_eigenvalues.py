@@ -0,0 +1,98 @@
+'''
+time the leading eigenvalue solvers of the absorption ratio (absorption_ratio.TopEigenSolver, warm-started from
+the eigenvectors of the previous date) against a full decomposition of every covariance matrix
+(np.linalg.eigvalsh), on consecutive dates of universes of 50, 500 and 3000 assets. The covariance matrices
+are updated one date at a time by absorption_ratio.CovarianceAccumulator, whose cost is shown separately.
+
+the returns are simulated from a market factor and 10 sector factors plus independent noise. The AR keeps the
+number of components of the 50 industry AR (10) for every universe: a fifth of 3000 assets would be more
+components than the rank of a 500 day covariance matrix.
+
+    python -m benchmarks.top_eigenvalues --assets 50 500 3000 --dates 200 20 5 --components 10
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from apps import absorption_ratio as ar
+from benchmarks import common
+
+
+def simulated_sector_returns(num_assets, num_dates, num_sectors=10, seed=0):
+    '''
+    daily returns with betas between 0.6 and 1.4 to a market factor and betas between 0.5 and 1 to the factor
+    of the asset's sector (the assets are spread evenly over the sectors)
+
+    :return: [num_dates x num_assets] array
+    '''
+
+    rng = np.random.RandomState(seed)
+    market = rng.normal(0, 0.01, (num_dates, 1))
+    sectors = rng.normal(0, 0.006, (num_dates, num_sectors))
+
+    market_betas = rng.uniform(0.6, 1.4, num_assets)
+    sector_betas = rng.uniform(0.5, 1.0, num_assets)
+    sector = np.arange(num_assets) % num_sectors
+
+    return market * market_betas + sectors[:, sector] * sector_betas + rng.normal(0, 0.01, (num_dates, num_assets))
+
+
+def main(assets, dates, components):
+
+    rows = []
+    for num_assets, num_dates in zip(assets, dates):
+
+        returns = simulated_sector_returns(num_assets, ar.WINDOW - 1 + num_dates)
+        fraction = components / num_assets
+        k = ar.num_components(num_assets, fraction)
+
+        accumulator = ar.CovarianceAccumulator.from_returns(returns[:ar.WINDOW - 1])
+        solvers = {method: ar.TopEigenSolver(k, method) for method in ['lanczos', 'subspace']}
+        seconds = dict.fromkeys(['update', 'eigvalsh', 'lanczos', 'subspace'], 0.0)
+        iterations = {method: [] for method in solvers}
+        max_difference = dict.fromkeys(solvers, 0.0)
+
+        for t in range(ar.WINDOW - 1, len(returns)):
+
+            start = time.perf_counter()
+            accumulator.update(returns[t])
+            covariance = accumulator.covariance()
+            seconds['update'] += time.perf_counter() - start
+
+            trace = np.trace(covariance)
+            start = time.perf_counter()
+            ratio = np.linalg.eigvalsh(covariance)[-k:].sum() / trace
+            seconds['eigvalsh'] += time.perf_counter() - start
+
+            for method, solver in solvers.items():
+                start = time.perf_counter()
+                solver_ratio = solver(covariance).sum() / trace
+                seconds[method] += time.perf_counter() - start
+                iterations[method].append(solver.iterations)
+                max_difference[method] = max(max_difference[method], abs(solver_ratio - ratio))
+
+        rows.append([num_assets, k, num_dates] +
+                    ['{:.2f}'.format(seconds[name] / num_dates * 1000) for name in seconds] +
+                    ['{:.0f}'.format(np.mean(iterations[method][1:] or iterations[method])) for method in solvers] +
+                    ['{:.0e}'.format(max_difference[method]) for method in solvers])
+
+    common.print_table(['assets', 'k', 'dates', 'update (ms)', 'eigvalsh (ms)', 'lanczos (ms)', 'subspace (ms)',
+                        'lanczos matvecs', 'subspace iterations', 'lanczos error', 'subspace error'], rows)
+    print()
+    print('times are per date, matvecs and iterations are per date after the first (warm-started), errors are '
+          'the max difference in the AR from eigvalsh')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--assets', type=int, nargs='+', default=[50, 500, 3000])
+    parser.add_argument('--dates', type=int, nargs='+', default=[200, 20, 5])
+    parser.add_argument('--components', type=int, default=10)
+    args = parser.parse_args()
+
+    assert len(args.assets) == len(args.dates), 'error: give the number of dates of every universe'
+
+    main(args.assets, args.dates, args.components)
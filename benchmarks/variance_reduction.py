@@ -0,0 +1,88 @@
+'''
+compare the variance reduction modes of random_walk_simulations(): for every mode, estimate the standard error
+of wealth_stats[5]['wealth_at_retirement'] (the 5th percentile of wealth at retirement, from financial_plan())
+at several numbers of simulations by repeating the plan with different seeds, fit SE = a * n^b and report the
+number of simulations needed to reach the target standard error.
+
+the default target is the standard error of independent draws at 10,000 simulations (the number of
+simulations used on the retirement page)
+
+    python -m benchmarks.variance_reduction --sims 1000 2000 4000 8000 --repeats 40
+'''
+
+import argparse
+
+import numpy as np
+
+from apps import functions as fn
+from benchmarks import common
+
+
+def percentile_estimates(variance_reduction, num_simulations, repeats):
+    '''
+    the 5th percentile of wealth at retirement in repeats plans with different seeds
+    '''
+
+    allocations, contributions = common.household_schedules()
+    params = common.plan_params(num_simulations)
+    params['wealth_engine'] = 'inplace'
+
+    bond_returns = np.full(params['num_periods'], fill_value=0.01)
+    bond_returns[0] = 0.0
+
+    estimates = []
+    for seed in range(repeats):
+        equity_returns = fn.random_walk_simulations(mean=0.08, stdev=0.14, periods=params['num_periods'],
+                                                    num_simulations=num_simulations,
+                                                    random_state=np.random.default_rng(seed),
+                                                    variance_reduction=variance_reduction)
+        wealth_stats = fn.financial_plan(params, contributions, equity_returns, bond_returns)[6]
+        estimates.append(wealth_stats[5]['wealth_at_retirement'])
+
+    return np.array(estimates)
+
+
+def main(sims, repeats, target):
+
+    modes = fn.VARIANCE_REDUCTION_MODES
+
+    standard_errors = {}
+    estimates = {}
+    for mode in modes:
+        standard_errors[mode] = []
+        for num_simulations in sims:
+            x = percentile_estimates(mode, num_simulations, repeats)
+            standard_errors[mode].append(x.std(ddof=1))
+        estimates[mode] = x.mean()
+
+    # fit log(SE) = log(a) + b * log(n) for every mode
+    fits = {mode: np.polyfit(np.log(sims), np.log(standard_errors[mode]), deg=1) for mode in modes}
+
+    if target is None:
+        slope, intercept = fits[None]
+        target = np.exp(intercept + slope * np.log(10000))
+
+    rows = []
+    for mode in modes:
+        slope, intercept = fits[mode]
+        paths_needed = np.exp((np.log(target) - intercept) / slope)
+        rows.append([str(mode)] +
+                    ['{:,.0f}'.format(se) for se in standard_errors[mode]] +
+                    ['{:.2f}'.format(slope),
+                     '{:,.0f}'.format(estimates[mode]),
+                     '{:,.0f}'.format(paths_needed)])
+
+    print('target standard error: ${:,.0f}'.format(target))
+    common.print_table(['mode'] + ['SE @ {}'.format(n) for n in sims] +
+                       ['SE slope', 'mean estimate', 'sims for target'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, nargs='+', default=[1000, 2000, 4000, 8000])
+    parser.add_argument('--repeats', type=int, default=40)
+    parser.add_argument('--target', type=float, default=None, help='target standard error in $')
+    args = parser.parse_args()
+
+    main(args.sims, args.repeats, args.target)
@@ -0,0 +1,68 @@
+'''
+compare wealth_distributions() against the previous implementation, which ran np.median and six separate
+np.percentile calls over the full simulation matrix
+
+    python -m benchmarks.wealth_distributions --sims 10000 100000 1000000
+'''
+
+import argparse
+
+import numpy as np
+
+from apps import functions as fn
+from benchmarks import common
+
+
+def separate_percentiles(x):
+
+    distributions = {'mean': np.mean(x, axis=0),
+                     'median': np.median(x, axis=0)}
+    for p in fn.DEFAULT_PERCENTILES:
+        distributions[p] = np.percentile(x, p, axis=0)
+
+    return distributions
+
+
+def main(sims, repeats):
+
+    allocations, contributions = common.household_schedules()
+    num_periods = len(contributions)
+
+    rows = []
+    for num_simulations in sims:
+
+        equity_returns, bond_returns = common.simulated_returns(num_simulations, num_periods)
+        wealths = fn.calc_wealth_trajectory(common.DEFAULT_HOUSEHOLD['user_wealth'], equity_returns,
+                                            bond_returns, allocations, contributions, engine='inplace')
+        del equity_returns, bond_returns
+
+        old_time, old = common.best_of(lambda: separate_percentiles(wealths), repeats)
+        exact_time, exact = common.best_of(lambda: fn.wealth_distributions(wealths), repeats)
+        sketch_time, sketch = common.best_of(lambda: fn.wealth_distributions(wealths, method='sketch'), repeats)
+
+        identical = all(np.array_equal(old[k], exact[k]) for k in old)
+        max_rel_err = max(np.max(np.abs(sketch[k] - old[k]) / np.maximum(np.abs(old[k]), 1000.0)) for k in old)
+
+        rows.append([num_simulations,
+                     '{:.4f}'.format(old_time),
+                     '{:.4f}'.format(exact_time),
+                     '{:.4f}'.format(sketch_time),
+                     '{:.1f}x'.format(old_time / exact_time),
+                     '{:.1f}x'.format(old_time / sketch_time),
+                     str(identical),
+                     '{:.2%}'.format(max_rel_err)])
+
+        del wealths
+
+    common.print_table(['sims', 'separate (s)', 'exact (s)', 'sketch (s)', 'exact speedup', 'sketch speedup',
+                        'exact identical', 'sketch max rel err'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.sims, args.repeats)
@@ -0,0 +1,62 @@
+'''
+benchmark the calc_wealth_trajectory() engines at increasing simulation counts
+
+    python -m benchmarks.wealth_trajectory --sims 10000 100000 1000000
+'''
+
+import argparse
+
+import numpy as np
+
+from apps import functions as fn
+from benchmarks import common
+
+
+def main(sims, repeats):
+
+    allocations, contributions = common.household_schedules()
+    num_periods = len(contributions)
+
+    rows = []
+    for num_simulations in sims:
+
+        equity_returns, bond_returns = common.simulated_returns(num_simulations, num_periods)
+        starting_wealth = np.full(num_simulations, common.DEFAULT_HOUSEHOLD['user_wealth'])
+        allocation_matrix = np.array([allocations for i in range(num_simulations)])
+        contribution_matrix = np.array([contributions for i in range(num_simulations)])
+
+        timings = {}
+        results = {}
+        for engine in ['loop', 'inplace', 'cumulative']:
+            timings[engine], results[engine] = common.best_of(
+                lambda: fn.calc_wealth_trajectory(starting_wealth, equity_returns, bond_returns,
+                                                  allocation_matrix, contribution_matrix, engine=engine),
+                repeats=repeats)
+
+        identical = np.array_equal(results['loop'], results['inplace'])
+        max_rel_err = np.max(np.abs(results['cumulative'] - results['loop']) /
+                             np.maximum(np.abs(results['loop']), 1.0))
+
+        rows.append([num_simulations,
+                     '{:.4f}'.format(timings['loop']),
+                     '{:.4f}'.format(timings['inplace']),
+                     '{:.4f}'.format(timings['cumulative']),
+                     '{:.1f}x'.format(timings['loop'] / timings['inplace']),
+                     '{:.1f}x'.format(timings['loop'] / timings['cumulative']),
+                     str(identical),
+                     '{:.1e}'.format(max_rel_err)])
+
+        del equity_returns, bond_returns, allocation_matrix, contribution_matrix, results
+
+    common.print_table(['sims', 'loop (s)', 'inplace (s)', 'cumulative (s)', 'inplace speedup',
+                        'cumulative speedup', 'inplace identical', 'cumulative max rel err'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sims', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.sims, args.repeats)